@@ -1,22 +1,88 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, g, send_file
 from db import (
-    init_db, add_keycap, get_keycaps, update_keycap, delete_keycap,
-    store_scrape_results, get_latest_scrape, compare_with_collection
+    init_db, add_keycap, iter_keycaps, update_keycap, delete_keycap,
+    bulk_upsert_keycaps, add_missing_keycaps,
+    store_scrape_results, store_all_scrape_results, get_latest_scrape_stamp, get_latest_scrape_time,
+    get_latest_scrape_id, get_scrape_products, get_collection_version, get_scrape_changes, compare_with_collection,
+    get_price_history
+)
+from scraper import scrape_all, scrape_vendor
+from images import get_image_cache, pick_width
+from scheduler import ScrapeScheduler
+from metrics import timed, render_prometheus
+from logs import configure_logging, log_fields
+from events import stream_events, parse_last_event_id
+from serializers import (
+    parse_keycap_query, parse_export_query, parse_compare_query, parse_changes_query, parse_history_query,
+    keycap_error, keycap_writer, export_writer, stream_rows, valid_import_rows, import_format,
+    with_prices, with_thumbnails
+)
+from web import (
+    CachedRequest, IMAGE_MAX_AGE, IMAGE_ERRORS, KEYCAP_MIMETYPES, EXPORT_MIMETYPES, error, server_error,
+    vendor_arg, known_vendor, unknown_vendor, record_request_metrics, keycaps_cache_key, compare_cache_key,
+    drops_cache_key, first_checked, export_headers, refresh_wanted, drops_headers, parse_image_request,
+    image_headers, event_stream_headers, debug_scrape_body
 )
-from scraper import scrape_s_craft
 import os
+import time
 import logging
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Set up logging: level-gated, written from a background thread (see logs.py)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# Start the background scrape scheduler once this process serves requests;
+# tools that import the app (benchmarks, test clients) set this to False
+app.config['SCRAPE_SCHEDULER'] = os.getenv('SCRAPE_SCHEDULER', 'true').lower() == 'true'
 
 # Initialize MongoDB connection
 if not init_db():
     logger.error("Failed to initialize database connection")
 
+# Background refresh of every vendor's drops
+scheduler = ScrapeScheduler(scrape_all, store_all_scrape_results, get_latest_scrape_time)
+
+@app.before_request
+def start_scheduler():
+    """Start the scrape scheduler with the first request served, unless disabled or testing."""
+    if not scheduler.is_started() and app.config['SCRAPE_SCHEDULER'] and not app.testing:
+        scheduler.start()
+
+@app.before_request
+def start_request_timer():
+    """Record when the request started for latency metrics."""
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_metrics(response):
+    """Record per-route latency and status counts."""
+    record_request_metrics(request, response, g.pop('request_start', None))
+    return response
+
+def _timed_jsonify(data):
+    """jsonify data, recording serialization time."""
+    with timed("serialize"):
+        return jsonify(data)
+
+def _cached_response(cached, mimetype):
+    """Answer a request from the response cache: a 304, or the cached body in the client's preferred encoding."""
+    if cached.not_modified:
+        return cached.finish(Response(status=304))
+    body, encoding = cached.body()
+    return cached.finish(Response(body, mimetype=mimetype), encoding)
+
+def _cached_json(key, build):
+    """Answer from the response cache, building and caching the JSON body on a miss.
+
+    Returns 304 without building anything when the client's ETag matches.
+    """
+    cached = CachedRequest(key, request)
+    if not cached.answered:
+        with timed("serialize"):
+            cached.store(app.json.dumps(build()).encode('utf-8'))
+    return _cached_response(cached, 'application/json')
+
 @app.route('/')
 def index():
     """Render the main page."""
@@ -27,34 +93,78 @@ def handle_keycaps():
     """Handle keycap collection operations."""
     try:
         if request.method == 'GET':
-            vendor = request.args.get('vendor')
-            logger.info(f"GET request for keycaps with vendor: {vendor}")
-            keycaps = get_keycaps(vendor)
-            logger.info(f"Found {len(keycaps)} keycaps")
-            # Convert ObjectId to string for JSON serialization
-            for keycap in keycaps:
-                keycap['_id'] = str(keycap['_id'])
-            return jsonify(keycaps)
+            query, message = parse_keycap_query(request.args)
+            if message:
+                return error(message)
+            limit = query["limit"]
+            log_fields(logger, logging.DEBUG, "GET keycaps", vendor=query["vendor"], after=query["after"], limit=limit)
+            
+            cached = CachedRequest(keycaps_cache_key(query, get_collection_version()), request)
+            mimetype = KEYCAP_MIMETYPES[query["format"]]
+            if cached.answered:
+                return _cached_response(cached, mimetype)
+            
+            # Fetch one extra document to learn whether another page exists
+            keycaps = first_checked(iter_keycaps(query["vendor"], query["after"], limit + 1 if limit else None,
+                                                 query["fields"]))
+            body = stream_rows(keycap_writer(query["format"], limit), keycaps)
+            # Stream the first response uncompressed and cache it for the next one
+            return cached.finish(Response(cached.tee(body), mimetype=mimetype))
         
         elif request.method == 'POST':
             data = request.json
-            logger.info(f"POST request with data: {data}")
-            if not data:
-                logger.error("No data provided in POST request")
-                return jsonify({"error": "No data provided"}), 400
-            
-            # Ensure required fields
-            if not data.get('name') or not data.get('vendor'):
-                logger.error("Missing required fields")
-                return jsonify({"error": "Name and vendor are required"}), 400
+            # Log field names only; bodies can be large and belong to the user
+            log_fields(logger, logging.DEBUG, "POST keycaps", fields=sorted(data) if isinstance(data, dict) else None)
+            message = keycap_error(data)
+            if message:
+                logger.error(f"Rejected POST keycaps: {message}")
+                return error(message)
             
             keycap_id = add_keycap(data)
-            logger.info(f"Added keycap with ID: {keycap_id}")
+            logger.info("Added keycap with ID: %s", keycap_id)
             return jsonify({"id": keycap_id}), 201
             
     except Exception as e:
-        logger.error(f"Error in handle_keycaps: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return server_error(logger, "handle_keycaps", e)
+
+@app.route('/api/keycaps/import', methods=['POST'])
+def import_keycaps():
+    """Bulk import keycaps from NDJSON or CSV, upserting by name."""
+    try:
+        input_format = import_format(request.args.get('format'), request.mimetype)
+        if input_format is None:
+            return error("format must be ndjson or csv")
+        
+        errors = []
+        summary = bulk_upsert_keycaps(valid_import_rows(request.stream, input_format, errors))
+        summary["errors"] = sorted(errors + summary["errors"], key=lambda row_error: row_error["row"])
+        return jsonify(summary)
+    except Exception as e:
+        return server_error(logger, "import_keycaps", e)
+
+@app.route('/api/keycaps/export')
+def export_keycaps():
+    """Stream the whole collection as NDJSON or CSV."""
+    try:
+        query, message = parse_export_query(request.args)
+        if message:
+            return error(message)
+        keycaps = first_checked(iter_keycaps(query["vendor"], fields=query["fields"]))
+        body = stream_rows(export_writer(query["format"], query["fields"]), keycaps)
+        return Response(body, mimetype=EXPORT_MIMETYPES[query["format"]], headers=export_headers(query["format"]))
+    except Exception as e:
+        return server_error(logger, "export_keycaps", e)
+
+@app.route('/api/keycaps/add-missing', methods=['POST'])
+def add_missing():
+    """Add every drop missing from the collection in one bulk write."""
+    try:
+        vendor = vendor_arg(request)
+        if vendor is None:
+            return unknown_vendor()
+        return jsonify(add_missing_keycaps(vendor))
+    except Exception as e:
+        return server_error(logger, "add_missing", e)
 
 @app.route('/api/keycaps/<keycap_id>', methods=['PUT', 'DELETE'])
 def handle_keycap(keycap_id):
@@ -63,7 +173,7 @@ def handle_keycap(keycap_id):
         if request.method == 'PUT':
             updates = request.json
             if not updates:
-                return jsonify({"error": "No updates provided"}), 400
+                return error("No updates provided")
             success = update_keycap(keycap_id, updates)
             return jsonify({"success": success})
         
@@ -72,56 +182,118 @@ def handle_keycap(keycap_id):
             return jsonify({"success": success})
             
     except Exception as e:
-        logger.error(f"Error in handle_keycap: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return server_error(logger, "handle_keycap", e)
 
 @app.route('/api/compare')
 def compare_items():
-    """Compare scraped items with collection."""
+    """Compare a vendor's scraped items with collection."""
     try:
-        comparison_results = compare_with_collection()
-        return jsonify(comparison_results)
+        vendor = vendor_arg(request)
+        if vendor is None:
+            return unknown_vendor()
+        query, message = parse_compare_query(request.args)
+        if message:
+            return error(message)
+        key = compare_cache_key(vendor, query, get_latest_scrape_id(vendor), get_collection_version())
+        return _cached_json(key, lambda: compare_with_collection(query["offset"], query["limit"], vendor))
     except Exception as e:
-        logger.error(f"Error in compare_items: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return server_error(logger, "compare_items", e)
 
 @app.route('/api/drops')
 def get_drops():
-    """Get the latest S-Craft drops."""
+    """Get a vendor's latest drops, refreshing them in the background when stale."""
     try:
-        force_scrape = request.args.get('force', '').lower() == 'true'
+        vendor = vendor_arg(request)
+        if vendor is None:
+            return unknown_vendor()
         
-        if force_scrape:
-            # Perform new scrape
-            drops = scrape_s_craft()
-            if drops:
-                store_scrape_results(drops)
-        else:
-            # Get latest stored scrape
-            drops = get_latest_scrape()
-            if not drops:
-                # If no stored scrape exists, perform new scrape
-                drops = scrape_s_craft()
-                if drops:
-                    store_scrape_results(drops)
+        # Always answer from the latest stored scrape
+        latest = get_latest_scrape_stamp(vendor)
         
-        return jsonify(drops)
+        age = scheduler.data_age(latest["scraped_at"] if latest else None)
+        if refresh_wanted(request, age, scheduler.interval):
+            # Coalesced into the in-flight scrape if one is already running
+            scheduler.refresh()
+        
+        key = drops_cache_key(vendor, latest["id"] if latest else None)
+        response = _cached_json(key, lambda: with_thumbnails(with_prices(get_scrape_products(latest["id"]), vendor)) if latest else [])
+        return drops_headers(response, age, scheduler.is_running())
     except Exception as e:
-        logger.error(f"Error in get_drops: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        return server_error(logger, "get_drops", e)
+
+@app.route('/img/<url_hash>')
+def serve_image(url_hash):
+    """Serve a resized, cached copy of a scraped product image."""
+    image = parse_image_request(url_hash, request)
+    if image is None:
+        return error("Image not found", 404)
+    
+    try:
+        thumbnail = get_image_cache().thumbnail(url_hash, pick_width(image["width"]), image["format"])
+    except IMAGE_ERRORS as e:
+        logger.error(f"Error fetching image {url_hash}: {str(e)}")
+        return error("Could not fetch image", 502)
+    if thumbnail is None:
+        return error("Image not found", 404)
+    
+    response = send_file(thumbnail["path"], mimetype=thumbnail["mimetype"], etag=thumbnail["etag"],
+                         conditional=True, max_age=IMAGE_MAX_AGE)
+    return image_headers(response)
+
+@app.route('/api/drops/stream')
+def stream_drops():
+    """Stream a vendor's scrape progress and drop changes as server-sent events."""
+    vendor = vendor_arg(request)
+    if vendor is None:
+        return unknown_vendor()
+    last_event_id = parse_last_event_id(request.headers.get('Last-Event-ID'))
+    return event_stream_headers(Response(stream_events(vendor, last_event_id), mimetype='text/event-stream'))
+
+@app.route('/api/drops/changes')
+def get_drop_changes():
+    """Get the products added, removed and changed by recent scrapes."""
+    try:
+        vendor = request.args.get('vendor')
+        if not known_vendor(vendor):
+            return unknown_vendor()
+        query, message = parse_changes_query(request.args)
+        if message:
+            return error(message)
+        return _timed_jsonify(get_scrape_changes(query["limit"], vendor))
+    except Exception as e:
+        return server_error(logger, "get_drop_changes", e)
+
+@app.route('/api/products/<path:name>/history')
+def get_product_history(name):
+    """Get a scraped product's price points over time, optionally within a time range or for one batch."""
+    try:
+        vendor = vendor_arg(request)
+        if vendor is None:
+            return unknown_vendor()
+        query, message = parse_history_query(request.args)
+        if message:
+            return error(message)
+        points = get_price_history(name, vendor, query["start"], query["end"], query["batch"])
+        return _timed_jsonify({"name": name, "vendor": vendor, "points": points})
+    except Exception as e:
+        return server_error(logger, "get_product_history", e)
+
+@app.route('/api/metrics')
+def get_metrics():
+    """Expose latency histograms and counters in Prometheus text format."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/debug/scraper')
 def debug_scraper():
     """Debug endpoint to test the scraper directly."""
     try:
-        drops = scrape_s_craft()
+        vendor = vendor_arg(request)
+        if vendor is None:
+            return unknown_vendor()
+        drops = scrape_vendor(vendor)
         if drops:
-            store_scrape_results(drops)
-        return jsonify({
-            "status": "success",
-            "count": len(drops),
-            "drops": drops[:5]  # Return first 5 items for debugging
-        })
+            store_scrape_results(drops, vendor)
+        return jsonify(debug_scrape_body(vendor, drops))
     except Exception as e:
         logger.error(f"Error in debug_scraper: {str(e)}")
         return jsonify({
@@ -130,4 +302,4 @@ def debug_scraper():
         }), 500
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
+    app.run(debug=True, port=5001, threaded=True)
@@ -0,0 +1,348 @@
+from quart import Quart, Response, render_template, jsonify, request, g, send_file
+from db import (
+    init_db, add_keycap, update_keycap, delete_keycap,
+    bulk_upsert_keycaps, add_missing_keycaps,
+    store_scrape_results, store_all_scrape_results, get_latest_scrape_time,
+    get_scrape_changes, compare_with_collection,
+    get_price_history
+)
+from async_db import (
+    init_db_async, close_db_async, iter_keycaps_async, get_scrape_products_async,
+    get_latest_scrape_stamp_async, get_collection_version_async
+)
+from scraper import scrape_all, scrape_all_async, scrape_vendor
+from fetcher import HAS_HTTPX
+from images import get_image_cache, pick_width
+from scheduler import ScrapeScheduler
+from metrics import timed, render_prometheus
+from logs import configure_logging, log_fields
+from events import stream_events_async, parse_last_event_id
+from serializers import (
+    parse_keycap_query, parse_export_query, parse_compare_query, parse_changes_query, parse_history_query,
+    keycap_error, keycap_writer, export_writer, stream_rows_async, valid_import_rows, import_format,
+    with_prices, with_thumbnails
+)
+from web import (
+    CachedRequest, IMAGE_MAX_AGE, IMAGE_ERRORS, KEYCAP_MIMETYPES, EXPORT_MIMETYPES, error, server_error,
+    vendor_arg, known_vendor, unknown_vendor, record_request_metrics, keycaps_cache_key, compare_cache_key,
+    drops_cache_key, first_checked_async, export_headers, refresh_wanted, drops_headers, parse_image_request,
+    image_headers, event_stream_headers, debug_scrape_body
+)
+import asyncio
+import io
+import os
+import time
+import logging
+
+# Async serving path: the same API as app.py on an ASGI server, e.g.
+#   hypercorn asgi:app --bind 0.0.0.0:5002
+# Collection and drop reads use Motor on the event loop. Writes, compare
+# and image resizing reuse db.py/images.py and run in worker threads, and
+# scrapes run on the scheduler's own thread and event loop, so a slow
+# scrape never holds up a request. Request parsing, caching and response
+# headers are shared with app.py through serializers.py and web.py.
+
+# Set up logging: level-gated, written from a background thread (see logs.py)
+configure_logging()
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__)
+# Start the background scrape scheduler when serving begins; tools that
+# serve the app in process set this to False
+app.config['SCRAPE_SCHEDULER'] = os.getenv('SCRAPE_SCHEDULER', 'true').lower() == 'true'
+
+def scrape_all_vendors(batches=None):
+    """Scrape every vendor (or just the given batches) with the async fetcher on the calling thread's own event loop."""
+    if not HAS_HTTPX:
+        return scrape_all(batches=batches)
+    return asyncio.run(scrape_all_async(batches=batches))
+
+# Background refresh of every vendor's drops
+scheduler = ScrapeScheduler(scrape_all_vendors, store_all_scrape_results, get_latest_scrape_time)
+
+@app.before_serving
+async def startup():
+    """Connect both MongoDB clients and start the scrape scheduler."""
+    # pymongo setup creates collections and indexes, keep it off the event loop
+    if not await run_sync(init_db):
+        logger.error("Failed to initialize database connection")
+    if not await init_db_async():
+        logger.error("Failed to initialize async database connection")
+    if app.config['SCRAPE_SCHEDULER'] and not app.testing:
+        scheduler.start()
+
+@app.after_serving
+async def shutdown():
+    scheduler.stop()
+    close_db_async()
+
+@app.before_request
+async def start_request_timer():
+    """Record when the request started for latency metrics."""
+    g.request_start = time.perf_counter()
+
+@app.after_request
+async def record_metrics(response):
+    """Record per-route latency and status counts."""
+    record_request_metrics(request, response, g.pop('request_start', None))
+    return response
+
+def run_sync(func, *args, **kwargs):
+    """Run a blocking db/images call in a worker thread."""
+    return asyncio.to_thread(func, *args, **kwargs)
+
+def _timed_jsonify(data):
+    """jsonify data, recording serialization time."""
+    with timed("serialize"):
+        return jsonify(data)
+
+def _cached_response(cached, mimetype):
+    """Answer a request from the response cache; see app._cached_response."""
+    if cached.not_modified:
+        return cached.finish(Response('', status=304))
+    body, encoding = cached.body()
+    return cached.finish(Response(body, mimetype=mimetype), encoding)
+
+async def _cached_json(key, build):
+    """Answer from the response cache, building and caching the JSON body on a miss; see app._cached_json."""
+    cached = CachedRequest(key, request)
+    if not cached.answered:
+        data = await build()
+        with timed("serialize"):
+            body = app.json.dumps(data).encode('utf-8')
+        # Compressing a large body is CPU-bound, keep it off the event loop
+        await run_sync(cached.store, body)
+    return _cached_response(cached, 'application/json')
+
+@app.route('/')
+async def index():
+    """Render the main page."""
+    return await render_template('index.html')
+
+@app.route('/api/keycaps', methods=['GET', 'POST'])
+async def handle_keycaps():
+    """Handle keycap collection operations."""
+    try:
+        if request.method == 'GET':
+            query, message = parse_keycap_query(request.args)
+            if message:
+                return error(message)
+            limit = query["limit"]
+            log_fields(logger, logging.DEBUG, "GET keycaps", vendor=query["vendor"], after=query["after"], limit=limit)
+
+            cached = CachedRequest(keycaps_cache_key(query, await get_collection_version_async()), request)
+            mimetype = KEYCAP_MIMETYPES[query["format"]]
+            if cached.answered:
+                return _cached_response(cached, mimetype)
+
+            # Fetch one extra document to learn whether another page exists
+            keycaps = await first_checked_async(
+                iter_keycaps_async(query["vendor"], query["after"], limit + 1 if limit else None, query["fields"])
+            )
+            body = stream_rows_async(keycap_writer(query["format"], limit), keycaps)
+            # Stream the first response uncompressed and cache it for the next one
+            return cached.finish(Response(cached.tee_async(body), mimetype=mimetype))
+
+        elif request.method == 'POST':
+            data = await request.get_json()
+            # Log field names only; bodies can be large and belong to the user
+            log_fields(logger, logging.DEBUG, "POST keycaps", fields=sorted(data) if isinstance(data, dict) else None)
+            message = keycap_error(data)
+            if message:
+                logger.error(f"Rejected POST keycaps: {message}")
+                return error(message)
+
+            keycap_id = await run_sync(add_keycap, data)
+            logger.info("Added keycap with ID: %s", keycap_id)
+            return jsonify({"id": keycap_id}), 201
+
+    except Exception as e:
+        return server_error(logger, "handle_keycaps", e)
+
+@app.route('/api/keycaps/import', methods=['POST'])
+async def import_keycaps():
+    """Bulk import keycaps from NDJSON or CSV, upserting by name."""
+    try:
+        input_format = import_format(request.args.get('format'), request.mimetype)
+        if input_format is None:
+            return error("format must be ndjson or csv")
+
+        body = await request.get_data()
+        errors = []
+        summary = await run_sync(bulk_upsert_keycaps, valid_import_rows(io.BytesIO(body), input_format, errors))
+        summary["errors"] = sorted(errors + summary["errors"], key=lambda row_error: row_error["row"])
+        return jsonify(summary)
+    except Exception as e:
+        return server_error(logger, "import_keycaps", e)
+
+@app.route('/api/keycaps/export')
+async def export_keycaps():
+    """Stream the whole collection as NDJSON or CSV."""
+    try:
+        query, message = parse_export_query(request.args)
+        if message:
+            return error(message)
+        keycaps = await first_checked_async(iter_keycaps_async(query["vendor"], fields=query["fields"]))
+        body = stream_rows_async(export_writer(query["format"], query["fields"]), keycaps)
+        return Response(body, mimetype=EXPORT_MIMETYPES[query["format"]], headers=export_headers(query["format"]))
+    except Exception as e:
+        return server_error(logger, "export_keycaps", e)
+
+@app.route('/api/keycaps/add-missing', methods=['POST'])
+async def add_missing():
+    """Add every drop missing from the collection in one bulk write."""
+    try:
+        vendor = vendor_arg(request)
+        if vendor is None:
+            return unknown_vendor()
+        return jsonify(await run_sync(add_missing_keycaps, vendor))
+    except Exception as e:
+        return server_error(logger, "add_missing", e)
+
+@app.route('/api/keycaps/<keycap_id>', methods=['PUT', 'DELETE'])
+async def handle_keycap(keycap_id):
+    """Handle individual keycap operations."""
+    try:
+        if request.method == 'PUT':
+            updates = await request.get_json()
+            if not updates:
+                return error("No updates provided")
+            success = await run_sync(update_keycap, keycap_id, updates)
+            return jsonify({"success": success})
+
+        elif request.method == 'DELETE':
+            success = await run_sync(delete_keycap, keycap_id)
+            return jsonify({"success": success})
+
+    except Exception as e:
+        return server_error(logger, "handle_keycap", e)
+
+@app.route('/api/compare')
+async def compare_items():
+    """Compare a vendor's scraped items with collection."""
+    try:
+        vendor = vendor_arg(request)
+        if vendor is None:
+            return unknown_vendor()
+        query, message = parse_compare_query(request.args)
+        if message:
+            return error(message)
+        latest = await get_latest_scrape_stamp_async(vendor)
+        key = compare_cache_key(vendor, query, latest["id"] if latest else None, await get_collection_version_async())
+        return await _cached_json(
+            key, lambda: run_sync(compare_with_collection, query["offset"], query["limit"], vendor)
+        )
+    except Exception as e:
+        return server_error(logger, "compare_items", e)
+
+@app.route('/api/drops')
+async def get_drops():
+    """Get a vendor's latest drops, refreshing them in the background when stale."""
+    try:
+        vendor = vendor_arg(request)
+        if vendor is None:
+            return unknown_vendor()
+
+        # Always answer from the latest stored scrape
+        latest = await get_latest_scrape_stamp_async(vendor)
+
+        age = scheduler.data_age(latest["scraped_at"]) if latest else await run_sync(scheduler.data_age)
+        if refresh_wanted(request, age, scheduler.interval):
+            # Coalesced into the in-flight scrape if one is already running
+            scheduler.refresh()
+
+        async def build():
+            return with_thumbnails(with_prices(await get_scrape_products_async(latest["id"]), vendor)) if latest else []
+
+        response = await _cached_json(drops_cache_key(vendor, latest["id"] if latest else None), build)
+        return drops_headers(response, age, scheduler.is_running())
+    except Exception as e:
+        return server_error(logger, "get_drops", e)
+
+@app.route('/img/<url_hash>')
+async def serve_image(url_hash):
+    """Serve a resized, cached copy of a scraped product image."""
+    image = parse_image_request(url_hash, request)
+    if image is None:
+        return error("Image not found", 404)
+
+    try:
+        thumbnail = await run_sync(get_image_cache().thumbnail, url_hash, pick_width(image["width"]), image["format"])
+    except IMAGE_ERRORS as e:
+        logger.error(f"Error fetching image {url_hash}: {str(e)}")
+        return error("Could not fetch image", 502)
+    if thumbnail is None:
+        return error("Image not found", 404)
+
+    # Quart's send_file derives its ETag from the file, so set ours before the conditional check
+    response = await send_file(thumbnail["path"], mimetype=thumbnail["mimetype"], add_etags=False,
+                               cache_timeout=IMAGE_MAX_AGE)
+    response.set_etag(thumbnail["etag"])
+    await response.make_conditional(request, accept_ranges=True, complete_length=response.content_length)
+    return image_headers(response)
+
+@app.route('/api/drops/stream')
+async def stream_drops():
+    """Stream a vendor's scrape progress and drop changes as server-sent events."""
+    vendor = vendor_arg(request)
+    if vendor is None:
+        return unknown_vendor()
+    last_event_id = parse_last_event_id(request.headers.get('Last-Event-ID'))
+    response = Response(stream_events_async(vendor, last_event_id), mimetype='text/event-stream')
+    response.timeout = None  # Streams stay open until the client goes away
+    return event_stream_headers(response)
+
+@app.route('/api/drops/changes')
+async def get_drop_changes():
+    """Get the products added, removed and changed by recent scrapes."""
+    try:
+        vendor = request.args.get('vendor')
+        if not known_vendor(vendor):
+            return unknown_vendor()
+        query, message = parse_changes_query(request.args)
+        if message:
+            return error(message)
+        return _timed_jsonify(await run_sync(get_scrape_changes, query["limit"], vendor))
+    except Exception as e:
+        return server_error(logger, "get_drop_changes", e)
+
+@app.route('/api/products/<path:name>/history')
+async def get_product_history(name):
+    """Get a scraped product's price points over time, optionally within a time range or for one batch."""
+    try:
+        vendor = vendor_arg(request)
+        if vendor is None:
+            return unknown_vendor()
+        query, message = parse_history_query(request.args)
+        if message:
+            return error(message)
+        points = await run_sync(get_price_history, name, vendor, query["start"], query["end"], query["batch"])
+        return _timed_jsonify({"name": name, "vendor": vendor, "points": points})
+    except Exception as e:
+        return server_error(logger, "get_product_history", e)
+
+@app.route('/api/metrics')
+async def get_metrics():
+    """Expose latency histograms and counters in Prometheus text format."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/debug/scraper')
+async def debug_scraper():
+    """Debug endpoint to test the scraper directly."""
+    try:
+        vendor = vendor_arg(request)
+        if vendor is None:
+            return unknown_vendor()
+        drops = await run_sync(scrape_vendor, vendor)
+        if drops:
+            await run_sync(store_scrape_results, drops, vendor)
+        return jsonify(debug_scrape_body(vendor, drops))
+    except Exception as e:
+        logger.error(f"Error in debug_scraper: {str(e)}")
+        return jsonify({
+            "status": "error",
+            "error": str(e)
+        }), 500
+
+if __name__ == '__main__':
+    app.run(port=5002)
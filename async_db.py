@@ -0,0 +1,117 @@
+from bson.objectid import ObjectId
+from typing import List, Dict, Optional, AsyncIterator
+import asyncio
+import os
+import logging
+import db
+from db import MAX_POOL_SIZE, MIN_POOL_SIZE, MAX_IDLE_TIME_MS, WAIT_QUEUE_TIMEOUT_MS
+from vendors import DEFAULT_VENDOR
+
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient
+    HAS_MOTOR = True
+except ImportError:
+    HAS_MOTOR = False
+
+logger = logging.getLogger(__name__)
+
+# Motor connection used by the ASGI app for reads. Writes, compare and
+# snapshot rebuilds share db.py's pymongo logic and run in worker threads.
+client = None
+keycaps_collection = None
+scrapes_collection = None
+meta_collection = None
+
+async def init_db_async(uri: str = None) -> bool:
+    """Connect Motor to MongoDB with the same pool settings as db.init_db.
+
+    Must be called from the event loop that serves requests. Collections
+    and indexes are created by db.init_db.
+    """
+    global client, keycaps_collection, scrapes_collection, meta_collection
+    if not HAS_MOTOR:
+        logger.error("motor is not installed, async reads are unavailable")
+        return False
+    try:
+        if uri is None:
+            uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
+        if client is not None:
+            client.close()
+
+        logger.info(f"Connecting Motor to MongoDB at {uri} (pool size {MIN_POOL_SIZE}-{MAX_POOL_SIZE})")
+        client = AsyncIOMotorClient(
+            uri,
+            serverSelectionTimeoutMS=5000,
+            connectTimeoutMS=5000,
+            socketTimeoutMS=5000,
+            maxPoolSize=MAX_POOL_SIZE,
+            minPoolSize=MIN_POOL_SIZE,
+            maxIdleTimeMS=MAX_IDLE_TIME_MS,
+            waitQueueTimeoutMS=WAIT_QUEUE_TIMEOUT_MS,
+            retryWrites=True,
+            event_listeners=[db._CommandTimer()]
+        )
+        await client.admin.command('ping')
+        keycaps_collection = client.keycapvault.keycaps
+        scrapes_collection = client.keycapvault.scrapes
+        meta_collection = client.keycapvault.meta
+        logger.info("Motor connected to MongoDB")
+        return True
+    except Exception as e:
+        logger.error(f"Failed to initialize Motor connection: {str(e)}")
+        return False
+
+def close_db_async():
+    """Close the Motor connection pool."""
+    global client
+    if client is not None:
+        client.close()
+        client = None
+
+async def iter_keycaps_async(vendor: Optional[str] = None, after: Optional[str] = None,
+                             limit: Optional[int] = None, fields: Optional[List[str]] = None) -> AsyncIterator[Dict]:
+    """Iterate keycaps in _id order without blocking the event loop; see db.iter_keycaps."""
+    try:
+        query = {"vendor": vendor} if vendor else {}
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+        projection = {field: 1 for field in fields} if fields else None
+        logger.debug("Querying keycaps with filter: %s", query)
+
+        cursor = keycaps_collection.find(query, projection).sort("_id", 1)
+        if limit:
+            cursor = cursor.limit(limit)
+        async for keycap in cursor:
+            yield keycap
+    except Exception as e:
+        logger.error(f"Error getting keycaps: {str(e)}")
+        raise
+
+async def get_scrape_products_async(scrape_id) -> List[Dict]:
+    """Get a scrape's products; see db.get_scrape_products.
+
+    The snapshot usually comes from db's in-memory cache. Rebuilding it from
+    deltas runs in a worker thread.
+    """
+    products = db._cached_snapshot(scrape_id)
+    if products is None:
+        products = await asyncio.to_thread(db.get_scrape_products, scrape_id)
+    return products
+
+async def get_latest_scrape_stamp_async(vendor: str = DEFAULT_VENDOR) -> Optional[Dict]:
+    """Get the id and timestamp of a vendor's most recent scrape; see db.get_latest_scrape_stamp."""
+    try:
+        latest_scrape = await scrapes_collection.find_one(
+            db._vendor_filter(vendor),
+            sort=[("scraped_at", -1)],
+            projection={"_id": 1, "scraped_at": 1}
+        )
+        return {"id": latest_scrape["_id"], "scraped_at": latest_scrape["scraped_at"]} if latest_scrape else None
+    except Exception as e:
+        logger.error(f"Error retrieving latest scrape stamp: {str(e)}")
+        raise
+
+async def get_collection_version_async() -> int:
+    """Get the keycap collection write counter; see db.get_collection_version."""
+    counter = await meta_collection.find_one({"_id": "collection_version"})
+    return counter["value"] if counter else 0
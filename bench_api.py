@@ -0,0 +1,112 @@
+"""API load test comparing the WSGI (app.py) and ASGI (asgi.py) serving paths.
+
+Start both servers against the same database, then point the load test at them:
+
+    python app.py                                      # WSGI on :5001
+    hypercorn asgi:app --bind 127.0.0.1:5002           # ASGI on :5002
+    python bench_api.py --concurrency 50 --duration 20
+    python bench_api.py --scrape                       # keep a scraper request in flight during the run
+
+Each target gets the same request mix and reports requests per second and
+p50/p95/p99 latency. With --scrape one extra client loops on
+/api/debug/scraper so reads are measured while a scrape is running; its
+requests are not counted.
+"""
+from typing import Dict, List
+import argparse
+import asyncio
+import time
+import logging
+
+import httpx
+
+DEFAULT_TARGETS = ['wsgi=http://127.0.0.1:5001', 'asgi=http://127.0.0.1:5002']
+DEFAULT_PATHS = ['/api/keycaps?limit=50', '/api/drops', '/api/compare?limit=50']
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+async def run_target(base_url: str, paths: List[str], concurrency: int, duration: float,
+                     warmup: float, scrape: bool) -> Dict:
+    """Hammer one server with concurrency clients for duration seconds."""
+    limits = httpx.Limits(max_connections=concurrency + 1, max_keepalive_connections=concurrency + 1)
+    latencies = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+    scrapes = 0
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=60.0, limits=limits) as client:
+        measure_from = time.perf_counter() + warmup
+        stop_at = measure_from + duration
+
+        async def worker(offset: int):
+            turn = offset
+            while time.perf_counter() < stop_at:
+                path = paths[turn % len(paths)]
+                turn += 1
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path)
+                    failed = response.status_code >= 500
+                except httpx.HTTPError:
+                    failed = True
+                if start < measure_from:
+                    continue
+                if failed:
+                    errors[path] += 1
+                else:
+                    latencies[path].append(time.perf_counter() - start)
+
+        async def scraper():
+            nonlocal scrapes
+            while time.perf_counter() < stop_at:
+                try:
+                    await client.get('/api/debug/scraper')
+                    scrapes += 1
+                except httpx.HTTPError:
+                    await asyncio.sleep(1)
+
+        tasks = [worker(i) for i in range(concurrency)]
+        if scrape:
+            tasks.append(scraper())
+        await asyncio.gather(*tasks)
+
+    return {"latencies": latencies, "errors": errors, "duration": duration, "scrapes": scrapes}
+
+def report(name: str, result: Dict):
+    """Print throughput and tail latency overall and per path."""
+    rows = [("all", sorted(l for values in result["latencies"].values() for l in values), sum(result["errors"].values()))]
+    rows += [(path, sorted(values), result["errors"][path]) for path, values in result["latencies"].items()]
+    scrapes = f", {result['scrapes']} scrapes completed" if result["scrapes"] else ""
+    print(f"\n{name}{scrapes}")
+    print(f"  {'path':<32} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8} {'errors':>7}")
+    for path, values, error_count in rows:
+        print(f"  {path:<32} {len(values) / result['duration']:8.1f} {percentile(values, 50) * 1000:8.1f} "
+              f"{percentile(values, 95) * 1000:8.1f} {percentile(values, 99) * 1000:8.1f} "
+              f"{(values[-1] if values else 0.0) * 1000:8.1f} {error_count:7d}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--target', action='append', metavar='NAME=URL',
+                        help=f"server to test, repeatable (default: {' '.join(DEFAULT_TARGETS)})")
+    parser.add_argument('--path', action='append', help=f"request path, repeatable (default: {' '.join(DEFAULT_PATHS)})")
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=15.0, help='measured seconds per target')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds before each run')
+    parser.add_argument('--scrape', action='store_true', help='keep a scraper request in flight during the run')
+    args = parser.parse_args()
+
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    paths = args.path or DEFAULT_PATHS
+    for target in args.target or DEFAULT_TARGETS:
+        name, _, base_url = target.partition('=')
+        if not base_url:
+            name, base_url = target, target
+        result = asyncio.run(run_target(base_url, paths, args.concurrency, args.duration, args.warmup, args.scrape))
+        report(f"{name} ({base_url}), {args.concurrency} clients", result)
+
+if __name__ == '__main__':
+    main()
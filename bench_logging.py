@@ -0,0 +1,81 @@
+"""/api/compare latency with lean and verbose logging.
+
+Runs the Flask app in process against the configured database (which needs a
+stored scrape, e.g. from a previous `python app.py` run) and times
+/api/compare under each logging mode:
+
+    python bench_logging.py --requests 500
+    python bench_logging.py --cold --requests 100      # recompute the comparison on every request
+
+lean is the default setup: INFO level, per-item debug messages sampled and
+records written by a background thread. verbose logs everything at DEBUG,
+every item, synchronously on the request thread. Log output goes to
+--log-file so terminal speed does not skew the numbers; with --cold the
+cached comparison is dropped before each request, so the per-product
+matching (and its per-item logging) runs every time.
+"""
+import db
+import app as app_module
+from bench_api import percentile
+from logs import configure_logging
+from response_cache import response_cache
+from typing import Dict, List
+import argparse
+import os
+import tempfile
+import time
+
+MODES = {
+    "lean": {"level": "INFO", "use_queue": True},
+    "verbose": {"level": "DEBUG", "use_queue": False, "sample_every": 1},
+}
+
+def run_mode(client, settings: Dict, path: str, requests: int, warmup: int, cold: bool, log_file) -> List[float]:
+    """Time requests to path under one logging mode, returning sorted latencies in seconds."""
+    configure_logging(stream=log_file, **settings)
+    latencies = []
+    for i in range(warmup + requests):
+        # Every request builds its body; only the materialized comparison is reused unless cold
+        response_cache.clear()
+        if cold:
+            with db._comparison_lock:
+                db._comparisons.clear()
+        start = time.perf_counter()
+        response = client.get(path)
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise RuntimeError(f"{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        if i >= warmup:
+            latencies.append(elapsed)
+    return sorted(latencies)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--path', default='/api/compare', help='request path')
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per mode')
+    parser.add_argument('--warmup', type=int, default=10, help='unmeasured requests before each mode')
+    parser.add_argument('--cold', action='store_true', help='recompute the comparison on every request')
+    parser.add_argument('--log-file', default=os.path.join(tempfile.gettempdir(), 'bench_logging.log'),
+                        help='where log output is written')
+    args = parser.parse_args()
+
+    # No background scrapes while the benchmark runs
+    app_module.app.config['SCRAPE_SCHEDULER'] = False
+    client = app_module.app.test_client()
+    results = {}
+    with open(args.log_file, 'w') as log_file:
+        for name, settings in MODES.items():
+            before = log_file.tell()
+            latencies = run_mode(client, settings, args.path, args.requests, args.warmup, args.cold, log_file)
+            configure_logging(stream=log_file, use_queue=False)  # Flush the writer thread before measuring output
+            results[name] = (latencies, log_file.tell() - before)
+
+    print(f"\n{args.path}, {args.requests} requests per mode{' (cold)' if args.cold else ''}")
+    print(f"  {'mode':<10} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'log KB':>8}")
+    for name, (latencies, log_bytes) in results.items():
+        total = sum(latencies)
+        print(f"  {name:<10} {len(latencies) / total if total else 0.0:8.1f} {percentile(latencies, 50) * 1000:8.1f} "
+              f"{percentile(latencies, 95) * 1000:8.1f} {percentile(latencies, 99) * 1000:8.1f} {log_bytes / 1024:8.1f}")
+
+if __name__ == '__main__':
+    main()
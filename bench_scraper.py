@@ -0,0 +1,282 @@
+"""Offline scraper benchmark.
+
+Record the live S-Craft group-buy pages once, then replay them through a local
+stand-in server and time scrape_s_craft end to end and per stage:
+
+    python bench_scraper.py record
+    python bench_scraper.py run --latency 150 --scale 10 --runs 3
+    python bench_scraper.py run --error-rate 0.1 --not-modified --warm
+
+Without recorded pages the run falls back to the parser fixtures in fixtures/.
+"""
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import Dict, Tuple
+import argparse
+import copy
+import hashlib
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import logging
+
+import requests
+
+try:
+    import lxml.html
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+import fetcher
+import metrics
+from logs import configure_logging
+import scraper
+from parsers import CompiledSelectors, compile_selector
+from vendors import DEFAULT_HEADERS, get_vendor, page_url
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RECORDED_DIR = os.path.join(BASE_DIR, 'fixtures', 'recorded')
+FALLBACK_DIR = os.path.join(BASE_DIR, 'fixtures')
+GROUP_BUY_PATH = '/shop/group-buy'
+S_CRAFT = get_vendor('s-craft')
+
+def fixture_name(batch_id: int, page: int) -> str:
+    return f"batch_{batch_id}_page_{page}.html"
+
+def record(output_dir: str = RECORDED_DIR):
+    """Save the live page for every S-Craft batch into output_dir."""
+    os.makedirs(output_dir, exist_ok=True)
+    session = requests.Session()
+    for batch_num, config in S_CRAFT["batches"].items():
+        for page in range(1, config["pages"] + 1):
+            url = page_url(S_CRAFT, config["id"], page)
+            response = session.get(url, headers=DEFAULT_HEADERS, timeout=fetcher.REQUEST_TIMEOUT)
+            response.raise_for_status()
+            path = os.path.join(output_dir, fixture_name(config["id"], page))
+            with open(path, 'w') as f:
+                f.write(response.text)
+            print(f"Recorded batch {batch_num} page {page} -> {path}")
+
+def load_pages(fixture_dir: str) -> Dict[Tuple[int, int], str]:
+    """Load recorded pages keyed by (batch id, page), falling back to parser fixtures."""
+    pages = {}
+    if os.path.isdir(fixture_dir):
+        for filename in os.listdir(fixture_dir):
+            if filename.startswith('batch_') and filename.endswith('.html'):
+                _, batch_id, _, page = filename[:-5].split('_')
+                with open(os.path.join(fixture_dir, filename), 'r') as f:
+                    pages[(int(batch_id), int(page))] = f.read()
+    if pages:
+        return pages
+
+    samples = []
+    for filename in sorted(os.listdir(FALLBACK_DIR)):
+        if filename.endswith('.html'):
+            with open(os.path.join(FALLBACK_DIR, filename), 'r') as f:
+                samples.append(f.read())
+    print(f"No recorded pages in {fixture_dir}, using {len(samples)} parser fixtures for every batch")
+    for i, (batch_num, config) in enumerate(S_CRAFT["batches"].items()):
+        for page in range(1, config["pages"] + 1):
+            pages[(config["id"], page)] = samples[(i + page) % len(samples)]
+    return pages
+
+def scale_page(html: str, factor: int, tag: str) -> str:
+    """Repeat every product card factor times, renaming copies so they stay unique (needs lxml)."""
+    if factor <= 1 and not tag:
+        return html
+    if not HAS_LXML:
+        raise RuntimeError("Scaling pages needs lxml; run without --scale and --page-scale or install lxml")
+    selectors = CompiledSelectors()
+    name_matches = compile_selector(selectors.name_selector)
+    root = lxml.html.document_fromstring(html)
+    cards = []
+    for card_matches in selectors.cards:
+        cards = [el for el in root.iter() if isinstance(el.tag, str) and card_matches(el.tag, el.attrib)]
+        if cards:
+            break
+    for card in cards:
+        parent = card.getparent()
+        if parent is None:
+            continue
+        anchor = card
+        for copy_num in range(factor):
+            target = card if copy_num == 0 else copy.deepcopy(card)
+            suffix = f"{tag}{copy_num}" if (tag or copy_num) else ""
+            if suffix:
+                for el in target.iter():
+                    if isinstance(el.tag, str) and el is not target and name_matches(el.tag, el.attrib):
+                        el.text = f"{el.text_content().strip()} #{suffix}"
+                        for child in list(el):
+                            el.remove(child)
+                        break
+            if copy_num:
+                anchor.addnext(target)
+                anchor = target
+    return lxml.html.tostring(root, encoding='unicode')
+
+def build_site(pages: Dict[Tuple[int, int], str], card_scale: int, page_scale: int) -> Tuple[Dict, Dict]:
+    """Build the served bodies and the matching batch config for the requested scale."""
+    bodies = {}
+    batch_config = {}
+    for batch_num, config in S_CRAFT["batches"].items():
+        recorded = [pages[(config["id"], page)] for page in range(1, config["pages"] + 1) if (config["id"], page) in pages]
+        total_pages = max(1, len(recorded)) * page_scale
+        for page in range(1, total_pages + 1):
+            source = recorded[(page - 1) % len(recorded)]
+            # Pages past the recorded ones are renamed copies so their products are unique
+            tag = f"p{page}-" if page > len(recorded) else ""
+            bodies[(config["id"], page)] = scale_page(source, card_scale, tag).encode('utf-8')
+        batch_config[batch_num] = {"id": config["id"], "pages": total_pages}
+    return bodies, batch_config
+
+class StandInServer:
+    """Local stand-in for the group-buy site with injectable latency, errors and 304s."""
+
+    def __init__(self, bodies: Dict, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, not_modified: bool = False, seed: int = 0):
+        self.bodies = bodies
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.not_modified = not_modified
+        self.random = random.Random(seed)
+        self.random_lock = threading.Lock()
+        self.requests = 0
+        self.etags = {key: '"' + hashlib.sha1(body).hexdigest() + '"' for key, body in bodies.items()}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}{GROUP_BUY_PATH}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                stand_in.requests += 1
+                parsed = urlparse(self.path)
+                query = parse_qs(parsed.query)
+                key = (int(query.get('batch_id', ['0'])[0]), int(query.get('page', ['1'])[0]))
+                with stand_in.random_lock:
+                    delay = stand_in.latency + stand_in.random.uniform(0, stand_in.jitter)
+                    fail = stand_in.random.random() < stand_in.error_rate
+                time.sleep(delay)
+
+                body = stand_in.bodies.get(key)
+                if parsed.path != GROUP_BUY_PATH or body is None:
+                    self._send(404, b'not found')
+                elif fail:
+                    self._send(503, b'injected error')
+                elif stand_in.not_modified and self.headers.get('If-None-Match') == stand_in.etags[key]:
+                    self._send(304, b'', {'ETag': stand_in.etags[key]})
+                else:
+                    self._send(200, body, {'ETag': stand_in.etags[key], 'Content-Type': 'text/html; charset=utf-8'})
+
+            def _send(self, status: int, body: bytes, headers: Dict = None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+def stage_totals() -> Dict[str, Dict]:
+    """Sum stage timings across label sets."""
+    totals = {}
+    for key, stats in metrics.get_summary("stage_duration_seconds").items():
+        stage = dict(key)["stage"]
+        total = totals.setdefault(stage, {"count": 0, "sum": 0.0, "p95": 0.0})
+        total["count"] += stats["count"]
+        total["sum"] += stats["sum"]
+        total["p95"] = max(total["p95"], stats["p95"])
+    return totals
+
+def run(args):
+    """Replay the pages through the stand-in server and print timings."""
+    pages = load_pages(args.fixtures)
+    bodies, batch_config = build_site(pages, args.scale, args.page_scale)
+    S_CRAFT["min_request_interval"] = args.min_interval
+    cache_dir = tempfile.mkdtemp(prefix='scraper-bench-')
+    cache_path = os.path.join(cache_dir, 'page_cache.json')
+
+    print(f"Serving {len(bodies)} pages ({sum(len(b) for b in bodies.values()) / 1024:.0f} KiB), "
+          f"card scale {args.scale}x, page scale {args.page_scale}x, latency {args.latency * 1000:.0f}ms")
+    try:
+        with StandInServer(bodies, args.latency, args.jitter, args.error_rate, args.not_modified) as server:
+            if args.warm:
+                scraper.scrape_s_craft(server.base_url, batch_config, cache_path)
+            for run_num in range(1, args.runs + 1):
+                if not args.warm and os.path.exists(cache_path):
+                    os.remove(cache_path)
+                metrics.reset()
+                requests_before = server.requests
+                start = time.perf_counter()
+                products = scraper.scrape_s_craft(server.base_url, batch_config, cache_path)
+                elapsed = time.perf_counter() - start
+                stats = scraper.get_last_scrape_stats()
+
+                print(f"\nRun {run_num}: {elapsed * 1000:.1f}ms end to end, {len(products)} products, "
+                      f"{server.requests - requests_before} requests, cache {stats['hits']} hits / "
+                      f"{stats['misses']} misses / {stats['errors']} errors")
+                for stage, total in sorted(stage_totals().items()):
+                    print(f"  {stage:<16} {total['sum'] * 1000:9.1f}ms total  {total['count']:6d} calls  "
+                          f"p95 {total['p95'] * 1000:8.2f}ms")
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    record_parser = subparsers.add_parser('record', help='record live pages into fixtures')
+    record_parser.add_argument('--output', default=RECORDED_DIR)
+
+    run_parser = subparsers.add_parser('run', help='replay fixtures through the stand-in server')
+    run_parser.add_argument('--fixtures', default=RECORDED_DIR)
+    run_parser.add_argument('--runs', type=int, default=3)
+    run_parser.add_argument('--latency', type=lambda ms: float(ms) / 1000, default=0.1, help='per-request latency in ms')
+    run_parser.add_argument('--jitter', type=lambda ms: float(ms) / 1000, default=0.0, help='extra random latency in ms')
+    run_parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests answered with 503')
+    run_parser.add_argument('--not-modified', action='store_true', help='answer matching If-None-Match with 304')
+    run_parser.add_argument('--warm', action='store_true', help='keep the page cache between runs')
+    run_parser.add_argument('--scale', type=int, default=1, help='multiply product cards per page')
+    run_parser.add_argument('--page-scale', type=int, default=1, help='multiply pages per batch')
+    run_parser.add_argument('--min-interval', type=float, default=S_CRAFT["min_request_interval"],
+                            help='seconds between requests to one host')
+    args = parser.parse_args()
+    if args.command == 'run' and (args.scale > 1 or args.page_scale > 1) and not HAS_LXML:
+        parser.error("--scale and --page-scale need lxml")
+
+    # Keep per-page scraper logs out of the timing output
+    configure_logging(level='WARNING')
+    for name in ('scraper', 'parsers', 'fetcher'):
+        logging.getLogger(name).setLevel(logging.ERROR)
+
+    if args.command == 'record':
+        record(args.output)
+    else:
+        run(args)
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,20 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ReturnDocument, monitoring
+from pymongo.errors import ConnectionFailure, BulkWriteError, OperationFailure
 from bson.objectid import ObjectId
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterator, Iterable, Tuple
 import os
 from dotenv import load_dotenv
 import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from metrics import observe, inc
+from logs import debug_sampled
+from vendors import DEFAULT_VENDOR, get_vendor
+from matching import MatchIndex, MATCH_THRESHOLD, MATCH_RULES_VERSION
+from prices import parse_price, DEFAULT_CURRENCY
 from datetime import datetime
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # MongoDB connection
@@ -15,57 +22,206 @@ client = None
 db = None
 keycaps_collection = None
 scrapes_collection = None  # New collection for storing scrape results
+comparisons_collection = None  # Persisted comparison results (optional)
+meta_collection = None  # Shared counters such as the collection version
+price_history_collection = None  # Time series of product prices, one point per price change
+
+# Connection pool settings
+MAX_POOL_SIZE = int(os.getenv('MONGODB_MAX_POOL_SIZE', '50'))
+MIN_POOL_SIZE = int(os.getenv('MONGODB_MIN_POOL_SIZE', '0'))
+MAX_IDLE_TIME_MS = int(os.getenv('MONGODB_MAX_IDLE_TIME_MS', '60000'))
+WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGODB_WAIT_QUEUE_TIMEOUT_MS', '5000'))
+HEALTH_CHECK_INTERVAL = float(os.getenv('MONGODB_HEALTH_CHECK_INTERVAL', '30'))  # Seconds between pings
+
+# Connection health, refreshed periodically or after a connection failure
+_healthy = False
+_last_health_check = 0.0
+_connect_lock = threading.RLock()  # Serializes reconnects; held by init_db
+_backfilled = False  # One-off data backfills have run in this process
+
+# Materialized comparison of each vendor's latest scrape against the collection,
+# keyed by (scrape id, collection version) and patched in place by keycap writes
+PERSIST_COMPARISONS = os.getenv('PERSIST_COMPARISONS', 'false').lower() == 'true'
+_comparisons = {}  # vendor -> comparison
+_match_index = None  # Fuzzy match index over collection names
+_match_index_version = None  # Collection version the match index reflects
+_comparison_lock = threading.Lock()
+
+# Rows sent to MongoDB per bulk write when importing keycaps
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '500'))
+
+# Scrape history is stored as deltas with a full checkpoint every N scrapes
+SCRAPE_CHECKPOINT_EVERY = int(os.getenv('SCRAPE_CHECKPOINT_EVERY', '10'))
+DIFF_FIELDS = ("price", "price_amount", "currency", "image_url")  # A product changed if any of these differ
+_snapshot_cache = {}  # vendor -> most recently rebuilt snapshot: {"scrape_id", "products"}
+
+class _CommandTimer(monitoring.CommandListener):
+    """Record the latency and failures of every MongoDB command."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        observe("mongo_command_duration_seconds", event.duration_micros / 1e6,
+                help_text="MongoDB command latency", command=event.command_name)
+
+    def failed(self, event):
+        observe("mongo_command_duration_seconds", event.duration_micros / 1e6,
+                help_text="MongoDB command latency", command=event.command_name)
+        inc("mongo_command_errors_total", help_text="Failed MongoDB commands", command=event.command_name)
 
 def init_db(uri: str = None) -> bool:
-    """Initialize MongoDB connection and get the collections."""
-    global client, db, keycaps_collection, scrapes_collection
+    """Initialize MongoDB connection and get the collections.
+
+    Safe to call from several threads: reconnects are serialized, the new
+    client is swapped in before the old one is closed, and the backfills
+    run once per process.
+    """
+    global client, db, keycaps_collection, scrapes_collection, comparisons_collection, meta_collection
+    global price_history_collection
+    global _healthy, _last_health_check, _backfilled
+    new_client = None
     try:
         if uri is None:
             uri = os.getenv('MONGODB_URI', 'mongodb://localhost:27017')
         
-        logger.info(f"Connecting to MongoDB at {uri}")
-        client = MongoClient(
-            uri,
-            serverSelectionTimeoutMS=5000,  # 5 second timeout
-            connectTimeoutMS=5000,
-            socketTimeoutMS=5000,
-            maxPoolSize=1,
-            retryWrites=True
-        )
-        
-        # Test the connection
-        client.admin.command('ping')
-        logger.info("Successfully connected to MongoDB")
-        
-        # Get or create database
-        db = client.keycapvault
-        logger.info(f"Using database: {db.name}")
-        
-        # Ensure collections exist
-        collections = db.list_collection_names()
-        logger.info(f"Existing collections: {collections}")
-        
-        if 'keycaps' not in collections:
-            logger.info("Creating keycaps collection")
-            db.create_collection('keycaps')
-        if 'scrapes' not in collections:
-            logger.info("Creating scrapes collection")
-            db.create_collection('scrapes')
-        
-        keycaps_collection = db.keycaps
-        scrapes_collection = db.scrapes
-        
-        # Ensure indexes
-        keycaps_collection.create_index("vendor")
-        keycaps_collection.create_index("name")
-        scrapes_collection.create_index([("scraped_at", -1)])  # Index for latest scrape
+        with _connect_lock:
+            logger.info(f"Connecting to MongoDB at {uri} (pool size {MIN_POOL_SIZE}-{MAX_POOL_SIZE})")
+            new_client = MongoClient(
+                uri,
+                serverSelectionTimeoutMS=5000,  # 5 second timeout
+                connectTimeoutMS=5000,
+                socketTimeoutMS=5000,
+                maxPoolSize=MAX_POOL_SIZE,
+                minPoolSize=MIN_POOL_SIZE,
+                maxIdleTimeMS=MAX_IDLE_TIME_MS,
+                waitQueueTimeoutMS=WAIT_QUEUE_TIMEOUT_MS,
+                retryWrites=True,
+                event_listeners=[_CommandTimer()]
+            )
+            
+            # Test the connection
+            new_client.admin.command('ping')
+            logger.info("Successfully connected to MongoDB")
+            
+            # Get or create database
+            new_db = new_client.keycapvault
+            logger.info(f"Using database: {new_db.name}")
+            _ensure_schema(new_db)
+            
+            # Swap in the new client before closing the old one, so other threads always find an open client
+            old_client = client
+            client = new_client
+            db = new_db
+            keycaps_collection = db.keycaps
+            scrapes_collection = db.scrapes
+            comparisons_collection = db.comparisons
+            meta_collection = db.meta
+            price_history_collection = db.price_history
+            _healthy = True
+            _last_health_check = time.monotonic()
+            if old_client is not None:
+                old_client.close()
+            
+            if not _backfilled:
+                _backfill_normalized_names()
+                _backfill_price_history()
+                _backfilled = True
         
         logger.info("Database initialization complete")
         return True
     except Exception as e:
         logger.error(f"Failed to initialize MongoDB connection: {str(e)}")
+        if new_client is not None and new_client is not client:
+            new_client.close()
         return False
 
+def _ensure_schema(database):
+    """Create missing collections and indexes."""
+    collections = database.list_collection_names()
+    logger.info(f"Existing collections: {collections}")
+    
+    if 'keycaps' not in collections:
+        logger.info("Creating keycaps collection")
+        database.create_collection('keycaps')
+    if 'scrapes' not in collections:
+        logger.info("Creating scrapes collection")
+        database.create_collection('scrapes')
+    if 'price_history' not in collections:
+        logger.info("Creating price_history collection")
+        _create_price_history_collection(database)
+    
+    # Ensure indexes
+    database.keycaps.create_index("vendor")
+    database.keycaps.create_index([("vendor", 1), ("_id", 1)])  # Keyset pagination by vendor
+    database.keycaps.create_index("name")
+    database.keycaps.create_index("name_normalized")  # Index for comparing against drops
+    database.scrapes.create_index([("scraped_at", -1)])  # Index for latest scrape
+    database.scrapes.create_index([("vendor", 1), ("scraped_at", -1)])  # Index for latest scrape per vendor
+    database.scrapes.create_index([("checkpoint_id", 1), ("scraped_at", 1)])  # Index for rebuilding snapshots
+    database.price_history.create_index(
+        [("product.vendor", 1), ("product.name", 1), ("scraped_at", 1)]  # Index for product price range queries
+    )
+
+def _create_price_history_collection(database):
+    """Create price_history as a time-series collection, or a regular one on servers before MongoDB 5.0."""
+    try:
+        database.create_collection('price_history', timeseries={
+            "timeField": "scraped_at",
+            "metaField": "product",
+            "granularity": "hours"
+        })
+    except OperationFailure as e:
+        logger.warning(f"Time-series collections unavailable, using a regular price_history collection: {str(e)}")
+        database.create_collection('price_history')
+
+def _backfill_price_history():
+    """Build price history from stored scrapes the first time the collection is empty."""
+    if price_history_collection.find_one({}, {"_id": 1}) is not None:
+        return
+    if scrapes_collection.find_one({}, {"_id": 1}) is None:
+        return
+    
+    logger.info("Backfilling price history from stored scrapes")
+    snapshots = {}  # vendor -> products as of the scrape being replayed
+    points = []
+    count = 0
+    for scrape in scrapes_collection.find({}, sort=[("scraped_at", 1)]):
+        vendor = scrape.get("vendor") or DEFAULT_VENDOR
+        previous = snapshots.get(vendor, [])
+        if scrape.get("kind", "full") == "full":
+            delta = _diff_products(previous, scrape.get("products", []))
+        else:
+            delta = {field: scrape.get(field, []) for field in ("added", "removed", "changed")}
+        points.extend(_price_points(vendor, scrape["scraped_at"], previous, delta))
+        snapshots[vendor] = _apply_delta(previous, delta)
+        if len(points) >= IMPORT_BATCH_SIZE:
+            price_history_collection.insert_many(points, ordered=False)
+            count += len(points)
+            points = []
+    if points:
+        price_history_collection.insert_many(points, ordered=False)
+        count += len(points)
+    logger.info(f"Backfilled {count} price history points")
+
+def normalize_name(name: str) -> str:
+    """Normalize a keycap name for matching: lowercase with collapsed whitespace."""
+    return " ".join(name.lower().split())
+
+def _backfill_normalized_names():
+    """Add name_normalized to keycaps stored before the field existed."""
+    missing = keycaps_collection.find(
+        {"name_normalized": {"$exists": False}, "name": {"$type": "string"}},
+        {"name": 1}
+    )
+    updates = [
+        UpdateOne({"_id": keycap["_id"]}, {"$set": {"name_normalized": normalize_name(keycap["name"])}})
+        for keycap in missing
+    ]
+    if updates:
+        keycaps_collection.bulk_write(updates, ordered=False)
+        logger.info(f"Backfilled name_normalized on {len(updates)} keycaps")
+
 def is_connected() -> bool:
     """Check if the database connection is active."""
     try:
@@ -77,119 +233,673 @@ def is_connected() -> bool:
         return False
 
 def ensure_connection():
-    """Ensure database connection is active, attempt to reconnect if not."""
-    if not is_connected():
-        logger.warning("Database connection lost, attempting to reconnect...")
-        return init_db()
+    """Ensure database connection is active, attempt to reconnect if not.
+
+    The server is only pinged when the last health check is older than
+    HEALTH_CHECK_INTERVAL or a previous call hit a connection failure, so a
+    healthy connection costs no extra round trip per operation.
+    """
+    global _healthy, _last_health_check
+    if client is not None and _healthy and time.monotonic() - _last_health_check < HEALTH_CHECK_INTERVAL:
+        return True
+    
+    with _connect_lock:
+        # Another thread may have checked or reconnected while this one waited
+        if client is not None and _healthy and time.monotonic() - _last_health_check < HEALTH_CHECK_INTERVAL:
+            return True
+        _healthy = is_connected()
+        _last_health_check = time.monotonic()
+        if not _healthy:
+            logger.warning("Database connection lost, attempting to reconnect...")
+            return init_db()
     return True
 
-def store_scrape_results(products: List[Dict]) -> bool:
-    """Store scrape results with timestamp."""
+def _record_failure(error: Exception):
+    """Force a health check on the next call after a connection failure."""
+    global _healthy
+    if isinstance(error, ConnectionFailure):
+        _healthy = False
+
+def _product_key(product: Dict) -> str:
+    """Identify a scraped product across scrapes by name and batch."""
+    return f"{product['name']}_{product['batch']}"
+
+def _diff_products(previous: List[Dict], current: List[Dict]) -> Dict[str, List]:
+    """Diff two snapshots into added products, removed keys and changed products.
+
+    Parsed prices are compared too, so products stored before they were
+    parsed (or parsed by older rules) are rewritten by the next scrape.
+    """
+    previous_by_key = {_product_key(product): product for product in previous}
+    current_keys = set()
+    added = []
+    changed = []
+    for product in current:
+        key = _product_key(product)
+        current_keys.add(key)
+        old = previous_by_key.get(key)
+        if old is None:
+            added.append(product)
+        elif any(old.get(field) != product.get(field) for field in DIFF_FIELDS):
+            changed.append(product)
+    removed = [
+        {"name": product["name"], "batch": product["batch"]}
+        for key, product in previous_by_key.items() if key not in current_keys
+    ]
+    return {"added": added, "removed": removed, "changed": changed}
+
+def _apply_delta(products: List[Dict], delta: Dict) -> List[Dict]:
+    """Apply a delta document to a snapshot, keeping products ordered by batch."""
+    by_key = {_product_key(product): product for product in products}
+    for product in delta.get("removed", []):
+        by_key.pop(_product_key(product), None)
+    for product in delta.get("changed", []):
+        by_key[_product_key(product)] = product
+    for product in delta.get("added", []):
+        by_key[_product_key(product)] = product
+    return sorted(by_key.values(), key=lambda product: product["batch"])
+
+def store_scrape_results(products: List[Dict], vendor: str = DEFAULT_VENDOR,
+                         batch_status: Optional[Dict[int, str]] = None) -> Dict:
+    """Store a vendor's scrape results as a delta against its previous scrape.
+
+    A full checkpoint is written for the first scrape and after every
+    SCRAPE_CHECKPOINT_EVERY deltas. Nothing is written when the scrape is
+    identical to the previous one. Returns the scrape id, whether a document
+    was stored, the added/removed/changed products and the failed batches.
+
+    With batch_status (batch number -> "ok"/"failed"), only "ok" batches
+    replace the previous scrape's products. Failed batches and batches that
+    were not scraped keep their previous products, and the failed ones are
+    recorded in failed_batches so they can be fetched again.
+    """
     if not ensure_connection():
         raise ConnectionError("Database connection failed")
     
     try:
-        logger.info(f"Attempting to store {len(products)} products")
+        logger.info(f"Attempting to store {len(products)} products for {vendor}")
         
         # Extract only essential data for comparison
         simplified_products = [{
             "name": product["name"],
             "batch": product["batch"],
             "price": product["price"],
-            "image_url": product["image_url"]
+            "price_amount": product.get("price_amount"),
+            "currency": product.get("currency"),
+            "image_url": product["image_url"],
+            "thumbnail_url": product.get("thumbnail_url")
         } for product in products]
         
-        # Create a scrape record with timestamp and products
-        scrape_data = {
-            "scraped_at": datetime.utcnow(),
-            "products": simplified_products
-        }
+        previous = _find_latest_scrape_header(vendor)
+        previous_products = _rebuild_snapshot(previous) if previous else []
+        failed_batches = []
+        if batch_status is not None:
+            simplified_products = _merge_batches(previous_products, simplified_products, batch_status)
+            failed_batches = sorted(batch_num for batch_num, status in batch_status.items() if status == "failed")
+        delta = _diff_products(previous_products, simplified_products)
         
-        # Store the scrape results
-        result = scrapes_collection.insert_one(scrape_data)
-        logger.info(f"Successfully stored scrape results with ID: {result.inserted_id}")
+        if previous and not any(delta.values()) and previous.get("failed_batches", []) == failed_batches:
+            logger.info("Scrape is identical to the previous one, skipping write")
+            return {"scrape_id": previous["_id"], "stored": False, "failed_batches": failed_batches, **delta}
         
-        # Verify the data was stored
-        stored_count = scrapes_collection.count_documents({"_id": result.inserted_id})
-        if stored_count == 1:
-            logger.info("Verified data was stored successfully")
-            return True
+        scraped_at = datetime.utcnow()
+        sequence = previous.get("sequence", 0) + 1 if previous else 0
+        if previous is None or sequence >= SCRAPE_CHECKPOINT_EVERY:
+            # Create a full checkpoint record with timestamp and products
+            scrape_data = {
+                "scraped_at": scraped_at,
+                "vendor": vendor,
+                "kind": "full",
+                "sequence": 0,
+                "failed_batches": failed_batches,
+                "products": simplified_products
+            }
         else:
-            logger.error("Failed to verify data storage")
-            return False
+            checkpoint_id = previous["_id"] if previous.get("kind", "full") == "full" else previous["checkpoint_id"]
+            scrape_data = {
+                "scraped_at": scraped_at,
+                "vendor": vendor,
+                "kind": "delta",
+                "sequence": sequence,
+                "checkpoint_id": checkpoint_id,
+                "base_id": previous["_id"],
+                "failed_batches": failed_batches,
+                **delta
+            }
+        
+        # Store the scrape results
+        result = scrapes_collection.insert_one(scrape_data)
+        _remember_snapshot(vendor, result.inserted_id, _apply_delta(previous_products, delta) if previous else simplified_products)
+        _record_prices(vendor, scraped_at, previous_products, delta)
+        logger.info(
+            f"Stored {scrape_data['kind']} {vendor} scrape {result.inserted_id}: {len(delta['added'])} added, "
+            f"{len(delta['removed'])} removed, {len(delta['changed'])} changed"
+        )
+        if failed_batches:
+            logger.warning(f"Kept previous {vendor} products for failed batches {failed_batches}")
+        return {"scrape_id": result.inserted_id, "stored": True, "failed_batches": failed_batches, **delta}
     except Exception as e:
         logger.error(f"Error storing scrape results: {str(e)}")
+        _record_failure(e)
         raise
 
-def compare_with_collection() -> Dict[str, List[Dict]]:
-    """Compare scraped items with collection and return matches/missing items."""
+def _price_points(vendor: str, scraped_at: datetime, previous: List[Dict], delta: Dict) -> List[Dict]:
+    """Build price history points for a scrape: new products, price changes and removals."""
+    previous_prices = {_product_key(product): product["price"] for product in previous}
+    priced = delta["added"] + [
+        product for product in delta["changed"] if previous_prices.get(_product_key(product)) != product["price"]
+    ]
+    points = []
+    for product in priced:
+        amount, currency = product.get("price_amount"), product.get("currency")
+        if "price_amount" not in product:
+            # Stored before prices were parsed at scrape time
+            parsed = parse_price(product["price"], get_vendor(vendor).get("currency", DEFAULT_CURRENCY))
+            amount, currency = (parsed["amount"], parsed["currency"]) if parsed else (None, None)
+        points.append({
+            "scraped_at": scraped_at,
+            "product": {"vendor": vendor, "name": product["name"], "batch": product["batch"]},
+            "price": product["price"],
+            "amount": amount,
+            "currency": currency
+        })
+    for product in delta["removed"]:
+        points.append({
+            "scraped_at": scraped_at,
+            "product": {"vendor": vendor, "name": product["name"], "batch": product["batch"]},
+            "removed": True
+        })
+    return points
+
+def _record_prices(vendor: str, scraped_at: datetime, previous: List[Dict], delta: Dict):
+    """Append a stored scrape's price changes to the price history."""
+    points = _price_points(vendor, scraped_at, previous, delta)
+    if not points:
+        return
+    try:
+        price_history_collection.insert_many(points, ordered=False)
+    except Exception as e:
+        # The scrape itself is stored; a missing point only thins the history
+        logger.error(f"Error recording price history for {vendor}: {str(e)}")
+        inc("price_history_errors_total", help_text="Failed price history writes", vendor=vendor)
+
+def get_price_history(name: str, vendor: str = DEFAULT_VENDOR, start: Optional[datetime] = None,
+                      end: Optional[datetime] = None, batch: Optional[int] = None) -> List[Dict]:
+    """Get a product's price points in time order from the price history, not from scrape snapshots.
+
+    Each point is a price change (or the product's first appearance), or a
+    removal. With start, the last point before it is included first so the
+    price at the start of the range is known.
+    """
     if not ensure_connection():
         raise ConnectionError("Database connection failed")
     
     try:
-        # Get latest scrape results
-        latest_scrape = scrapes_collection.find_one(sort=[("scraped_at", -1)])
-        logger.info(f"Latest scrape found: {latest_scrape is not None}")
+        query = {"product.vendor": vendor, "product.name": name}
+        if batch is not None:
+            query["product.batch"] = batch
+        time_range = {}
+        if start is not None:
+            time_range["$gte"] = start
+        if end is not None:
+            time_range["$lte"] = end
         
-        if not latest_scrape:
+        points = list(price_history_collection.find(
+            {**query, **({"scraped_at": time_range} if time_range else {})},
+            sort=[("scraped_at", 1)]
+        ))
+        if start is not None:
+            opening = price_history_collection.find_one(
+                {**query, "scraped_at": {"$lt": start}},
+                sort=[("scraped_at", -1)]
+            )
+            if opening is not None:
+                points.insert(0, opening)
+        return [{
+            "scraped_at": point["scraped_at"],
+            "batch": point["product"]["batch"],
+            "price": point.get("price"),
+            "amount": point.get("amount"),
+            "currency": point.get("currency"),
+            "removed": point.get("removed", False)
+        } for point in points]
+    except Exception as e:
+        logger.error(f"Error retrieving price history: {str(e)}")
+        _record_failure(e)
+        raise
+
+def store_all_scrape_results(results: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Store each vendor's scrape ({"products", "batches"}), skipping vendors that returned nothing.
+
+    Returns store_scrape_results' result for each stored vendor.
+    """
+    return {
+        vendor: store_scrape_results(result["products"], vendor, result["batches"])
+        for vendor, result in results.items() if result["products"] or result["batches"]
+    }
+
+def _merge_batches(previous: List[Dict], current: List[Dict], batch_status: Dict[int, str]) -> List[Dict]:
+    """Combine a scrape with the previous snapshot, batch by batch.
+
+    "ok" batches come from the scrape. Other batches keep their previous
+    products, except failed batches the previous snapshot never had, which
+    keep whatever the scrape did get.
+    """
+    previous_batches = {product["batch"] for product in previous}
+    merged = [
+        product for product in previous
+        if batch_status.get(product["batch"]) != "ok"
+    ]
+    merged.extend(
+        product for product in current
+        if batch_status.get(product["batch"]) == "ok" or product["batch"] not in previous_batches
+    )
+    return sorted(merged, key=lambda product: product["batch"])
+
+def _vendor_filter(vendor: Optional[str]) -> Dict:
+    """Build the scrapes filter for a vendor, or for every vendor when None.
+
+    Scrapes stored before vendors were tracked have no vendor field and
+    belong to the default vendor.
+    """
+    if vendor is None:
+        return {}
+    if vendor == DEFAULT_VENDOR:
+        return {"vendor": {"$in": [vendor, None]}}
+    return {"vendor": vendor}
+
+def _find_latest_scrape_header(vendor: str = DEFAULT_VENDOR) -> Optional[Dict]:
+    """Get a vendor's latest scrape document without its product lists."""
+    return scrapes_collection.find_one(
+        _vendor_filter(vendor),
+        sort=[("scraped_at", -1)],
+        projection={"products": 0, "added": 0, "removed": 0, "changed": 0}
+    )
+
+def _remember_snapshot(vendor: str, scrape_id, products: List[Dict]):
+    """Keep each vendor's most recently rebuilt snapshot in memory."""
+    _snapshot_cache[vendor] = {"scrape_id": scrape_id, "products": products}
+
+def _cached_snapshot(scrape_id) -> Optional[List[Dict]]:
+    """Get a scrape's products from the snapshot cache, if present."""
+    for cached in list(_snapshot_cache.values()):
+        if cached["scrape_id"] == scrape_id:
+            return cached["products"]
+    return None
+
+def _rebuild_snapshot(header: Dict) -> List[Dict]:
+    """Rebuild a scrape's full product list from its checkpoint and deltas."""
+    cached = _cached_snapshot(header["_id"])
+    if cached is not None:
+        return cached
+    
+    if header.get("kind", "full") == "full":
+        scrape = scrapes_collection.find_one({"_id": header["_id"]}, {"products": 1})
+        products = scrape["products"] if scrape else []
+    else:
+        checkpoint = scrapes_collection.find_one({"_id": header["checkpoint_id"]}, {"products": 1})
+        products = checkpoint["products"] if checkpoint else []
+        deltas = scrapes_collection.find(
+            {"checkpoint_id": header["checkpoint_id"], "scraped_at": {"$lte": header["scraped_at"]}},
+            sort=[("scraped_at", 1)]
+        )
+        for delta in deltas:
+            products = _apply_delta(products, delta)
+    
+    _remember_snapshot(header.get("vendor") or DEFAULT_VENDOR, header["_id"], products)
+    return products
+
+def get_scrape_changes(limit: int = 10, vendor: Optional[str] = None) -> List[Dict]:
+    """Get what changed in the most recent scrapes, newest first, optionally for one vendor."""
+    if not ensure_connection():
+        raise ConnectionError("Database connection failed")
+    
+    try:
+        scrapes = scrapes_collection.find(
+            {"kind": "delta", **_vendor_filter(vendor)},
+            sort=[("scraped_at", -1)],
+            limit=limit
+        )
+        return [{
+            "scrape_id": str(scrape["_id"]),
+            "vendor": scrape.get("vendor") or DEFAULT_VENDOR,
+            "scraped_at": scrape["scraped_at"],
+            "added": scrape.get("added", []),
+            "removed": scrape.get("removed", []),
+            "changed": scrape.get("changed", [])
+        } for scrape in scrapes]
+    except Exception as e:
+        logger.error(f"Error retrieving scrape changes: {str(e)}")
+        _record_failure(e)
+        raise
+
+def compare_with_collection(offset: int = 0, limit: Optional[int] = None,
+                            vendor: str = DEFAULT_VENDOR) -> Dict:
+    """Compare a vendor's scraped items with collection and return matches/missing items.
+
+    Serves from the materialized comparison when it is current for the
+    latest scrape and collection version, and recomputes it otherwise.
+    offset/limit select a page of each of matches and missing.
+    """
+    if not ensure_connection():
+        raise ConnectionError("Database connection failed")
+    
+    try:
+        scrape_id = get_latest_scrape_id(vendor)
+        if scrape_id is None:
             logger.info("No scrape results found")
-            return {"matches": [], "missing": []}
-        
-        # Get collection items
-        collection_items = list(keycaps_collection.find({}, {"name": 1}))
-        logger.info(f"Found {len(collection_items)} items in collection")
-        logger.info(f"Collection items: {collection_items}")
-        
-        collection_names = {item["name"].lower() for item in collection_items}
-        logger.info(f"Collection names (lowercase): {collection_names}")
-        
-        # Compare items
-        matches = []
-        missing = []
-        
-        for product in latest_scrape["products"]:
-            product_name = product["name"].lower()
-            logger.info(f"Comparing product: {product_name}")
-            
-            if product_name in collection_names:
-                logger.info(f"Match found for: {product_name}")
-                matches.append(product)
-            else:
-                logger.info(f"No match found for: {product_name}")
-                missing.append(product)
+            return {"matches": [], "missing": [], "total_matches": 0, "total_missing": 0}
         
-        logger.info(f"Found {len(matches)} matches and {len(missing)} missing items")
-        logger.info(f"Matches: {matches}")
-        logger.info(f"Missing: {missing}")
+        version = get_collection_version()
+        with _comparison_lock:
+            comparison = _comparisons.get(vendor)
+        if comparison is None or comparison["scrape_id"] != scrape_id or comparison["version"] != version:
+            comparison = _load_persisted_comparison(scrape_id, version) if PERSIST_COMPARISONS else None
+            if comparison is None:
+                comparison = _compute_comparison(scrape_id, version)
+                _save_comparison(comparison)
+            with _comparison_lock:
+                _comparisons[vendor] = comparison
         
-        return {
-            "matches": matches,
-            "missing": missing
-        }
+        with _comparison_lock:
+            products = comparison["products"]
+            name_matches = comparison["name_matches"]
+            end = offset + limit if limit else None
+            matches = []
+            for i in comparison["matches"][offset:end]:
+                matched_name, score = name_matches[normalize_name(products[i]["name"])]
+                matches.append({**products[i], "matched_name": matched_name, "confidence": round(score, 3)})
+            return {
+                "matches": matches,
+                "missing": [products[i] for i in comparison["missing"][offset:end]],
+                "total_matches": len(comparison["matches"]),
+                "total_missing": len(comparison["missing"])
+            }
     except Exception as e:
         logger.error(f"Error comparing items: {str(e)}")
-        logger.exception("Full traceback:")
+        _record_failure(e)
         raise
 
-def get_latest_scrape() -> List[Dict]:
-    """Get the most recent scrape results."""
+def _build_comparison(scrape_id, version: int, products: List[Dict], name_matches: Dict) -> Dict:
+    """Index a scrape's products by normalized name and split them into matches/missing.
+
+    name_matches maps each matched product name to the collection name it
+    matched and the match score.
+    """
+    by_name = {}
+    matches = []
+    missing = []
+    for position, product in enumerate(products):
+        name = normalize_name(product["name"])
+        by_name.setdefault(name, []).append(position)
+        (matches if name in name_matches else missing).append(position)
+    by_owned = {}
+    for name, (owned_name, _) in name_matches.items():
+        by_owned.setdefault(owned_name, set()).add(name)
+    product_index = MatchIndex()
+    for name in by_name:
+        product_index.add(name)
+    return {
+        "scrape_id": scrape_id,
+        "version": version,
+        "products": products,
+        "by_name": by_name,
+        "name_matches": name_matches,
+        "by_owned": by_owned,  # Collection name -> product names it matched
+        "product_index": product_index,  # Finds the products a newly added keycap matches
+        "matches": matches,  # Positions into products, in scrape order
+        "missing": missing
+    }
+
+def _compute_comparison(scrape_id, version: int) -> Dict:
+    """Run the full comparison for a scrape against the collection's match index."""
+    products = get_scrape_products(scrape_id)
+    index = _get_match_index(version)
+    name_matches = {}
+    for name in {normalize_name(product["name"]) for product in products}:
+        match = index.best_match(name)
+        if match:
+            name_matches[name] = match
+            debug_sampled(logger, "compare.match", "Matched %s to %s (%.3f)", name, match[0], match[1])
+        else:
+            debug_sampled(logger, "compare.missing", "No collection match for %s", name)
+    comparison = _build_comparison(scrape_id, version, products, name_matches)
+    logger.info("Computed comparison: %d matches and %d missing items", len(comparison['matches']), len(comparison['missing']))
+    return comparison
+
+def _get_match_index(version: int) -> MatchIndex:
+    """Get the match index over collection names, rebuilding it if it missed a write."""
+    global _match_index, _match_index_version
+    with _comparison_lock:
+        if _match_index is not None and _match_index_version == version:
+            return _match_index
+    
+    index = MatchIndex()
+    for name in keycaps_collection.distinct("name_normalized"):
+        if isinstance(name, str):
+            index.add(name)
+    logger.info(f"Built match index over {len(index)} collection names")
+    with _comparison_lock:
+        _match_index = index
+        _match_index_version = version
+    return index
+
+def _load_persisted_comparison(scrape_id, version: int) -> Optional[Dict]:
+    """Load a comparison saved by any process for this scrape and collection version."""
+    saved = comparisons_collection.find_one({"_id": f"{scrape_id}:{version}"})
+    if (not saved or saved.get("threshold") != MATCH_THRESHOLD or saved.get("rules") != MATCH_RULES_VERSION
+            or "name_matches" not in saved):
+        return None
+    products = get_scrape_products(scrape_id)
+    name_matches = {name: (owned_name, score) for name, owned_name, score in saved["name_matches"]}
+    return _build_comparison(scrape_id, version, products, name_matches)
+
+def _save_comparison(comparison: Dict):
+    """Persist a comparison to the comparisons collection when enabled."""
+    if not PERSIST_COMPARISONS:
+        return
+    comparisons_collection.replace_one(
+        {"_id": f"{comparison['scrape_id']}:{comparison['version']}"},
+        {
+            "scrape_id": comparison["scrape_id"],
+            "version": comparison["version"],
+            "threshold": MATCH_THRESHOLD,
+            "rules": MATCH_RULES_VERSION,
+            # Stored as a list since product names may contain "." or "$"
+            "name_matches": [[name, owned_name, score] for name, (owned_name, score) in comparison["name_matches"].items()],
+            "computed_at": datetime.utcnow()
+        },
+        upsert=True
+    )
+    # Only the current comparison is useful once the version moves on
+    comparisons_collection.delete_many({
+        "scrape_id": comparison["scrape_id"],
+        "version": {"$lt": comparison["version"]}
+    })
+
+def get_collection_version() -> int:
+    """Get the keycap collection write counter.
+
+    It lives in the meta collection, so writes made by any process or
+    server move it and every process keys its caches on the same value.
+    """
+    if not ensure_connection():
+        raise ConnectionError("Database connection failed")
+    counter = meta_collection.find_one({"_id": "collection_version"})
+    return counter["value"] if counter else 0
+
+def _bump_collection_version() -> int:
+    """Increment the keycap collection write counter and return the new value."""
+    counter = meta_collection.find_one_and_update(
+        {"_id": "collection_version"},
+        {"$inc": {"value": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["value"]
+
+def _apply_collection_change(added_names: List[str] = (), removed_names: List[str] = ()):
+    """Record a keycap write and update the match index and comparisons in place.
+
+    Added names are indexed and matched against each comparison's missing
+    products; names no keycap has any more are dropped from the index and
+    the products they matched are matched again. A cached index or
+    comparison that missed an intervening write is dropped instead.
+    """
+    global _match_index, _match_index_version
+    with _comparison_lock:
+        version = _bump_collection_version()
+        index = _match_index if _match_index_version == version - 1 else None
+        released_names = []
+        if index is not None and removed_names:
+            # Names no keycap has any more
+            released_names = [
+                name for name in removed_names
+                if name not in added_names
+                and not keycaps_collection.count_documents({"name_normalized": name}, limit=1)
+            ]
+        if index is not None:
+            for name in added_names:
+                index.add(name)
+            for name in released_names:
+                index.remove(name)
+            _match_index_version = version
+        else:
+            _match_index = None
+        
+        patched = []
+        for vendor, comparison in list(_comparisons.items()):
+            if index is None or comparison["version"] != version - 1:
+                del _comparisons[vendor]
+                continue
+            _patch_comparison(comparison, index, added_names, released_names)
+            comparison["version"] = version
+            patched.append(comparison)
+    for comparison in patched:
+        _save_comparison(comparison)
+
+def _patch_comparison(comparison: Dict, index: MatchIndex, added_names: List[str], released_names: List[str]):
+    """Update a comparison's matches after keycap names were added or released."""
+    name_matches = comparison["name_matches"]
+    by_owned = comparison["by_owned"]
+    
+    def set_match(name: str, match: Optional[Tuple[str, float]]):
+        current = name_matches.get(name)
+        if current:
+            by_owned.get(current[0], set()).discard(name)
+        if match:
+            name_matches[name] = match
+            by_owned.setdefault(match[0], set()).add(name)
+        else:
+            name_matches.pop(name, None)
+        if (current is None) != (match is None):
+            # Move the product's positions between missing and matches
+            source, target = ("missing", "matches") if match else ("matches", "missing")
+            for position in comparison["by_name"][name]:
+                i = bisect_left(comparison[source], position)
+                if i < len(comparison[source]) and comparison[source][i] == position:
+                    del comparison[source][i]
+                    insort(comparison[target], position)
+    
+    for owned_name in added_names:
+        for name, score in comparison["product_index"].search(owned_name):
+            current = name_matches.get(name)
+            if current is None or score > current[1]:
+                set_match(name, (owned_name, score))
+    
+    for owned_name in released_names:
+        for name in list(by_owned.pop(owned_name, ())):
+            set_match(name, index.best_match(name))
+
+def get_latest_scrape_info(vendor: str = DEFAULT_VENDOR) -> Optional[Dict]:
+    """Get a vendor's most recent scrape id, products and timestamp."""
     if not ensure_connection():
         raise ConnectionError("Database connection failed")
     
     try:
         # Find the most recent scrape
-        latest_scrape = scrapes_collection.find_one(
-            sort=[("scraped_at", -1)]
-        )
+        latest_scrape = _find_latest_scrape_header(vendor)
         
         if latest_scrape:
-            logger.info(f"Retrieved latest scrape from {latest_scrape['scraped_at']}")
-            return latest_scrape["products"]
+            logger.debug("Retrieved latest %s scrape from %s", vendor, latest_scrape['scraped_at'])
+            return {
+                "id": latest_scrape["_id"],
+                "products": _rebuild_snapshot(latest_scrape),
+                "scraped_at": latest_scrape["scraped_at"]
+            }
         else:
             logger.info("No previous scrape results found")
-            return []
+            return None
     except Exception as e:
         logger.error(f"Error retrieving latest scrape: {str(e)}")
+        _record_failure(e)
+        raise
+
+def get_latest_scrape(vendor: str = DEFAULT_VENDOR) -> List[Dict]:
+    """Get a vendor's most recent scrape results."""
+    info = get_latest_scrape_info(vendor)
+    return info["products"] if info else []
+
+def get_latest_scrape_id(vendor: str = DEFAULT_VENDOR):
+    """Get the _id of a vendor's most recent scrape."""
+    if not ensure_connection():
+        raise ConnectionError("Database connection failed")
+    
+    try:
+        latest_scrape = scrapes_collection.find_one(
+            _vendor_filter(vendor),
+            sort=[("scraped_at", -1)],
+            projection={"_id": 1}
+        )
+        return latest_scrape["_id"] if latest_scrape else None
+    except Exception as e:
+        logger.error(f"Error retrieving latest scrape id: {str(e)}")
+        _record_failure(e)
+        raise
+
+def get_latest_scrape_stamp(vendor: str = DEFAULT_VENDOR) -> Optional[Dict]:
+    """Get the id and timestamp of a vendor's most recent scrape, without its products."""
+    if not ensure_connection():
+        raise ConnectionError("Database connection failed")
+    
+    try:
+        latest_scrape = scrapes_collection.find_one(
+            _vendor_filter(vendor),
+            sort=[("scraped_at", -1)],
+            projection={"_id": 1, "scraped_at": 1}
+        )
+        return {"id": latest_scrape["_id"], "scraped_at": latest_scrape["scraped_at"]} if latest_scrape else None
+    except Exception as e:
+        logger.error(f"Error retrieving latest scrape stamp: {str(e)}")
+        _record_failure(e)
+        raise
+
+def get_scrape_products(scrape_id) -> List[Dict]:
+    """Get the full product list for a scrape, rebuilding it from deltas if needed."""
+    cached = _cached_snapshot(scrape_id)
+    if cached is not None:
+        return cached
+    header = scrapes_collection.find_one(
+        {"_id": scrape_id},
+        projection={"products": 0, "added": 0, "removed": 0, "changed": 0}
+    )
+    return _rebuild_snapshot(header) if header else []
+
+def get_latest_scrape_time(vendor: Optional[str] = None) -> Optional[datetime]:
+    """Get the timestamp of the most recent scrape of a vendor, or of any vendor when None."""
+    if not ensure_connection():
+        raise ConnectionError("Database connection failed")
+    
+    try:
+        latest_scrape = scrapes_collection.find_one(
+            _vendor_filter(vendor),
+            sort=[("scraped_at", -1)],
+            projection={"scraped_at": 1}
+        )
+        return latest_scrape["scraped_at"] if latest_scrape else None
+    except Exception as e:
+        logger.error(f"Error retrieving latest scrape time: {str(e)}")
+        _record_failure(e)
         raise
 
 def add_keycap(data: Dict) -> str:
@@ -198,25 +908,47 @@ def add_keycap(data: Dict) -> str:
         raise ConnectionError("Database connection failed")
     
     try:
-        result = keycaps_collection.insert_one(data)
+        keycap = dict(data)
+        if isinstance(keycap.get("name"), str):
+            keycap["name_normalized"] = normalize_name(keycap["name"])
+        result = keycaps_collection.insert_one(keycap)
+        _apply_collection_change(added_names=[keycap["name_normalized"]] if "name_normalized" in keycap else [])
         return str(result.inserted_id)
     except Exception as e:
         logger.error(f"Error adding keycap: {str(e)}")
+        _record_failure(e)
         raise
 
 def get_keycaps(vendor: Optional[str] = None) -> List[Dict]:
     """Get all keycaps, optionally filtered by vendor."""
+    keycaps = list(iter_keycaps(vendor))
+    logger.debug("Found %d keycaps", len(keycaps))
+    return keycaps
+
+def iter_keycaps(vendor: Optional[str] = None, after: Optional[str] = None,
+                 limit: Optional[int] = None, fields: Optional[List[str]] = None) -> Iterator[Dict]:
+    """Iterate keycaps in _id order, streaming them off the cursor.
+
+    Pass the last seen _id as after to fetch the next page, and a list of
+    field names to project only those fields (_id is always included).
+    """
     if not ensure_connection():
         raise ConnectionError("Database connection failed")
     
     try:
         query = {"vendor": vendor} if vendor else {}
-        logger.info(f"Querying keycaps with filter: {query}")
-        keycaps = list(keycaps_collection.find(query))
-        logger.info(f"Found {len(keycaps)} keycaps")
-        return keycaps
+        if after:
+            query["_id"] = {"$gt": ObjectId(after)}
+        projection = {field: 1 for field in fields} if fields else None
+        logger.debug("Querying keycaps with filter: %s", query)
+        
+        cursor = keycaps_collection.find(query, projection).sort("_id", 1)
+        if limit:
+            cursor = cursor.limit(limit)
+        yield from cursor
     except Exception as e:
         logger.error(f"Error getting keycaps: {str(e)}")
+        _record_failure(e)
         raise
 
 def update_keycap(keycap_id: str, updates: Dict) -> bool:
@@ -225,13 +957,31 @@ def update_keycap(keycap_id: str, updates: Dict) -> bool:
         raise ConnectionError("Database connection failed")
     
     try:
-        result = keycaps_collection.update_one(
+        updates = dict(updates)
+        updates.pop("name_normalized", None)
+        if isinstance(updates.get("name"), str):
+            updates["name_normalized"] = normalize_name(updates["name"])
+        previous = keycaps_collection.find_one_and_update(
             {"_id": ObjectId(keycap_id)},
-            {"$set": updates}
+            {"$set": updates},
+            return_document=ReturnDocument.BEFORE
         )
-        return result.modified_count > 0
+        if previous is None or all(previous.get(field) == value for field, value in updates.items()):
+            return False
+        
+        old_name = previous.get("name_normalized")
+        new_name = updates.get("name_normalized", old_name)
+        if new_name != old_name:
+            _apply_collection_change(
+                added_names=[new_name] if new_name else [],
+                removed_names=[old_name] if old_name else []
+            )
+        else:
+            _apply_collection_change()
+        return True
     except Exception as e:
         logger.error(f"Error updating keycap: {str(e)}")
+        _record_failure(e)
         raise
 
 def delete_keycap(keycap_id: str) -> bool:
@@ -240,8 +990,89 @@ def delete_keycap(keycap_id: str) -> bool:
         raise ConnectionError("Database connection failed")
     
     try:
-        result = keycaps_collection.delete_one({"_id": ObjectId(keycap_id)})
-        return result.deleted_count > 0
+        deleted = keycaps_collection.find_one_and_delete(
+            {"_id": ObjectId(keycap_id)},
+            projection={"name_normalized": 1}
+        )
+        if deleted is None:
+            return False
+        _apply_collection_change(
+            removed_names=[deleted["name_normalized"]] if deleted.get("name_normalized") else []
+        )
+        return True
     except Exception as e:
         logger.error(f"Error deleting keycap: {str(e)}")
+        _record_failure(e)
         raise
+
+def bulk_upsert_keycaps(rows: Iterable[Tuple[int, Dict]], batch_size: Optional[int] = IMPORT_BATCH_SIZE) -> Dict:
+    """Insert or update keycaps by name with batched bulk writes.
+
+    rows yields (row number, keycap) pairs; each keycap's fields are set on
+    the existing keycap with the same normalized name, or inserted as a new
+    one. Rows are written batch_size at a time (all at once when None) and
+    a later row with the same name wins. Returns counts of inserted,
+    updated and unchanged keycaps plus per-row write errors.
+    """
+    if not ensure_connection():
+        raise ConnectionError("Database connection failed")
+    
+    summary = {"inserted": 0, "updated": 0, "unchanged": 0, "errors": []}
+    names = set()
+    batch = {}  # name_normalized -> (row number, keycap), so duplicates in a batch collapse
+    try:
+        for row, data in rows:
+            keycap = {field: value for field, value in data.items() if field not in ("_id", "name_normalized")}
+            keycap["name_normalized"] = normalize_name(keycap["name"])
+            batch.pop(keycap["name_normalized"], None)
+            batch[keycap["name_normalized"]] = (row, keycap)
+            if batch_size and len(batch) >= batch_size:
+                _write_keycap_batch(list(batch.values()), summary, names)
+                batch = {}
+        if batch:
+            _write_keycap_batch(list(batch.values()), summary, names)
+    except Exception as e:
+        logger.error(f"Error importing keycaps: {str(e)}")
+        _record_failure(e)
+        raise
+    finally:
+        if names:
+            _apply_collection_change(added_names=list(names))
+    
+    logger.info(
+        f"Imported keycaps: {summary['inserted']} inserted, {summary['updated']} updated, "
+        f"{summary['unchanged']} unchanged, {len(summary['errors'])} errors"
+    )
+    return summary
+
+def _write_keycap_batch(batch: List[Tuple[int, Dict]], summary: Dict, names: set):
+    """Upsert one batch of keycaps, recording failed rows instead of raising."""
+    operations = [
+        UpdateOne({"name_normalized": keycap["name_normalized"]}, {"$set": keycap}, upsert=True)
+        for _, keycap in batch
+    ]
+    failed = set()
+    try:
+        result = keycaps_collection.bulk_write(operations, ordered=False)
+        details = result.bulk_api_result
+    except BulkWriteError as e:
+        details = e.details
+        for error in details.get("writeErrors", []):
+            failed.add(error["index"])
+            summary["errors"].append({"row": batch[error["index"]][0], "error": error.get("errmsg", "Write failed")})
+    
+    upserted = len(details.get("upserted", []))
+    summary["inserted"] += upserted
+    summary["updated"] += details.get("nModified", 0)
+    summary["unchanged"] += details.get("nMatched", 0) - details.get("nModified", 0)
+    names.update(keycap["name_normalized"] for i, (_, keycap) in enumerate(batch) if i not in failed)
+
+def add_missing_keycaps(vendor: str = DEFAULT_VENDOR) -> Dict:
+    """Add every drop missing from the collection with a single bulk write."""
+    comparison = compare_with_collection(vendor=vendor)
+    vendor_name = get_vendor(vendor)["name"]
+    rows = [
+        (position, {"name": product["name"], "vendor": vendor_name})
+        for position, product in enumerate(comparison["missing"])
+    ]
+    return bulk_upsert_keycaps(rows, batch_size=None)
@@ -0,0 +1,147 @@
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, AsyncIterator, Optional, Tuple
+import asyncio
+import itertools
+import json
+import os
+import queue
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+EVENT_HISTORY = int(os.getenv('EVENT_HISTORY', '200'))  # Events kept for clients resuming with Last-Event-ID
+SUBSCRIBER_QUEUE_SIZE = 1000  # Undelivered events before a slow client is disconnected
+HEARTBEAT_INTERVAL = 15.0  # Seconds between keep-alive comments on an idle stream
+RETRY_MS = 3000  # Reconnect delay suggested to EventSource clients
+
+Message = Tuple[int, str, Dict]  # (event id, event name, data)
+
+class Subscription:
+    """Events waiting to be sent to one stream.
+
+    A client that falls SUBSCRIBER_QUEUE_SIZE events behind is closed; its
+    EventSource reconnects and resumes from the broker's history.
+    """
+
+    def __init__(self, size: int = SUBSCRIBER_QUEUE_SIZE):
+        self._queue = queue.Queue()
+        self._size = size
+        self.closed = False
+
+    def deliver(self, message: Message):
+        if self._queue.qsize() >= self._size:
+            self.closed = True
+            return
+        self._queue.put_nowait(message)
+
+    def get(self, timeout: float) -> Optional[Message]:
+        """Wait for the next event, or None after timeout seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class AsyncSubscription(Subscription):
+    """Subscription read from an event loop; events published from other threads are handed over to the loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, size: int = SUBSCRIBER_QUEUE_SIZE):
+        super().__init__(size)
+        self._queue = asyncio.Queue()
+        self._loop = loop
+
+    def deliver(self, message: Message):
+        self._loop.call_soon_threadsafe(super().deliver, message)
+
+    async def get(self, timeout: float) -> Optional[Message]:
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+class EventBroker:
+    """Fan out scrape progress and drop changes to every connected stream."""
+
+    def __init__(self, history: int = EVENT_HISTORY):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+
+    def publish(self, event: str, data: Dict) -> int:
+        """Send an event to every subscriber, returning its id."""
+        with self._lock:
+            message = (next(self._ids), event, data)
+            self._history.append(message)
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            try:
+                subscription.deliver(message)
+            except RuntimeError:
+                # The subscriber's event loop has shut down
+                with self._lock:
+                    self._subscribers.discard(subscription)
+        return message[0]
+
+    @contextmanager
+    def subscribe(self, subscription: Subscription, last_event_id: Optional[int] = None):
+        """Register a subscription for the duration of a stream.
+
+        With last_event_id, events after it that are still in the history
+        are delivered first.
+        """
+        with self._lock:
+            if last_event_id is not None:
+                for message in self._history:
+                    if message[0] > last_event_id:
+                        subscription.deliver(message)
+            self._subscribers.add(subscription)
+        try:
+            yield subscription
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscription)
+
+broker = EventBroker()
+
+def publish(event: str, data: Dict) -> int:
+    """Publish an event on the process-wide broker."""
+    return broker.publish(event, data)
+
+def parse_last_event_id(value: Optional[str]) -> Optional[int]:
+    """Parse a Last-Event-ID header, ignoring malformed values."""
+    return int(value) if value and value.isdigit() else None
+
+def wanted(message: Message, vendor: Optional[str]) -> bool:
+    """Check whether a stream for vendor (None for every vendor) should receive an event."""
+    event_vendor = message[2].get("vendor")
+    return vendor is None or event_vendor is None or event_vendor == vendor
+
+def format_event(message: Message) -> str:
+    """Format an event in the text/event-stream wire format."""
+    event_id, event, data = message
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def stream_events(vendor: Optional[str] = None, last_event_id: Optional[int] = None) -> Iterator[str]:
+    """Stream events for vendor until the client disconnects or falls behind."""
+    with broker.subscribe(Subscription(), last_event_id) as subscription:
+        yield f"retry: {RETRY_MS}\n\n"
+        while not subscription.closed:
+            message = subscription.get(HEARTBEAT_INTERVAL)
+            if message is None:
+                # Comment lines keep proxies from timing out idle streams
+                yield ": keepalive\n\n"
+            elif wanted(message, vendor):
+                yield format_event(message)
+
+async def stream_events_async(vendor: Optional[str] = None, last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+    """stream_events on the event loop, waiting without holding a worker thread."""
+    with broker.subscribe(AsyncSubscription(asyncio.get_running_loop()), last_event_id) as subscription:
+        yield f"retry: {RETRY_MS}\n\n"
+        while not subscription.closed:
+            message = await subscription.get(HEARTBEAT_INTERVAL)
+            if message is None:
+                yield ": keepalive\n\n"
+            elif wanted(message, vendor):
+                yield format_event(message)
@@ -0,0 +1,400 @@
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional
+from urllib.parse import urlparse
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import random
+import threading
+import time
+import logging
+from metrics import inc, timed
+
+try:
+    import httpx
+    HAS_HTTPX = True
+except ImportError:
+    HAS_HTTPX = False
+
+logger = logging.getLogger(__name__)
+logging.getLogger('httpx').setLevel(logging.WARNING)  # httpx logs every request at INFO
+
+# Fetch settings
+MAX_WORKERS = int(os.getenv('SCRAPER_MAX_WORKERS', '8'))
+MIN_REQUEST_INTERVAL = float(os.getenv('SCRAPER_MIN_REQUEST_INTERVAL', '0.02'))  # Seconds between requests to one host
+REQUEST_TIMEOUT = 10
+# Retry, circuit breaker and time budget settings
+MAX_RETRIES = int(os.getenv('SCRAPER_MAX_RETRIES', '3'))
+BACKOFF_BASE = float(os.getenv('SCRAPER_BACKOFF_BASE', '0.5'))  # Seconds before the first retry, doubling per attempt
+BACKOFF_MAX = float(os.getenv('SCRAPER_BACKOFF_MAX', '8'))
+BREAKER_THRESHOLD = int(os.getenv('SCRAPER_BREAKER_THRESHOLD', '5'))  # Consecutive failures that open a host's circuit
+BREAKER_COOLDOWN = float(os.getenv('SCRAPER_BREAKER_COOLDOWN', '30'))  # Seconds before a trial request is let through
+SCRAPE_BUDGET = float(os.getenv('SCRAPER_TIME_BUDGET', '120'))  # Seconds one vendor scrape may spend fetching
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+CACHE_PATH = os.getenv(
+    'SCRAPER_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'page_cache.json')
+)
+
+_session = None
+_session_lock = threading.Lock()
+
+class RateLimiter:
+    """Space out requests to the same host by a minimum interval."""
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, host: str) -> float:
+        """Reserve the next request slot for host, returning seconds until it starts."""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.min_interval
+        return slot - now
+
+    def wait(self, host: str):
+        """Block until the next request slot for host is available."""
+        delay = self.reserve(host)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, host: str):
+        """Sleep without blocking the event loop until the next slot for host."""
+        delay = self.reserve(host)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+rate_limiter = RateLimiter(MIN_REQUEST_INTERVAL)
+
+class FetchError(Exception):
+    """A request that was not sent because of the fetch policy."""
+
+class CircuitOpenError(FetchError):
+    pass
+
+class BudgetExhaustedError(FetchError):
+    pass
+
+class CircuitBreaker:
+    """Stop sending requests to hosts that keep failing.
+
+    After threshold consecutive failures a host's circuit opens and its
+    requests fail fast for cooldown seconds. Then one trial request is let
+    through: success closes the circuit, failure opens it again.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._hosts = {}  # host -> {"failures", "opened_at", "trial"}
+        self._lock = threading.Lock()
+
+    def allow(self, host: str) -> bool:
+        """Check whether a request to host may be sent now."""
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state["failures"] < self.threshold:
+                return True
+            if state["trial"] or time.monotonic() - state["opened_at"] < self.cooldown:
+                return False
+            state["trial"] = True
+            return True
+
+    def record_success(self, host: str):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def record_failure(self, host: str):
+        with self._lock:
+            state = self._hosts.setdefault(host, {"failures": 0, "opened_at": 0.0, "trial": False})
+            state["failures"] += 1
+            if state["failures"] >= self.threshold:
+                if state["failures"] == self.threshold or state["trial"]:
+                    logger.warning(f"Circuit for {host} opened after {state['failures']} consecutive failures")
+                    inc("fetch_circuit_opened_total", help_text="Times a host's circuit breaker opened", host=host)
+                state["opened_at"] = time.monotonic()
+                state["trial"] = False
+
+circuit_breaker = CircuitBreaker(BREAKER_THRESHOLD, BREAKER_COOLDOWN)
+
+class FetchBudget:
+    """Wall-clock time budget shared by every request of one scrape, retries included."""
+
+    def __init__(self, seconds: float = SCRAPE_BUDGET):
+        self.deadline = time.monotonic() + seconds
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.monotonic())
+
+def backoff_delay(attempt: int, retry_after: Optional[str] = None) -> float:
+    """Seconds to wait before retry number attempt (from 0): full-jitter exponential backoff.
+
+    A numeric Retry-After from the server is honoured instead, up to BACKOFF_MAX.
+    """
+    if retry_after and retry_after.strip().isdigit():
+        return min(float(retry_after), BACKOFF_MAX)
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def _retry_delay(attempt: int, retryable: bool, retry_after: Optional[str], budget: Optional[FetchBudget]) -> Optional[float]:
+    """Seconds to wait before retrying a failed request, or None to give up."""
+    if not retryable or attempt >= MAX_RETRIES:
+        return None
+    delay = backoff_delay(attempt, retry_after)
+    if budget is not None and delay >= budget.remaining():
+        return None
+    return delay
+
+def _before_request(host: str, budget: Optional[FetchBudget]) -> float:
+    """Check the circuit and budget for a request, returning its timeout."""
+    if not circuit_breaker.allow(host):
+        raise CircuitOpenError(f"Circuit open for {host}, skipping request")
+    if budget is None:
+        return REQUEST_TIMEOUT
+    remaining = budget.remaining()
+    if remaining <= 0:
+        raise BudgetExhaustedError("Scrape time budget exhausted")
+    return min(REQUEST_TIMEOUT, remaining)
+
+def _is_retryable(error: requests.RequestException) -> bool:
+    """Connection errors, timeouts and overloaded/5xx responses are worth retrying."""
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code in RETRY_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+def get_session() -> requests.Session:
+    """Get the shared keep-alive session, creating it on first use."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=MAX_WORKERS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+class PageCache:
+    """Persistent per-URL cache of validators and extracted records for fetched pages.
+
+    Also holds small named values (such as discovered site layouts) that
+    should be kept and invalidated together with the page entries.
+    """
+
+    def __init__(self, path: Optional[str] = None, version: int = 1):
+        self.path = path or CACHE_PATH
+        self.version = version
+        self._entries = {}
+        self._meta = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get("version") == self.version:
+                self._entries = data.get("entries", {})
+                self._meta = data.get("meta", {})
+            else:
+                logger.info(f"Discarding page cache with version {data.get('version')}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load page cache from {self.path}: {str(e)}")
+
+    def get(self, url: str) -> Optional[Dict]:
+        """Get the cache entry for a URL."""
+        with self._lock:
+            return self._entries.get(url)
+
+    def put(self, url: str, etag: Optional[str], last_modified: Optional[str], body_hash: str,
+            records: List, **extra):
+        """Store validators, body hash and extracted records (plus any extra fields) for a URL."""
+        with self._lock:
+            self._entries[url] = {
+                "etag": etag,
+                "last_modified": last_modified,
+                "body_hash": body_hash,
+                "records": records,
+                **extra
+            }
+
+    def get_meta(self, key: str) -> Optional[Dict]:
+        """Get a named value stored alongside the page entries."""
+        with self._lock:
+            return self._meta.get(key)
+
+    def put_meta(self, key: str, value: Dict):
+        """Store a named value alongside the page entries."""
+        with self._lock:
+            self._meta[key] = value
+
+    def save(self):
+        """Write the cache to disk atomically."""
+        with self._lock:
+            data = {"version": self.version, "entries": self._entries, "meta": self._meta}
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save page cache to {self.path}: {str(e)}")
+
+def hash_body(text: str) -> str:
+    """Hash a page body for change detection."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def fetch_page(url: str, headers: Dict, cache: Optional[PageCache] = None,
+               limiter: Optional[RateLimiter] = None, budget: Optional[FetchBudget] = None) -> Dict:
+    """Fetch a single page through the shared session.
+
+    With a cache, sends conditional request headers and reports whether the
+    page is unchanged (a 304, or a 200 whose body hash matches the cache).
+    Transient failures are retried with jittered backoff while the host's
+    circuit is closed and the budget lasts.
+    """
+    entry = cache.get(url) if cache else None
+    request_headers = _conditional_headers(headers, entry)
+    host = urlparse(url).netloc
+
+    for attempt in itertools.count():
+        timeout = _before_request(host, budget)
+        (limiter or rate_limiter).wait(host)
+        start = time.perf_counter()
+        try:
+            with timed("fetch"):
+                response = get_session().get(url, headers=request_headers, timeout=timeout)
+                if not (entry and response.status_code == 304):
+                    response.raise_for_status()
+                    text = response.text
+            break
+        except requests.RequestException as e:
+            retryable = _is_retryable(e)
+            if retryable:
+                circuit_breaker.record_failure(host)
+            else:
+                circuit_breaker.record_success(host)  # The host answered, the request itself is bad
+            retry_after = e.response.headers.get('Retry-After') if e.response is not None else None
+            delay = _retry_delay(attempt, retryable, retry_after, budget)
+            if delay is None:
+                raise
+            logger.info(f"Retrying {url} in {delay:.2f}s after: {str(e)}")
+            inc("fetch_retries_total", help_text="Requests retried after a transient failure", host=host)
+            time.sleep(delay)
+    circuit_breaker.record_success(host)
+    elapsed = time.perf_counter() - start
+
+    if entry and response.status_code == 304:
+        return {"url": url, "text": None, "error": None, "cache": "hit", "entry": entry, "elapsed": elapsed}
+    return _page_result(url, entry, text, response.headers, elapsed)
+
+def _conditional_headers(headers: Dict, entry: Optional[Dict]) -> Dict:
+    """Add If-None-Match/If-Modified-Since from a cache entry to request headers."""
+    request_headers = dict(headers)
+    if entry:
+        if entry.get("etag"):
+            request_headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            request_headers["If-Modified-Since"] = entry["last_modified"]
+    return request_headers
+
+def _page_result(url: str, entry: Optional[Dict], text: str, response_headers, elapsed: float) -> Dict:
+    """Build the result for a 200 response, reporting a hit when the body hash is unchanged."""
+    body_hash = hash_body(text)
+    result = {
+        "url": url,
+        "text": text,
+        "error": None,
+        "etag": response_headers.get("ETag"),
+        "last_modified": response_headers.get("Last-Modified"),
+        "body_hash": body_hash,
+        "cache": "miss",
+        "entry": None,
+        "elapsed": elapsed
+    }
+    if entry and entry.get("body_hash") == body_hash:
+        result["cache"] = "hit"
+        result["entry"] = entry
+    return result
+
+def fetch_pages(urls: List[str], headers: Dict, max_workers: Optional[int] = None,
+                cache: Optional[PageCache] = None, limiter: Optional[RateLimiter] = None,
+                budget: Optional[FetchBudget] = None) -> List[Dict]:
+    """Fetch pages concurrently, returning one result per URL in input order."""
+    def fetch(url: str) -> Dict:
+        try:
+            return fetch_page(url, headers, cache, limiter, budget)
+        except (requests.RequestException, FetchError) as e:
+            return {"url": url, "text": None, "error": e, "cache": "error", "entry": None, "elapsed": 0.0}
+
+    if not urls:
+        return []
+
+    workers = min(max_workers or MAX_WORKERS, len(urls))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='fetch') as executor:
+        # map() yields results in submission order regardless of completion order
+        return list(executor.map(fetch, urls))
+
+async def fetch_pages_async(urls: List[str], headers: Dict, max_workers: Optional[int] = None,
+                            cache: Optional[PageCache] = None, limiter: Optional[RateLimiter] = None,
+                            budget: Optional[FetchBudget] = None) -> List[Dict]:
+    """Fetch pages concurrently with httpx on the running event loop.
+
+    Same results and retry policy as fetch_pages, with at most max_workers
+    requests in flight over one keep-alive connection pool.
+    """
+    if not urls:
+        return []
+
+    workers = min(max_workers or MAX_WORKERS, len(urls))
+    limiter = limiter or rate_limiter
+    semaphore = asyncio.Semaphore(workers)
+    limits = httpx.Limits(max_connections=workers, max_keepalive_connections=workers)
+
+    async def fetch(client, url: str) -> Dict:
+        entry = cache.get(url) if cache else None
+        host = urlparse(url).netloc
+        async with semaphore:
+            for attempt in itertools.count():
+                start = time.perf_counter()
+                try:
+                    timeout = _before_request(host, budget)
+                    await limiter.wait_async(host)
+                    with timed("fetch"):
+                        response = await client.get(url, headers=_conditional_headers(headers, entry), timeout=timeout)
+                        if not (entry and response.status_code == 304):
+                            response.raise_for_status()
+                    break
+                except FetchError as e:
+                    return {"url": url, "text": None, "error": e, "cache": "error", "entry": None, "elapsed": 0.0}
+                except httpx.HTTPError as e:
+                    status = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+                    retryable = status in RETRY_STATUSES if status is not None else isinstance(e, httpx.TransportError)
+                    if retryable:
+                        circuit_breaker.record_failure(host)
+                    else:
+                        circuit_breaker.record_success(host)  # The host answered, the request itself is bad
+                    retry_after = e.response.headers.get('Retry-After') if status is not None else None
+                    delay = _retry_delay(attempt, retryable, retry_after, budget)
+                    if delay is None:
+                        return {"url": url, "text": None, "error": e, "cache": "error", "entry": None, "elapsed": 0.0}
+                    logger.info(f"Retrying {url} in {delay:.2f}s after: {str(e)}")
+                    inc("fetch_retries_total", help_text="Requests retried after a transient failure", host=host)
+                    await asyncio.sleep(delay)
+        circuit_breaker.record_success(host)
+        elapsed = time.perf_counter() - start
+        if entry and response.status_code == 304:
+            return {"url": url, "text": None, "error": None, "cache": "hit", "entry": entry, "elapsed": elapsed}
+        return _page_result(url, entry, response.text, response.headers, elapsed)
+
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT, limits=limits, follow_redirects=True) as client:
+        return list(await asyncio.gather(*(fetch(client, url) for url in urls)))
@@ -0,0 +1,304 @@
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, Iterable, Optional, Tuple
+import hashlib
+import json
+import os
+import threading
+import logging
+from fetcher import get_session, REQUEST_TIMEOUT
+from metrics import inc, timed
+from vendors import DEFAULT_HEADERS
+
+try:
+    from PIL import Image
+    HAS_PIL = True
+except ImportError:
+    HAS_PIL = False
+
+logger = logging.getLogger(__name__)
+
+# Image proxy settings
+IMAGE_CACHE_DIR = os.getenv(
+    'IMAGE_CACHE_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'images')
+)
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_MB', '256')) * 1024 * 1024
+THUMBNAIL_WIDTHS = (160, 320, 640)
+DEFAULT_WIDTH = 320
+MAX_SOURCE_BYTES = 10 * 1024 * 1024  # Refuse to proxy larger source images
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+RASTER_MIMETYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp')  # Only these are proxied
+# Sent with every proxied image so a mislabeled source cannot run as a page from our origin
+IMAGE_SECURITY_HEADERS = {
+    'Content-Security-Policy': "default-src 'none'",
+    'X-Content-Type-Options': 'nosniff'
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+class ImageCache:
+    """Content-addressed on-disk cache of source images and their thumbnails.
+
+    Source URLs are registered under a hash of the URL, which is what
+    /img/<hash> serves, so only scraped images can be proxied. Downloaded
+    images are stored under a hash of their bytes and thumbnails are made
+    on first request. Files are evicted least recently used first once the
+    cache is over max_bytes, along with the sources that pointed at them.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory or IMAGE_CACHE_DIR
+        self.max_bytes = max_bytes
+        self._sources_path = os.path.join(self.directory, 'sources.json')
+        self._sources = {}  # url hash -> {"url", "content"}
+        self._files = OrderedDict()  # file name -> size, least recently used first
+        self._size = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()  # Keeps registry snapshots written in the order they were taken
+        self._downloads = {}  # url hash -> lock, so each image is downloaded once
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        self._load_sources()
+        entries = []
+        for filename in os.listdir(self.directory):
+            if filename == 'sources.json' or filename.endswith('.tmp'):
+                continue
+            stat = os.stat(os.path.join(self.directory, filename))
+            entries.append((stat.st_mtime, filename, stat.st_size))
+        for _, filename, size in sorted(entries):
+            self._files[filename] = size
+            self._size += size
+
+    def _load_sources(self):
+        try:
+            with open(self._sources_path, 'r') as f:
+                self._sources.update(json.load(f))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not load image sources from {self._sources_path}: {str(e)}")
+
+    def _save_sources(self):
+        """Write the registry to disk without holding the lock that lookups wait on."""
+        with self._save_lock:
+            with self._lock:
+                sources = {url_hash: dict(source) for url_hash, source in self._sources.items()}
+            tmp_path = f"{self._sources_path}.tmp"
+            try:
+                with open(tmp_path, 'w') as f:
+                    json.dump(sources, f)
+                os.replace(tmp_path, self._sources_path)
+            except OSError as e:
+                logger.warning(f"Could not save image sources to {self._sources_path}: {str(e)}")
+
+    def register(self, url: str) -> str:
+        """Register a source image URL and return its hash."""
+        return self.register_many([url])[url]
+
+    def register_many(self, urls: Iterable[str]) -> Dict[str, str]:
+        """Register source image URLs, saving the registry once, and return url -> hash."""
+        hashes = {url: hashlib.sha256(url.encode('utf-8')).hexdigest()[:32] for url in urls}
+        added = False
+        with self._lock:
+            for url, url_hash in hashes.items():
+                if url_hash not in self._sources:
+                    self._sources[url_hash] = {"url": url, "content": None}
+                    added = True
+        if added:
+            self._save_sources()
+        return hashes
+
+    def get_source(self, url_hash: str) -> Optional[Dict]:
+        """Get a registered source, reloading the registry in case another process added it."""
+        with self._lock:
+            source = self._sources.get(url_hash)
+            if source is None:
+                self._load_sources()
+                source = self._sources.get(url_hash)
+            return dict(source) if source else None
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.directory, filename)
+
+    def read(self, filename: str) -> Optional[str]:
+        """Get the path of a cached file and mark it recently used."""
+        with self._lock:
+            if filename not in self._files:
+                return None
+            self._files.move_to_end(filename)
+        path = self._path(filename)
+        try:
+            os.utime(path)  # Keep the LRU order across restarts
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._files.pop(filename, 0)
+            return None
+        return path
+
+    def write(self, filename: str, data: bytes) -> str:
+        """Store a file atomically and evict old files over the size cap."""
+        path = self._path(filename)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        evicted = []
+        with self._lock:
+            self._size -= self._files.pop(filename, 0)
+            self._files[filename] = len(data)
+            self._size += len(data)
+            while self._size > self.max_bytes and len(self._files) > 1:
+                old, size = self._files.popitem(last=False)
+                self._size -= size
+                evicted.append(old)
+            # Forget sources whose download was evicted; serving a drop registers its image again
+            evicted_contents = {old[:-len('.src')] for old in evicted if old.endswith('.src')}
+            pruned = [url_hash for url_hash, source in self._sources.items() if source["content"] in evicted_contents]
+            for url_hash in pruned:
+                del self._sources[url_hash]
+        if pruned:
+            self._save_sources()
+        for old in evicted:
+            try:
+                os.remove(self._path(old))
+            except FileNotFoundError:
+                pass
+        if evicted:
+            inc("image_cache_evictions_total", len(evicted), help_text="Image cache files evicted to stay under the size cap")
+        return path
+
+    def _source_image(self, url_hash: str, source: Dict) -> Tuple[str, str]:
+        """Get the downloaded source image for a hash, downloading it if needed.
+
+        Returns the content hash and the path of the stored image.
+        """
+        with self._lock:
+            download_lock = self._downloads.setdefault(url_hash, threading.Lock())
+        with download_lock:
+            current = self.get_source(url_hash) or source
+            content = current["content"]
+            path = self.read(f"{content}.src") if content else None
+            if path:
+                return content, path
+
+            data = _download(source["url"])
+            content = hashlib.sha256(data).hexdigest()[:32]
+            path = self.write(f"{content}.src", data)
+            with self._lock:
+                self._sources[url_hash] = {"url": source["url"], "content": content}
+            self._save_sources()
+            return content, path
+
+    def thumbnail(self, url_hash: str, width: int, image_format: str) -> Optional[Dict]:
+        """Get the path, mimetype and ETag of a thumbnail, making it on first request.
+
+        Returns None for unknown hashes. Without Pillow, or for images it
+        cannot read, the source image is served unresized; sources that are
+        not PNG, JPEG, GIF or WebP (such as SVG) raise ValueError.
+        """
+        source = self.get_source(url_hash)
+        if source is None:
+            return None
+
+        content, source_path = self._source_image(url_hash, source)
+        filename = f"{content}_{width}.{image_format}"
+        path = self.read(filename) if HAS_PIL else None
+        if path is None and HAS_PIL:
+            try:
+                with timed("thumbnail", format=image_format):
+                    data = _resize(source_path, width, image_format)
+                path = self.write(filename, data)
+                inc("image_thumbnails_total", help_text="Thumbnails generated", format=image_format)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not resize image {url_hash}, serving it unresized: {str(e)}")
+        if path is None:
+            with open(source_path, 'rb') as f:
+                mimetype = _sniff_mimetype(f.read(16))
+            if mimetype is None:
+                raise ValueError("Not a raster image")
+            return {"path": source_path, "mimetype": mimetype, "etag": content}
+        return {"path": path, "mimetype": f"image/{image_format}", "etag": f"{content}-{width}-{image_format}"}
+
+def get_image_cache() -> ImageCache:
+    """Get the shared image cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ImageCache()
+        return _cache
+
+def proxy_url(url: Optional[str]) -> Optional[str]:
+    """Get the /img URL that serves thumbnails of a source image."""
+    if not url:
+        return None
+    return f"/img/{get_image_cache().register(url)}"
+
+def proxy_urls(urls: Iterable[Optional[str]]) -> Dict[str, str]:
+    """Get the /img URLs for many source images, registering them with one registry save."""
+    hashes = get_image_cache().register_many({url for url in urls if url})
+    return {url: f"/img/{url_hash}" for url, url_hash in hashes.items()}
+
+def pick_width(requested: Optional[int]) -> int:
+    """Round a requested width up to the nearest thumbnail width."""
+    if not requested:
+        return DEFAULT_WIDTH
+    for width in THUMBNAIL_WIDTHS:
+        if requested <= width:
+            return width
+    return THUMBNAIL_WIDTHS[-1]
+
+def _download(url: str) -> bytes:
+    """Download a source image, refusing anything but raster images and oversized bodies."""
+    with timed("image_download"):
+        response = get_session().get(url, headers=DEFAULT_HEADERS, timeout=REQUEST_TIMEOUT, stream=True)
+        try:
+            response.raise_for_status()
+            content_type = response.headers.get('Content-Type', '')
+            mimetype = content_type.split(';')[0].strip().lower()
+            if mimetype and mimetype not in RASTER_MIMETYPES:
+                raise ValueError(f"Not a raster image: {content_type}")
+            data = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                data.extend(chunk)
+                if len(data) > MAX_SOURCE_BYTES:
+                    raise ValueError(f"Image larger than {MAX_SOURCE_BYTES} bytes")
+            if _sniff_mimetype(bytes(data[:16])) is None:
+                raise ValueError("Not a raster image")
+            return bytes(data)
+        finally:
+            response.close()
+
+def _resize(source_path: str, width: int, image_format: str) -> bytes:
+    """Resize an image to at most width pixels wide and encode it as WebP or JPEG."""
+    with Image.open(source_path) as image:
+        image.seek(0)  # First frame of animated images
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        output = BytesIO()
+        if image_format == 'webp':
+            image.save(output, 'WEBP', quality=WEBP_QUALITY)
+        else:
+            if image.mode not in ('RGB', 'L'):
+                image = image.convert('RGBA')
+                background = Image.new('RGB', image.size, (255, 255, 255))
+                background.paste(image, mask=image.getchannel('A'))
+                image = background
+            image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+        return output.getvalue()
+
+def _sniff_mimetype(header: bytes) -> Optional[str]:
+    """Get a raster image's mimetype from its first bytes, or None for anything else."""
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if header.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
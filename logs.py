@@ -0,0 +1,129 @@
+from typing import Optional, TextIO
+import atexit
+import itertools
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+from metrics import inc
+
+# Logging settings
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # text or json (one object per line)
+LOG_ASYNC = os.getenv('LOG_ASYNC', 'true').lower() == 'true'  # Write records from a background thread
+LOG_SAMPLE_EVERY = int(os.getenv('LOG_SAMPLE_EVERY', '100'))  # Per-item debug messages kept: one in N
+LOG_QUEUE_SIZE = 10000  # Records waiting for the writer thread before new ones are dropped
+
+_listener = None  # QueueListener writing records from the background thread
+_samples = {}  # sample key -> call counter
+_sample_every = LOG_SAMPLE_EVERY
+
+class StructuredFormatter(logging.Formatter):
+    """Format records as text or JSON lines, including fields passed with extra={"fields": {...}}."""
+
+    def __init__(self, json_lines: bool = False):
+        super().__init__(logging.BASIC_FORMAT)
+        self.json_lines = json_lines
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, 'fields', None) or {}
+        if not self.json_lines:
+            text = super().format(record)
+            if fields:
+                text += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+            return text
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **fields
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+_traceback_formatter = logging.Formatter()
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to the writer thread without waiting on its I/O or on a full queue."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Render the message and traceback on the calling thread, as the stdlib QueueHandler does.
+
+        Arguments may be mutated after the logging call returns, so they
+        cannot be left for the writer thread. Level and fields are kept for
+        the writer's formatter.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            inc("log_records_dropped_total", help_text="Log records dropped because the log queue was full")
+
+def configure_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT, use_queue: bool = LOG_ASYNC,
+                      sample_every: int = LOG_SAMPLE_EVERY, stream: Optional[TextIO] = None):
+    """Replace the root logger's handlers with one writing to stream (default stderr).
+
+    With use_queue, request and scraper threads render each message and
+    enqueue it, and a background thread formats and writes the lines. Safe to call again to switch
+    settings; the previous writer thread is flushed and stopped.
+    """
+    global _listener, _sample_every
+    _sample_every = max(sample_every, 1)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(StructuredFormatter(json_lines=log_format == 'json'))
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    if use_queue:
+        log_queue = queue.Queue(LOG_QUEUE_SIZE)
+        _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+        _listener.start()
+        root.addHandler(NonBlockingQueueHandler(log_queue))
+    else:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+atexit.register(_stop_listener)
+
+def log_fields(logger: logging.Logger, level: int, message: str, **fields):
+    """Log a fixed message with structured fields, building nothing when the level is disabled."""
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"fields": fields})
+
+def sampled(key: str) -> bool:
+    """Check whether this call is the one in every sample_every calls to log for key."""
+    counter = _samples.get(key)
+    if counter is None:
+        counter = _samples.setdefault(key, itertools.count())
+    return next(counter) % _sample_every == 0
+
+def debug_sampled(logger: logging.Logger, key: str, message: str, *args):
+    """Log a per-item debug message for one in sample_every items sharing key.
+
+    Costs one level check when debug logging is off.
+    """
+    if logger.isEnabledFor(logging.DEBUG) and sampled(key):
+        logger.debug(message, *args, extra={"fields": {"sample_every": _sample_every}})
@@ -0,0 +1,152 @@
+from math import ceil
+from typing import List, Optional, Tuple
+import os
+import re
+import unicodedata
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Lowest trigram similarity (0-1) that counts as owning a drop
+MATCH_THRESHOLD = float(os.getenv('MATCH_THRESHOLD', '0.6'))
+
+# Lowest trigram similarity (0-1) for a word to count as the same word spelled differently
+WORD_THRESHOLD = 0.4
+# Bumped when the matching rules change, so persisted comparisons are recomputed
+MATCH_RULES_VERSION = 2
+
+# Words that vendors add or drop freely and that say nothing about the set
+STOPWORDS = {"keycap", "keycaps", "set", "kit", "the"}
+# Joining words ("Kuro & Shiro" vs "Kuro Shiro") that need no counterpart when words are compared
+CONNECTORS = {"and", "of"}
+
+_TOKEN_RE = re.compile(r'[a-z0-9+]+')
+
+def canonical_name(name: str) -> str:
+    """Reduce a name to its lowercase ASCII tokens, dropping punctuation and filler words."""
+    text = unicodedata.normalize('NFKD', name)
+    text = ''.join(c for c in text if not unicodedata.combining(c)).lower().replace('&', ' and ')
+    tokens = _TOKEN_RE.findall(text)
+    kept = [token for token in tokens if token not in STOPWORDS]
+    return ' '.join(kept or tokens)
+
+def version_tokens(canonical: str) -> frozenset:
+    """Tokens with digits, such as revisions (r2) and editions, which must agree to match."""
+    return frozenset(token for token in canonical.split() if any(c.isdigit() for c in token))
+
+def word_tokens(canonical: str) -> frozenset:
+    """Tokens without digits: the set name, colorways and modifiers such as "dark" or "red"."""
+    return frozenset(token for token in canonical.split()
+                     if not any(c.isdigit() for c in token) and token not in CONNECTORS)
+
+def _same_word(word: str, other: str) -> bool:
+    """Check whether two words are the same word up to a typo, a spacing difference or an affix."""
+    if word == other:
+        return True
+    if min(len(word), len(other)) >= 3 and (word in other or other in word):
+        return True  # "hammerhead" vs "hammer head", "botanical" vs "botanicals"
+    grams, other_grams = trigrams(word), trigrams(other)
+    overlap = len(grams & other_grams)
+    return overlap / (len(grams) + len(other_grams) - overlap) >= WORD_THRESHOLD
+
+def words_agree(words: frozenset, other: frozenset) -> bool:
+    """Check that every word on each side has a counterpart on the other.
+
+    A colorway or modifier present on only one side ("GMK Olivia Dark" vs
+    "GMK Olivia", "GMK Red Samurai" vs "GMK Samurai") names a different set.
+    """
+    return (all(any(_same_word(word, candidate) for candidate in other) for word in words)
+            and all(any(_same_word(word, candidate) for candidate in words) for word in other))
+
+def trigrams(canonical: str) -> frozenset:
+    """Character trigrams of a canonical name, padded so word edges count."""
+    padded = f"  {canonical} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+class MatchIndex:
+    """Trigram index over a set of names for fast similarity lookups.
+
+    Similarity is the Jaccard index of two names' trigram sets, so names
+    that differ only in case, punctuation or filler words score 1.0.
+    Names with different revision or edition tokens (GMK Olivia vs GMK
+    Olivia R2) never match, nor do names where a word on one side has no
+    counterpart on the other (GMK Olivia Dark vs GMK Olivia).
+
+    Lookups only verify candidates that share one of the query's rarest
+    trigrams (prefix filtering), so they do not scan every indexed name.
+    """
+
+    def __init__(self, threshold: float = MATCH_THRESHOLD):
+        self.threshold = threshold
+        self._grams = {}  # name -> trigram set
+        self._versions = {}  # name -> version tokens
+        self._words = {}  # name -> word tokens
+        self._postings = {}  # trigram -> names containing it
+
+    def __len__(self) -> int:
+        return len(self._grams)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._grams
+
+    def add(self, name: str):
+        """Add a name to the index."""
+        if name in self._grams:
+            return
+        canonical = canonical_name(name)
+        grams = trigrams(canonical)
+        self._grams[name] = grams
+        self._versions[name] = version_tokens(canonical)
+        self._words[name] = word_tokens(canonical)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(name)
+
+    def remove(self, name: str):
+        """Remove a name from the index."""
+        grams = self._grams.pop(name, None)
+        self._versions.pop(name, None)
+        self._words.pop(name, None)
+        for gram in grams or ():
+            names = self._postings[gram]
+            names.discard(name)
+            if not names:
+                del self._postings[gram]
+
+    def search(self, name: str) -> List[Tuple[str, float]]:
+        """Get every indexed name at least threshold-similar to name, best first."""
+        if name in self._grams:
+            grams, versions, words = self._grams[name], self._versions[name], self._words[name]
+        else:
+            canonical = canonical_name(name)
+            grams, versions, words = trigrams(canonical), version_tokens(canonical), word_tokens(canonical)
+        if not grams:
+            return []
+
+        # Jaccard >= t needs an overlap of at least t * |grams|, so any match
+        # must contain one of the len(grams) - k + 1 rarest query trigrams
+        k = max(1, ceil(self.threshold * len(grams)))
+        rarest = sorted(grams, key=lambda gram: len(self._postings.get(gram, ())))[:len(grams) - k + 1]
+        candidates = set()
+        for gram in rarest:
+            candidates.update(self._postings.get(gram, ()))
+
+        results = []
+        for candidate in candidates:
+            other = self._grams[candidate]
+            if not self.threshold * len(grams) <= len(other) <= len(grams) / max(self.threshold, 1e-9):
+                continue
+            if self._versions[candidate] != versions:
+                continue
+            overlap = len(grams & other)
+            score = overlap / (len(grams) + len(other) - overlap)
+            if score >= self.threshold and words_agree(words, self._words[candidate]):
+                results.append((candidate, score))
+        results.sort(key=lambda result: (-result[1], result[0] != name, result[0]))
+        return results
+
+    def best_match(self, name: str) -> Optional[Tuple[str, float]]:
+        """Get the most similar indexed name and its score, or None below the threshold."""
+        if name in self._grams:
+            return name, 1.0
+        results = self.search(name)
+        return results[0] if results else None
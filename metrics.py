@@ -0,0 +1,114 @@
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Tuple
+import threading
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+NAMESPACE = "keycapvault"
+QUANTILES = (0.5, 0.95, 0.99)
+WINDOW_SIZE = 1024  # Observations kept per series for quantiles
+
+_lock = threading.Lock()
+_summaries = {}  # name -> {"help": str, "series": {labels: {"count", "sum", "window"}}}
+_counters = {}  # name -> {"help": str, "series": {labels: value}}
+
+def _label_key(labels: Dict) -> Tuple:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def observe(name: str, value: float, help_text: str = "", **labels):
+    """Record an observation (usually seconds) in a summary metric."""
+    key = _label_key(labels)
+    with _lock:
+        metric = _summaries.setdefault(name, {"help": help_text, "series": {}})
+        series = metric["series"].get(key)
+        if series is None:
+            series = metric["series"][key] = {"count": 0, "sum": 0.0, "window": deque(maxlen=WINDOW_SIZE)}
+        series["count"] += 1
+        series["sum"] += value
+        series["window"].append(value)
+
+def inc(name: str, amount: float = 1, help_text: str = "", **labels):
+    """Increment a counter metric."""
+    key = _label_key(labels)
+    with _lock:
+        metric = _counters.setdefault(name, {"help": help_text, "series": {}})
+        metric["series"][key] = metric["series"].get(key, 0) + amount
+
+@contextmanager
+def timed(stage: str, **labels):
+    """Time a block as a pipeline stage, counting calls that raise as errors."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        inc("stage_errors_total", help_text="Errors raised by pipeline stages", stage=stage, **labels)
+        raise
+    finally:
+        observe("stage_duration_seconds", time.perf_counter() - start,
+                help_text="Time spent in each pipeline stage", stage=stage, **labels)
+
+def _quantile(values, q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+def _format_labels(key: Tuple, extra: Tuple = ()) -> str:
+    pairs = key + extra
+    if not pairs:
+        return ""
+    escaped = (
+        f'{label}="' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for label, value in pairs
+    )
+    return "{" + ",".join(escaped) + "}"
+
+def render_prometheus() -> str:
+    """Render all metrics in the Prometheus text exposition format.
+
+    Summaries report p50/p95/p99 over the last WINDOW_SIZE observations
+    of each series, plus lifetime _sum and _count.
+    """
+    lines = []
+    with _lock:
+        for name, metric in sorted(_summaries.items()):
+            full_name = f"{NAMESPACE}_{name}"
+            if metric["help"]:
+                lines.append(f"# HELP {full_name} {metric['help']}")
+            lines.append(f"# TYPE {full_name} summary")
+            for key, series in sorted(metric["series"].items()):
+                for q in QUANTILES:
+                    value = _quantile(series["window"], q) if series["window"] else 0.0
+                    lines.append(f"{full_name}{_format_labels(key, (('quantile', str(q)),))} {value:.6f}")
+                lines.append(f"{full_name}_sum{_format_labels(key)} {series['sum']:.6f}")
+                lines.append(f"{full_name}_count{_format_labels(key)} {series['count']}")
+        for name, metric in sorted(_counters.items()):
+            full_name = f"{NAMESPACE}_{name}"
+            if metric["help"]:
+                lines.append(f"# HELP {full_name} {metric['help']}")
+            lines.append(f"# TYPE {full_name} counter")
+            for key, value in sorted(metric["series"].items()):
+                lines.append(f"{full_name}{_format_labels(key)} {value:g}")
+    return "\n".join(lines) + "\n"
+
+def get_summary(name: str) -> Dict[Tuple, Dict]:
+    """Get count, sum and quantiles for each series of a summary metric."""
+    with _lock:
+        metric = _summaries.get(name)
+        if metric is None:
+            return {}
+        result = {}
+        for key, series in metric["series"].items():
+            stats = {"count": series["count"], "sum": series["sum"]}
+            for q in QUANTILES:
+                stats[f"p{int(q * 100)}"] = _quantile(series["window"], q) if series["window"] else 0.0
+            result[key] = stats
+        return result
+
+def reset():
+    """Clear all recorded metrics."""
+    with _lock:
+        _summaries.clear()
+        _counters.clear()
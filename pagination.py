@@ -0,0 +1,151 @@
+from typing import List, Dict, Iterable, Optional
+from urllib.parse import urljoin, urlparse, parse_qsl
+import os
+import re
+import time
+import logging
+from vendors import page_url
+
+logger = logging.getLogger(__name__)
+
+# Discovery settings
+SPECULATIVE_PAGES = max(1, int(os.getenv('SCRAPER_SPECULATIVE_PAGES', '2')))  # Unknown pages fetched per wave
+MAX_PAGES_PER_BATCH = int(os.getenv('SCRAPER_MAX_PAGES_PER_BATCH', '20'))
+INDEX_INTERVAL = float(os.getenv('SCRAPER_INDEX_INTERVAL', '21600'))  # Seconds between batch index checks
+
+NEXT_LINK_TEXTS = {"next", "next page", "›", "»", ">"}
+
+def _same_page(url: str, other: str) -> bool:
+    """Compare two URLs ignoring query parameter order."""
+    a, b = urlparse(url), urlparse(other)
+    return (a.netloc, a.path) == (b.netloc, b.path) and sorted(parse_qsl(a.query)) == sorted(parse_qsl(b.query))
+
+def has_next_link(links: List[Dict], config: Dict, batch_id, page: int, base_url: str) -> bool:
+    """Check whether a page links to the page after it.
+
+    A link counts when it points at the vendor's URL for the next page of
+    the batch, or is marked as a next link by rel, class or text.
+    """
+    next_url = page_url(config, batch_id, page + 1, base_url)
+    for link in links:
+        href = link["href"].strip()
+        if not href or href.startswith(('#', 'javascript:')):
+            continue
+        if _same_page(urljoin(base_url, href), next_url):
+            return True
+        if ("next" in link["rel"].lower().split() or "next" in link["class"].lower().split()
+                or link["text"].lower() in NEXT_LINK_TEXTS):
+            return True
+    return False
+
+def find_batch_ids(links: List[Dict], pattern: str) -> List:
+    """Get the batch ids linked from a group-buy index page, in page order.
+
+    pattern is a regex whose first group captures the batch id; numeric
+    ids are returned as ints to match the vendor config.
+    """
+    regex = re.compile(pattern)
+    batch_ids = []
+    for link in links:
+        match = regex.search(link["href"])
+        if match:
+            batch_id = int(match.group(1)) if match.group(1).isdigit() else match.group(1)
+            if batch_id not in batch_ids:
+                batch_ids.append(batch_id)
+    return batch_ids
+
+def load_layout(cache, key: str, batch_config: Dict[int, Dict], skip_ids: Iterable = ()) -> Dict:
+    """Merge the configured batches with the layout discovered by earlier scrapes.
+
+    Returns {"batches": {batch number: {"id", "pages"}}, "index_checked_at"}
+    where pages is None for batches whose page count is not known yet.
+    Discovered batches whose id is in skip_ids are dropped.
+    """
+    batches = {batch_num: {"id": batch["id"], "pages": batch["pages"]} for batch_num, batch in batch_config.items()}
+    saved = cache.get_meta(key) if cache else None
+    if not saved:
+        return {"batches": batches, "index_checked_at": 0.0}
+
+    by_id = {batch["id"]: batch_num for batch_num, batch in batches.items()}
+    for entry in saved.get("batches", []):
+        if entry["id"] in skip_ids and entry["id"] not in by_id:
+            continue
+        batch_num = by_id.get(entry["id"], entry["batch"])
+        if batch_num in batches and batches[batch_num]["id"] != entry["id"]:
+            continue  # The config now uses this batch number for another batch
+        batches[batch_num] = {"id": entry["id"], "pages": entry["pages"]}
+    return {"batches": batches, "index_checked_at": saved.get("index_checked_at", 0.0)}
+
+def save_layout(cache, key: str, layout: Dict):
+    """Store a discovered layout so the next scrape starts from it."""
+    if cache is None:
+        return
+    cache.put_meta(key, {
+        "batches": [
+            {"batch": batch_num, "id": batch["id"], "pages": batch["pages"]}
+            for batch_num, batch in sorted(layout["batches"].items())
+        ],
+        "index_checked_at": layout["index_checked_at"]
+    })
+
+def index_due(layout: Dict) -> bool:
+    """Check whether the batch index should be fetched again."""
+    return time.time() - layout["index_checked_at"] >= INDEX_INTERVAL
+
+def add_batches(layout: Dict, batch_ids: List, skip_ids: Iterable = ()) -> List[int]:
+    """Add newly discovered batch ids to a layout, numbering them after the known batches."""
+    known = {batch["id"] for batch in layout["batches"].values()}
+    added = []
+    for batch_id in batch_ids:
+        if batch_id in known or batch_id in skip_ids:
+            continue
+        batch_num = max(layout["batches"], default=0) + 1
+        layout["batches"][batch_num] = {"id": batch_id, "pages": None}
+        known.add(batch_id)
+        added.append(batch_num)
+    return added
+
+def first_wave(batch: Dict) -> List[int]:
+    """Pages to fetch first: the known pages, or a speculative run for a new batch."""
+    pages = batch["pages"] or SPECULATIVE_PAGES
+    return list(range(1, min(pages, MAX_PAGES_PER_BATCH) + 1))
+
+def walk_batch(pages: Dict[int, Dict], known_pages: Optional[int]) -> Dict:
+    """Decide where a batch ends from the pages fetched so far.
+
+    pages maps page number to {"records", "has_next", "error"}. A page ends
+    the batch when it is empty or only repeats products from earlier pages
+    (sites often serve the last page for out-of-range page numbers).
+    Returns the pages to use, the discovered page count and the pages to
+    fetch next, if any.
+    """
+    seen = set()
+    use = []
+    last_good = None
+    ended = False
+    for page in sorted(pages):
+        result = pages[page]
+        if result["error"] is not None:
+            continue
+        names = {record["name"] for record in result["records"]}
+        if not names or names <= seen:
+            ended = True
+            break
+        seen |= names
+        use.append(page)
+        last_good = page
+
+    fetched = max(pages)
+    if ended:
+        discovered = last_good or 1
+    else:
+        # Pages that failed to fetch keep the count found by earlier scrapes
+        discovered = max(last_good or 0, known_pages or 0) or 1
+    more = []
+    if not ended and last_good == fetched and fetched < MAX_PAGES_PER_BATCH:
+        last = pages[fetched]
+        # On sites without next links, a speculative page with new products may be followed by more
+        uses_links = any(result["has_next"] for result in pages.values())
+        if last["has_next"] or (not uses_links and fetched > (known_pages or 0)):
+            more = list(range(fetched + 1, min(fetched + SPECULATIVE_PAGES, MAX_PAGES_PER_BATCH) + 1))
+    return {"use": use, "pages": discovered, "more": more}
@@ -0,0 +1,315 @@
+from bs4 import BeautifulSoup
+from bs4.exceptions import ParserRejectedMarkup
+from typing import List, Dict, Callable, Optional
+import os
+import re
+import logging
+from metrics import timed
+
+try:
+    import lxml.etree
+    import lxml.html
+    HAS_LXML = True
+except ImportError:
+    HAS_LXML = False
+
+# Errors raised by a backend for markup it cannot parse (lxml rejects empty documents)
+PARSE_ERRORS = (ParserRejectedMarkup, ValueError, UnicodeError) + ((lxml.etree.LxmlError,) if HAS_LXML else ())
+
+logger = logging.getLogger(__name__)
+
+# Selectors used to locate product cards and their fields
+CARD_SELECTORS = ['div.product-item, div.product-card, div.product', 'div[class*="product"], div[class*="item"]']
+NAME_SELECTOR = 'h2, h3, .product-name, .title, [class*="name"]'
+PRICE_SELECTOR = '.price, [class*="price"], span[class*="amount"]'
+IMAGE_SELECTORS = ['img.product-image', 'img.main-image', 'img[class*="product"]', 'img[class*="main"]', 'img']
+
+# A compound selector: optional tag, then any number of .class / [attr] / [attr="v"] / [attr*="v"]
+_COMPOUND_RE = re.compile(r'^([a-zA-Z][a-zA-Z0-9]*)?((?:\.[\w-]+|\[[\w-]+(?:\*?=("[^"]*"|\'[^\']*\'|[\w-]+))?\])*)$')
+_PART_RE = re.compile(r'\.([\w-]+)|\[([\w-]+)(?:(\*?=)("[^"]*"|\'[^\']*\'|[\w-]+))?\]')
+
+Matcher = Callable[[str, Dict[str, str]], bool]
+
+def compile_selector(selector: str) -> Matcher:
+    """Compile a simple CSS selector group into a predicate on (tag, attrs).
+
+    Supports comma-separated compounds of a tag name, class selectors and
+    [attr], [attr="v"], [attr*="v"] attribute selectors. Combinators and
+    pseudo-classes are not supported and raise ValueError.
+    """
+    compounds = []
+    for part in selector.split(','):
+        part = part.strip()
+        match = _COMPOUND_RE.match(part)
+        if not part or not match:
+            raise ValueError(f"Unsupported selector: {part!r}")
+        tag = match.group(1).lower() if match.group(1) else None
+        classes = []
+        attr_tests = []
+        for cls, attr, op, value in _PART_RE.findall(match.group(2)):
+            if cls:
+                classes.append(cls)
+            else:
+                attr_tests.append((attr.lower(), op, value.strip('"\'') if value else None))
+        compounds.append((tag, classes, attr_tests))
+
+    def matches(tag: str, attrs: Dict[str, str]) -> bool:
+        for compound_tag, classes, attr_tests in compounds:
+            if compound_tag and compound_tag != tag:
+                continue
+            if classes:
+                element_classes = attrs.get('class', '').split()
+                if not all(cls in element_classes for cls in classes):
+                    continue
+            ok = True
+            for attr, op, value in attr_tests:
+                actual = attrs.get(attr)
+                if actual is None:
+                    ok = False
+                elif op == '=' and actual != value:
+                    ok = False
+                elif op == '*=' and (not value or value not in actual):
+                    ok = False
+                if not ok:
+                    break
+            if ok:
+                return True
+        return False
+
+    return matches
+
+class CompiledSelectors:
+    """Card and field selectors compiled once per scrape."""
+
+    def __init__(self, card_selectors: List[str] = None, name_selector: str = NAME_SELECTOR,
+                 price_selector: str = PRICE_SELECTOR, image_selectors: List[str] = None):
+        self.card_selectors = card_selectors or CARD_SELECTORS
+        self.name_selector = name_selector
+        self.price_selector = price_selector
+        self.image_selectors = image_selectors or IMAGE_SELECTORS
+        self.cards = [compile_selector(s) for s in self.card_selectors]
+        self.name = compile_selector(name_selector)
+        self.price = compile_selector(price_selector)
+        self.images = [compile_selector(s) for s in self.image_selectors]
+
+def _lxml_parse(html: str):
+    root = lxml.html.document_fromstring(html)
+
+    def iter_elements(node):
+        # Skip comments and processing instructions, whose tag is not a string
+        for el in node.iter():
+            if isinstance(el.tag, str):
+                yield el
+
+    def info(el):
+        return el.tag.lower(), el.attrib
+
+    def text(el):
+        return el.text_content()
+
+    return root, iter_elements, info, text
+
+def _bs4_parse(html: str):
+    return _bs4_tree(BeautifulSoup(html, 'html.parser'))
+
+def _bs4_tree(root):
+    def iter_elements(node):
+        if node is not root:
+            yield node
+        yield from node.find_all(True)
+
+    def info(el):
+        attrs = el.attrs
+        # Multi-valued attributes such as class and rel come back as lists
+        if any(isinstance(value, list) for value in attrs.values()):
+            attrs = {key: ' '.join(value) if isinstance(value, list) else value for key, value in attrs.items()}
+        return el.name, attrs
+
+    def text(el):
+        return el.text
+
+    return root, iter_elements, info, text
+
+BACKENDS = {
+    "html.parser": _bs4_parse,
+}
+if HAS_LXML:
+    BACKENDS["lxml"] = _lxml_parse
+
+def select_backend() -> str:
+    """Pick the parser backend from SCRAPER_PARSER, preferring lxml when installed."""
+    requested = os.getenv('SCRAPER_PARSER')
+    if requested:
+        if requested in BACKENDS or requested == "reference":
+            return requested
+        logger.warning(f"Parser backend {requested} is not available, falling back")
+    return "lxml" if HAS_LXML else "html.parser"
+
+PARSER_BACKEND = select_backend()
+logger.info(f"Using parser backend: {PARSER_BACKEND}")
+
+def extract_cards(html: str, selectors: CompiledSelectors, image_fallbacks: bool,
+                  backend: Optional[str] = None) -> List[Dict]:
+    """Extract raw card fields from a page in a single pass over each card.
+
+    Returns one dict per card with the stripped name text, the stripped
+    price text, and the src of the first match for each image selector
+    (or just the plain 'img' selector when image_fallbacks is False).
+    A src is None when nothing matches or the match has no src attribute.
+    """
+    return extract_page(html, selectors, image_fallbacks, backend)["cards"]
+
+def extract_page(html: str, selectors: CompiledSelectors, image_fallbacks: bool,
+                 backend: Optional[str] = None) -> Dict[str, List[Dict]]:
+    """Extract the cards and the links from a page with one parse.
+
+    Returns {"cards": [...], "links": [...]} where cards are as returned by
+    extract_cards and each link is the href, rel, class and stripped text
+    of an <a> or <link> element that has an href.
+    """
+    backend = backend or PARSER_BACKEND
+    if backend == "reference":
+        with timed("parse", backend=backend):
+            soup = BeautifulSoup(html, 'html.parser')
+        with timed("extract", backend=backend):
+            return {
+                "cards": _select_from_soup(soup, selectors, image_fallbacks),
+                "links": _links_from_tree(*_bs4_tree(soup))
+            }
+
+    with timed("parse", backend=backend):
+        root, iter_elements, info, text = BACKENDS[backend](html)
+    with timed("extract", backend=backend):
+        return {
+            "cards": _extract_from_tree(root, iter_elements, info, text, selectors, image_fallbacks),
+            "links": _links_from_tree(root, iter_elements, info, text)
+        }
+
+def _links_from_tree(root, iter_elements, info, text) -> List[Dict]:
+    """Collect every <a> and <link> element that has an href."""
+    links = []
+    for el in iter_elements(root):
+        tag, attrs = info(el)
+        if tag in ('a', 'link') and attrs.get('href'):
+            links.append({
+                "href": attrs['href'],
+                "rel": attrs.get('rel', ''),
+                "class": attrs.get('class', ''),
+                "text": text(el).strip()
+            })
+    return links
+
+def _extract_from_tree(root, iter_elements, info, text, selectors: CompiledSelectors,
+                       image_fallbacks: bool) -> List[Dict]:
+    """Find cards in a parsed tree and walk each one once for its fields."""
+    image_matchers = selectors.images if image_fallbacks else selectors.images[-1:]
+
+    cards = []
+    for i, card_matcher in enumerate(selectors.cards):
+        if i:
+            logger.warning("No products found with primary selectors. Trying alternative selectors...")
+        cards = [el for el in iter_elements(root) if card_matcher(*info(el))]
+        if cards:
+            break
+
+    extracted = []
+    for card in cards:
+        name_elem = None
+        price_elem = None
+        image_srcs = [None] * len(image_matchers)
+        image_found = [False] * len(image_matchers)
+        remaining = 2 + len(image_matchers)
+
+        descendants = iter_elements(card)
+        next(descendants)  # Selectors only match descendants of the card
+        for el in descendants:
+            tag, attrs = info(el)
+            if name_elem is None and selectors.name(tag, attrs):
+                name_elem = el
+                remaining -= 1
+            if price_elem is None and selectors.price(tag, attrs):
+                price_elem = el
+                remaining -= 1
+            for i, matcher in enumerate(image_matchers):
+                if not image_found[i] and matcher(tag, attrs):
+                    image_found[i] = True
+                    image_srcs[i] = attrs.get('src')
+                    remaining -= 1
+            if not remaining:
+                break
+
+        extracted.append({
+            "name": text(name_elem).strip() if name_elem is not None else "",
+            "price": text(price_elem).strip() if price_elem is not None else "",
+            "image_srcs": image_srcs
+        })
+    return extracted
+
+def extract_cards_reference(html: str, selectors: CompiledSelectors, image_fallbacks: bool) -> List[Dict]:
+    """Extract raw card fields with BeautifulSoup select calls (the original slow path)."""
+    with timed("parse", backend="reference"):
+        soup = BeautifulSoup(html, 'html.parser')
+    with timed("extract", backend="reference"):
+        return _select_from_soup(soup, selectors, image_fallbacks)
+
+def _select_from_soup(soup, selectors: CompiledSelectors, image_fallbacks: bool) -> List[Dict]:
+    """Find cards and their fields with one select call per selector."""
+    image_selectors = selectors.image_selectors if image_fallbacks else selectors.image_selectors[-1:]
+
+    product_cards = []
+    for i, card_selector in enumerate(selectors.card_selectors):
+        if i:
+            logger.warning("No products found with primary selectors. Trying alternative selectors...")
+        product_cards = soup.select(card_selector)
+        if product_cards:
+            break
+
+    extracted = []
+    for card in product_cards:
+        name_elem = card.select_one(selectors.name_selector)
+        price_elem = card.select_one(selectors.price_selector)
+        image_srcs = []
+        for selector in image_selectors:
+            img_elem = card.select_one(selector)
+            image_srcs.append(img_elem.get('src') if img_elem else None)
+        extracted.append({
+            "name": name_elem.text.strip() if name_elem else "",
+            "price": price_elem.text.strip() if price_elem else "",
+            "image_srcs": image_srcs
+        })
+    return extracted
+
+def check_parity(html: str, image_fallbacks: bool, backend: Optional[str] = None) -> List[str]:
+    """Compare a backend against the reference path, returning any differences."""
+    selectors = CompiledSelectors()
+    expected = extract_cards_reference(html, selectors, image_fallbacks)
+    actual = extract_cards(html, selectors, image_fallbacks, backend)
+    differences = []
+    if len(expected) != len(actual):
+        differences.append(f"card count {len(actual)} != {len(expected)}")
+    for i, (want, got) in enumerate(zip(expected, actual)):
+        if want != got:
+            differences.append(f"card {i}: {got} != {want}")
+    return differences
+
+# For checking backend parity against saved pages
+if __name__ == "__main__":
+    import sys
+    from logs import configure_logging
+    configure_logging()
+    fixture_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+    failures = 0
+    for filename in sorted(os.listdir(fixture_dir)):
+        if not filename.endswith('.html'):
+            continue
+        with open(os.path.join(fixture_dir, filename), 'r') as f:
+            html = f.read()
+        for backend in BACKENDS:
+            for image_fallbacks in (False, True):
+                differences = check_parity(html, image_fallbacks, backend)
+                status = "ok" if not differences else "MISMATCH"
+                print(f"{filename} [{backend}, fallbacks={image_fallbacks}]: {status}")
+                for difference in differences:
+                    print(f"  {difference}")
+                failures += bool(differences)
+    sys.exit(1 if failures else 0)
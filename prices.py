@@ -0,0 +1,62 @@
+from typing import Dict, Optional
+import re
+
+# Currency symbols and codes seen on vendor pages, longest first so "US$" wins over "$"
+CURRENCY_SYMBOLS = [
+    ("US$", "USD"), ("CA$", "CAD"), ("C$", "CAD"), ("A$", "AUD"), ("AU$", "AUD"),
+    ("HK$", "HKD"), ("S$", "SGD"), ("NT$", "TWD"),
+    ("$", "USD"), ("€", "EUR"), ("£", "GBP"), ("¥", "JPY"), ("₩", "KRW"),
+]
+CURRENCY_CODES = {"USD", "EUR", "GBP", "JPY", "KRW", "CAD", "AUD", "HKD", "SGD", "TWD", "MYR", "CNY", "CHF"}
+CURRENCY_CODE_RE = re.compile(r'\b([A-Z]{3})\b')
+# Digits with optional thousands groups and up to two decimals: "1,299.50", "1.299,50", "1 299", "45",
+# or just the decimals: ".99"
+AMOUNT_RE = re.compile(r'(?:\d+(?:[.,\s]\d{3})*(?:[.,]\d{1,2})?|[.,]\d{1,2})(?!\d)')
+# Currencies without minor units; every other currency is stored in hundredths
+ZERO_DECIMAL_CURRENCIES = {"JPY", "KRW", "TWD"}
+DEFAULT_CURRENCY = "USD"
+
+def minor_unit_digits(currency: str) -> int:
+    """Get the number of decimal digits in a currency's minor unit."""
+    return 0 if currency in ZERO_DECIMAL_CURRENCIES else 2
+
+def parse_price(text: Optional[str], default_currency: str = DEFAULT_CURRENCY) -> Optional[Dict]:
+    """Parse a scraped price such as "$45.00", "US$1,299.50" or "45,00 €".
+
+    Returns {"currency", "amount"} with amount in integer minor units (cents
+    for USD), or None if the text has no number. For a range such as
+    "$38.00 - $45.00" the first price is used.
+    """
+    if not text:
+        return None
+    match = AMOUNT_RE.search(text)
+    if not match:
+        return None
+
+    codes = [code for code in CURRENCY_CODE_RE.findall(text) if code in CURRENCY_CODES]
+    currency = codes[0] if codes else None
+    if currency is None:
+        for symbol, symbol_currency in CURRENCY_SYMBOLS:
+            if symbol in text:
+                currency = symbol_currency
+                break
+    currency = currency or default_currency
+
+    number = re.sub(r'\s', '', match.group(0))
+    digits = minor_unit_digits(currency)
+    # The last separator is a decimal point when 1-2 digits follow it ("45,00", "45.5", ".99");
+    # otherwise every separator groups thousands ("1,299" or "1.299")
+    whole, fraction = number, ""
+    last = max(number.rfind('.'), number.rfind(','))
+    if last != -1 and 1 <= len(number) - last - 1 <= 2:
+        whole, fraction = number[:last], number[last + 1:]
+    whole = re.sub(r'[.,]', '', whole) or "0"
+    fraction = (fraction + "00")[:digits]
+    return {"currency": currency, "amount": int(whole) * 10 ** digits + int(fraction or 0)}
+
+def format_amount(amount: int, currency: str) -> str:
+    """Format minor units back into a decimal string, e.g. 4500 USD -> "45.00"."""
+    digits = minor_unit_digits(currency)
+    if not digits:
+        return str(amount)
+    return f"{amount // 10 ** digits}.{amount % 10 ** digits:0{digits}d}"
@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from typing import Dict, Iterator, AsyncIterator, Optional, Tuple
+import gzip
+import hashlib
+import os
+import threading
+import logging
+from metrics import inc, timed
+
+try:
+    import brotli
+    HAS_BROTLI = True
+except ImportError:
+    HAS_BROTLI = False
+
+logger = logging.getLogger(__name__)
+
+# Response cache settings
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_MB', '64')) * 1024 * 1024
+MAX_BODY_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BODY_MB', '4')) * 1024 * 1024  # Larger bodies are streamed uncached
+MIN_COMPRESS_BYTES = 512  # Smaller bodies are not worth compressing
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+# Clients may store responses but must revalidate them with the ETag on every use
+CACHE_CONTROL = 'private, no-cache'
+# Distinguishes this process's keys from those of earlier runs: the collection
+# write counter starts again at 0 on a fresh database, so version N alone may not name the same data
+BOOT_ID = os.urandom(8).hex()
+
+def cache_key(route: str, version, **params) -> Tuple:
+    """Build a cache key from a route, the data version it was built from and its query parameters.
+
+    Keys (and so ETags) include BOOT_ID, so a tag issued before a restart
+    never matches afterwards.
+    """
+    return (route, BOOT_ID, str(version), tuple(sorted((name, str(value)) for name, value in params.items())))
+
+def etag_for(key: Tuple) -> str:
+    """Derive a weak ETag from a cache key, so 304s need no body.
+
+    Weak because the same ETag covers the identity, gzip and brotli bodies.
+    """
+    return 'W/"' + hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:32] + '"'
+
+def not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header against an ETag using weak comparison."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    opaque = etag[2:] if etag.startswith('W/') else etag
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == opaque:
+            return True
+    return False
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Pick br or gzip from an Accept-Encoding header, or None for the identity body."""
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.strip().lower()] = quality
+    for encoding in ('br', 'gzip'):
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > 0 and (encoding != 'br' or HAS_BROTLI):
+            return encoding
+    return None
+
+class ResponseCache:
+    """In-memory LRU cache of serialized API responses with precompressed bodies.
+
+    Entries are keyed by the data version they were built from, so a write
+    never has to find and invalidate them: requests after it use a new key
+    and old entries are evicted least recently used first once the cache is
+    over max_bytes.
+    """
+
+    def __init__(self, max_bytes: int = RESPONSE_CACHE_MAX_BYTES, max_body_bytes: int = MAX_BODY_BYTES):
+        self.max_bytes = max_bytes
+        self.max_body_bytes = max_body_bytes
+        self._entries = OrderedDict()  # key -> {"identity", "gzip", "br", "size"}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[Dict]:
+        """Get a cached entry, marking it recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        inc("response_cache_total", help_text="Response cache lookups by result",
+            route=key[0], result='hit' if entry is not None else 'miss')
+        return entry
+
+    def put(self, key: Tuple, body: bytes) -> Dict:
+        """Compress and cache a body, returning its entry.
+
+        Bodies over max_body_bytes are returned uncompressed and not cached.
+        """
+        entry = {"identity": body, "gzip": None, "br": None}
+        if len(body) > self.max_body_bytes:
+            return entry
+        if len(body) >= MIN_COMPRESS_BYTES:
+            with timed("compress", route=key[0]):
+                entry["gzip"] = gzip.compress(body, compresslevel=GZIP_LEVEL)
+                if HAS_BROTLI:
+                    entry["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+        entry["size"] = sum(len(value) for value in (body, entry["gzip"], entry["br"]) if value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous["size"]
+            self._entries[key] = entry
+            self._size += entry["size"]
+            while self._size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted["size"]
+        return entry
+
+    def clear(self):
+        """Drop every entry."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def tee(self, key: Tuple, chunks: Iterator[str]) -> Iterator[str]:
+        """Pass a streamed body through, caching it once it completes if it stays small enough."""
+        parts = []
+        size = 0
+        for chunk in chunks:
+            if parts is not None:
+                parts.append(chunk)
+                size += len(chunk)
+                if size > self.max_body_bytes:
+                    parts = None
+            yield chunk
+        if parts is not None:
+            self.put(key, ''.join(parts).encode('utf-8'))
+
+    async def tee_async(self, key: Tuple, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        """tee for an async stream."""
+        parts = []
+        size = 0
+        async for chunk in chunks:
+            if parts is not None:
+                parts.append(chunk)
+                size += len(chunk)
+                if size > self.max_body_bytes:
+                    parts = None
+            yield chunk
+        if parts is not None:
+            self.put(key, ''.join(parts).encode('utf-8'))
+
+def encoded_body(entry: Dict, encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """Get the entry's body in the negotiated encoding, falling back to identity."""
+    if encoding and entry.get(encoding) is not None:
+        return entry[encoding], encoding
+    return entry["identity"], None
+
+response_cache = ResponseCache()
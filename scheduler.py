@@ -0,0 +1,136 @@
+from typing import Callable, Optional, List, Dict
+from datetime import datetime
+import os
+import threading
+import time
+import logging
+from events import publish
+
+logger = logging.getLogger(__name__)
+
+SCRAPE_INTERVAL = int(os.getenv('SCRAPE_INTERVAL_SECONDS', '3600'))
+CHECK_PERIOD = min(SCRAPE_INTERVAL, 60)  # How often the background loop checks for stale data
+RETRY_FAILED_AFTER = int(os.getenv('SCRAPE_RETRY_FAILED_SECONDS', '300'))  # Delay before re-fetching failed batches
+
+class ScrapeScheduler:
+    """Refresh drops in the background and coalesce concurrent refresh requests.
+
+    scrape_fn returns each vendor's products and batch status, and
+    store_fn persists them, returning each vendor's added/removed/changed
+    products and failed batches. Failed batches are scraped again on their
+    own (scrape_fn(batches={vendor: [batch numbers]})) after
+    RETRY_FAILED_AFTER seconds. Each refresh publishes "scrape" status
+    events and a "drops" event per changed vendor.
+    """
+
+    def __init__(self, scrape_fn: Callable[..., Dict[str, Dict]],
+                 store_fn: Callable[[Dict[str, Dict]], Dict[str, Dict]],
+                 last_scraped_fn: Callable[[], Optional[datetime]], interval: int = SCRAPE_INTERVAL):
+        self.scrape_fn = scrape_fn
+        self.store_fn = store_fn
+        self.last_scraped_fn = last_scraped_fn
+        self.interval = interval
+        self.last_refresh = None  # UTC time of the last successful refresh in this process
+        self._lock = threading.Lock()
+        self._running = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._failed_batches = {}  # vendor -> batch numbers the latest scrape could not fetch
+        self._retry_at = None  # Monotonic time to re-fetch the failed batches
+
+    def start(self):
+        """Start the periodic refresh loop if it is not already running."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._loop, name='scrape-scheduler', daemon=True)
+            self._thread.start()
+        logger.info(f"Scrape scheduler started with interval {self.interval}s")
+
+    def stop(self):
+        """Stop the periodic refresh loop."""
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                if self.is_stale():
+                    self.refresh()
+                elif self._retry_at is not None and time.monotonic() >= self._retry_at:
+                    self.refresh(batches=dict(self._failed_batches))
+            except Exception as e:
+                logger.error(f"Error in scrape scheduler: {str(e)}")
+            self._stop.wait(CHECK_PERIOD)
+
+    def is_started(self) -> bool:
+        """Check whether the periodic refresh loop has been started."""
+        return self._thread is not None
+
+    def is_running(self) -> bool:
+        """Check whether a scrape is currently in flight."""
+        return self._running
+
+    def data_age(self, last_scraped: Optional[datetime] = None) -> Optional[float]:
+        """Get the age in seconds of the freshest scrape, or None if there is none."""
+        last = last_scraped or self.last_scraped_fn()
+        if self.last_refresh and (last is None or self.last_refresh > last):
+            last = self.last_refresh
+        if last is None:
+            return None
+        return (datetime.utcnow() - last).total_seconds()
+
+    def is_stale(self) -> bool:
+        """Check whether the stored drops are older than the refresh interval."""
+        age = self.data_age()
+        return age is None or age >= self.interval
+
+    def refresh(self, batches: Optional[Dict[str, List[int]]] = None) -> bool:
+        """Start a background scrape unless one is already in flight.
+
+        With batches, only those vendors' batches are scraped and merged
+        into their latest scrapes. Returns True if a new scrape was started,
+        False if the request was coalesced into the one already running.
+        """
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+            self._retry_at = None
+        threading.Thread(target=self._run, args=(batches,), name='scrape-refresh', daemon=True).start()
+        return True
+
+    def _run(self, batches: Optional[Dict[str, List[int]]] = None):
+        try:
+            if batches:
+                logger.info(f"Starting background scrape of failed batches {batches}")
+            else:
+                logger.info("Starting background scrape")
+            publish("scrape", {"status": "started"})
+            drops = self.scrape_fn(batches=batches) if batches else self.scrape_fn()
+            total = sum(len(result["products"]) for result in drops.values())
+            if any(result["products"] or result["batches"] for result in drops.values()):
+                stored = self.store_fn(drops) or {}
+                self.last_refresh = datetime.utcnow()
+                for vendor, result in stored.items():
+                    if result["failed_batches"]:
+                        self._failed_batches[vendor] = result["failed_batches"]
+                    else:
+                        self._failed_batches.pop(vendor, None)
+                    if result["stored"]:
+                        publish("drops", {
+                            "vendor": vendor,
+                            "added": result["added"],
+                            "removed": result["removed"],
+                            "changed": result["changed"]
+                        })
+            if self._failed_batches:
+                self._retry_at = time.monotonic() + RETRY_FAILED_AFTER
+                logger.warning(f"Retrying failed batches {self._failed_batches} in {RETRY_FAILED_AFTER}s")
+            logger.info(f"Background scrape finished with {total} products from {len(drops)} vendors")
+            publish("scrape", {"status": "finished", "products": total, "failed_batches": self._failed_batches})
+        except Exception as e:
+            logger.error(f"Background scrape failed: {str(e)}")
+            publish("scrape", {"status": "failed", "error": str(e)})
+        finally:
+            with self._lock:
+                self._running = False
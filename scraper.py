@@ -1,14 +1,33 @@
-import requests
-from bs4 import BeautifulSoup
-from typing import List, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple, Generator
 from datetime import datetime
+import asyncio
 import logging
+import threading
+import time
 from urllib.parse import urljoin
+from fetcher import fetch_pages, fetch_pages_async, PageCache, RateLimiter, FetchBudget, MIN_REQUEST_INTERVAL, SCRAPE_BUDGET
+from parsers import CompiledSelectors, extract_page, PARSE_ERRORS
+from pagination import (
+    load_layout, save_layout, index_due, add_batches, first_wave, walk_batch,
+    has_next_link, find_batch_ids
+)
+from metrics import observe, inc, timed
+from logs import configure_logging, debug_sampled
+from events import publish
+from images import proxy_urls
+from prices import parse_price, DEFAULT_CURRENCY
+from vendors import DEFAULT_VENDOR, DEFAULT_HEADERS, get_vendor, list_vendors, page_url
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Bump when extraction logic changes so cached page records are re-parsed
+CACHE_VERSION = 3
+
+_last_scrape_stats = {}  # vendor -> stats from that vendor's most recent scrape
+_rate_limiters = {}  # vendor -> RateLimiter
+_rate_limiters_lock = threading.Lock()
+
 def clean_image_url(url: str, base_url: str) -> str:
     """Clean and normalize image URL."""
     if not url:
@@ -23,149 +42,399 @@ def clean_image_url(url: str, base_url: str) -> str:
     
     return url
 
-def scrape_s_craft() -> List[Dict]:
+def _get_rate_limiter(vendor: str, config: Dict) -> RateLimiter:
+    """Get the vendor's rate limiter, creating it from its config on first use."""
+    with _rate_limiters_lock:
+        if vendor not in _rate_limiters:
+            _rate_limiters[vendor] = RateLimiter(config.get("min_request_interval", MIN_REQUEST_INTERVAL))
+        return _rate_limiters[vendor]
+
+def scrape_all(vendors: Optional[List[str]] = None, cache_path: Optional[str] = None,
+               batches: Optional[Dict[str, List[int]]] = None) -> Dict[str, Dict]:
+    """Scrape every registered vendor (or the given ones) concurrently.
+
+    Each vendor fetches with its own worker count and rate limit. With
+    batches, only those vendors and batch numbers are fetched again. Returns
+    each vendor's products and per-batch status (see scrape_vendor_batches).
+    """
+    vendors = list(batches) if batches else vendors or list_vendors()
+    cache = PageCache(cache_path, version=CACHE_VERSION)
+    with ThreadPoolExecutor(max_workers=len(vendors), thread_name_prefix='vendor') as executor:
+        futures = {
+            vendor: executor.submit(scrape_vendor_batches, vendor, batches.get(vendor) if batches else None, cache=cache)
+            for vendor in vendors
+        }
+        results = {vendor: future.result() for vendor, future in futures.items()}
+    cache.save()
+    return results
+
+async def scrape_all_async(vendors: Optional[List[str]] = None, cache_path: Optional[str] = None,
+                           batches: Optional[Dict[str, List[int]]] = None) -> Dict[str, Dict]:
+    """Scrape every registered vendor (or the given ones) concurrently on the event loop; see scrape_all."""
+    vendors = list(batches) if batches else vendors or list_vendors()
+    cache = PageCache(cache_path, version=CACHE_VERSION)
+    results = await asyncio.gather(*(
+        scrape_vendor_batches_async(vendor, batches.get(vendor) if batches else None, cache=cache)
+        for vendor in vendors
+    ))
+    cache.save()
+    return dict(zip(vendors, results))
+
+def scrape_s_craft(base_url: Optional[str] = None, batch_config: Optional[Dict[int, Dict]] = None,
+                   cache_path: Optional[str] = None) -> List[Dict]:
     """Scrape S-Craft Studio group buy page for keycap products."""
-    base_url = "https://www.s-craft.studio/shop/group-buy"
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
-        "Accept-Language": "en-US,en;q=0.5",
-        "Connection": "keep-alive",
-    }
-    
-    # Batch IDs mapping (batch number to ID and pages)
-    batch_config = {
-        1: {"id": 1, "pages": 1},
-        2: {"id": 2, "pages": 1},
-        3: {"id": 3, "pages": 1},
-        4: {"id": 4, "pages": 1},
-        5: {"id": 5, "pages": 1},
-        6: {"id": 6, "pages": 1},
-        7: {"id": 7, "pages": 1},
-        8: {"id": 8, "pages": 1},
-        9: {"id": 9, "pages": 1},
-        10: {"id": 14, "pages": 1},
-        11: {"id": 18, "pages": 2},
-        12: {"id": 21, "pages": 2}
+    return scrape_vendor("s-craft", base_url, batch_config, cache_path)
+
+def scrape_vendor(vendor: str, base_url: Optional[str] = None, batch_config: Optional[Dict[int, Dict]] = None,
+                  cache_path: Optional[str] = None, cache: Optional[PageCache] = None) -> List[Dict]:
+    """Scrape one vendor's group buy pages for keycap products.
+
+    base_url and batch_config default to the vendor's config; the benchmark
+    overrides them. Pass a shared cache when scraping several vendors,
+    otherwise the page cache at cache_path is loaded and saved here.
+
+    Page counts are discovered as pages are fetched: a batch grows when its
+    last page links to a next page and shrinks when a page comes back empty.
+    New batch ids are picked up from the group buy index. The discovered
+    layout is kept in the page cache so later scrapes fetch only known pages.
+    """
+    return scrape_vendor_batches(vendor, None, base_url, batch_config, cache_path, cache)["products"]
+
+def scrape_vendor_batches(vendor: str, only_batches: Optional[List[int]] = None, base_url: Optional[str] = None,
+                          batch_config: Optional[Dict[int, Dict]] = None, cache_path: Optional[str] = None,
+                          cache: Optional[PageCache] = None) -> Dict:
+    """Scrape one vendor like scrape_vendor, reporting which batches could not be fetched.
+
+    Returns {"products", "batches"} where batches maps each scraped batch
+    number to "ok" or "failed". With only_batches, just those batches are
+    fetched (no index discovery), e.g. to retry the failed ones.
+    """
+    owns_cache = cache is None
+    if owns_cache:
+        cache = PageCache(cache_path, version=CACHE_VERSION)
+    options = _fetch_options(vendor, cache)
+    steps = _scrape_steps(vendor, base_url, batch_config, cache, only_batches)
+    try:
+        urls = next(steps)
+        while True:
+            with timed("scrape_fetch", vendor=vendor):
+                results = fetch_pages(urls, **options)
+            urls = steps.send(results)
+    except StopIteration as done:
+        if owns_cache:
+            cache.save()
+        return done.value
+    except Exception as e:
+        # Fetch and parse errors are recorded per batch; anything else is a bug, not an empty scrape
+        logger.error(f"Critical error in {vendor} scraper: {str(e)}")
+        raise
+
+async def scrape_vendor_async(vendor: str, base_url: Optional[str] = None,
+                              batch_config: Optional[Dict[int, Dict]] = None,
+                              cache_path: Optional[str] = None, cache: Optional[PageCache] = None) -> List[Dict]:
+    """Scrape one vendor like scrape_vendor, fetching pages with httpx on the event loop."""
+    return (await scrape_vendor_batches_async(vendor, None, base_url, batch_config, cache_path, cache))["products"]
+
+async def scrape_vendor_batches_async(vendor: str, only_batches: Optional[List[int]] = None,
+                                      base_url: Optional[str] = None, batch_config: Optional[Dict[int, Dict]] = None,
+                                      cache_path: Optional[str] = None, cache: Optional[PageCache] = None) -> Dict:
+    """Scrape one vendor like scrape_vendor_batches, fetching pages with httpx on the event loop."""
+    owns_cache = cache is None
+    if owns_cache:
+        cache = PageCache(cache_path, version=CACHE_VERSION)
+    options = _fetch_options(vendor, cache)
+    steps = _scrape_steps(vendor, base_url, batch_config, cache, only_batches)
+    try:
+        urls = next(steps)
+        while True:
+            with timed("scrape_fetch", vendor=vendor):
+                results = await fetch_pages_async(urls, **options)
+            urls = steps.send(results)
+    except StopIteration as done:
+        if owns_cache:
+            cache.save()
+        return done.value
+    except Exception as e:
+        logger.error(f"Critical error in {vendor} scraper: {str(e)}")
+        raise
+
+def _fetch_options(vendor: str, cache: PageCache) -> Dict:
+    """Keyword arguments for fetching one vendor's pages."""
+    config = get_vendor(vendor)
+    return {
+        "headers": config.get("headers", DEFAULT_HEADERS),
+        "max_workers": config.get("max_workers"),
+        "cache": cache,
+        "limiter": _get_rate_limiter(vendor, config),
+        "budget": FetchBudget(config.get("time_budget", SCRAPE_BUDGET))
     }
+
+def _scrape_steps(vendor: str, base_url: Optional[str], batch_config: Optional[Dict[int, Dict]],
+                  cache: PageCache, only_batches: Optional[List[int]] = None) -> Generator[List[str], List[Dict], Dict]:
+    """Run a vendor scrape, yielding each list of URLs to fetch and receiving their results.
+
+    Keeps the scrape logic independent of how pages are fetched, so the
+    threaded and async drivers share it. Returns the products and the
+    status of each batch.
+    """
+    config = get_vendor(vendor)
+    discover_batches = batch_config is None and only_batches is None and config.get("batch_id_pattern") is not None
+    base_url = base_url or config["base_url"]
+    batch_config = batch_config or config["batches"]
+    fallbacks_from = config.get("image_fallbacks_from_batch")
     
     all_products = []
     seen_products = set()  # Track unique products by name and batch
+    selectors = CompiledSelectors(**config.get("selectors", {}))
+    stats = {"hits": 0, "misses": 0, "errors": 0, "requests": 0, "pages": []}
+    layout_key = f"layout:{vendor}:{base_url}"
+    layout = load_layout(cache, layout_key, batch_config, set(config.get("skip_batch_ids", [])))
+    
+    if discover_batches and index_due(layout):
+        index_url = config.get("index_url", config["base_url"])
+        index_result = (yield [index_url])[0]
+        stats["requests"] += 1
+        added = _discover_batches(vendor, config, layout, index_url, index_result, cache)
+        if added:
+            logger.info(f"Discovered {len(added)} new {vendor} batches: {added}")
+    
+    batches = {
+        batch_num: batch for batch_num, batch in layout["batches"].items()
+        if only_batches is None or batch_num in only_batches
+    }
+    batch_times = {}  # Per-batch time is the batch's page fetch times plus its processing time
+    fetched = {batch_num: {} for batch_num in batches}
+    wave = [(batch_num, page) for batch_num, batch in batches.items() for page in first_wave(batch)]
+    walks = {}
+    batch_products = {}
+    batch_status = {}
+    
+    while wave:
+        logger.info(f"Fetching {len(wave)} {vendor} pages across {len({b for b, _ in wave})} batches")
+        urls = [page_url(config, batches[batch_num]["id"], page, base_url) for batch_num, page in wave]
+        results = yield urls
+        stats["requests"] += len(urls)
+        
+        for (batch_num, page), url, result in zip(wave, urls, results):
+            page_start = time.perf_counter()
+            fetched[batch_num][page] = _process_page(
+                vendor, config, batches[batch_num]["id"], batch_num, page, url, result,
+                base_url, selectors, fallbacks_from, cache, stats
+            )
+            batch_times[batch_num] = batch_times.get(batch_num, 0.0) + result["elapsed"] + time.perf_counter() - page_start
+        
+        # Keep going only for batches whose last page suggests there is more
+        wave = []
+        for batch_num in batches:
+            walks[batch_num] = walk_batch(fetched[batch_num], batches[batch_num]["pages"])
+            wave.extend((batch_num, page) for page in walks[batch_num]["more"])
+            if not walks[batch_num]["more"] and batch_num not in batch_products:
+                # Build a batch's products as soon as it is complete so progress carries partial results
+                batch_products[batch_num] = _finish_batch(vendor, config, batches[batch_num], batch_num,
+                                                          walks[batch_num], fetched[batch_num], base_url, seen_products)
+                # A batch with any page that could not be fetched may be missing products
+                batch_status[batch_num] = "failed" if any(
+                    page["error"] is not None for page in fetched[batch_num].values()
+                ) else "ok"
+                publish("progress", {
+                    "vendor": vendor,
+                    "batch": batch_num,
+                    "status": batch_status[batch_num],
+                    "pages": walks[batch_num]["pages"],
+                    "batches_done": len(batch_products),
+                    "batches_total": len(batches),
+                    "products": batch_products[batch_num]
+                })
+    
+    # Products are kept in batch/page order; deduplication is per batch so build order does not matter
+    for batch_num in sorted(batch_products):
+        all_products.extend(batch_products[batch_num])
+    
+    for batch_num, seconds in batch_times.items():
+        observe("scrape_batch_duration_seconds", seconds,
+                help_text="Fetch plus processing time for each scraped batch", vendor=vendor, batch=batch_num)
+    save_layout(cache, layout_key, layout)
+    _last_scrape_stats[vendor] = stats
+    logger.info(f"Page cache for {vendor}: {stats['hits']} hits, {stats['misses']} misses, "
+                f"{stats['errors']} errors over {stats['requests']} requests")
+    failed = sorted(batch_num for batch_num, status in batch_status.items() if status == "failed")
+    if failed:
+        logger.warning(f"Could not fully fetch {vendor} batches {failed}")
+    logger.info(f"Successfully scraped {len(all_products)} unique {vendor} products across {len(batches)} batches")
+    return {"products": all_products, "batches": batch_status}
+
+def _finish_batch(vendor: str, config: Dict, batch: Dict, batch_num: int, walk: Dict, fetched: Dict,
+                  base_url: str, seen_products: set) -> List[Dict]:
+    """Record a completed batch's page count and build its products in page order.
+
+    The batch's images are registered with the image proxy together, so the
+    registry is saved once per batch rather than once per product.
+    """
+    if walk["pages"] != batch["pages"]:
+        logger.info(f"{vendor} batch {batch_num} now has {walk['pages']} pages (was {batch['pages']})")
+        batch["pages"] = walk["pages"]
+    products = []
+    for page in walk["use"]:
+        url = page_url(config, batch["id"], page, base_url)
+        products.extend(_build_products(fetched[page]["records"], vendor, batch_num, page, url, seen_products,
+                                        config.get("currency", DEFAULT_CURRENCY)))
+    thumbnails = proxy_urls(product["image_url"] for product in products)
+    for product in products:
+        product["thumbnail_url"] = thumbnails.get(product["image_url"])
+    return products
+
+def _discover_batches(vendor: str, config: Dict, layout: Dict, index_url: str, result: Dict,
+                      cache: PageCache) -> List[int]:
+    """Add any batch ids linked from the fetched group buy index that are not known yet."""
+    if result["error"] is not None:
+        logger.warning(f"Could not fetch {vendor} batch index: {str(result['error'])}")
+        return []
+    
+    if result["cache"] == "hit":
+        batch_ids = result["entry"]["records"]
+    else:
+        links = extract_page(result["text"], CompiledSelectors(), False)["links"]
+        batch_ids = find_batch_ids(links, config["batch_id_pattern"])
+        cache.put(index_url, result["etag"], result["last_modified"], result["body_hash"], batch_ids)
+    layout["index_checked_at"] = time.time()
+    return add_batches(layout, batch_ids, set(config.get("skip_batch_ids", [])))
+
+def _process_page(vendor: str, config: Dict, batch_id, batch_num: int, page: int, url: str, result: Dict,
+                  base_url: str, selectors: CompiledSelectors, fallbacks_from: Optional[int],
+                  cache: PageCache, stats: Dict) -> Dict:
+    """Turn one fetch result into the page's records and whether it has a next page."""
+    stats["pages"].append({"batch": batch_num, "page": page, "url": url, "cache": result["cache"]})
+    inc("page_cache_total", help_text="Scraped pages by page cache result", result=result["cache"])
+    
+    error = result["error"]
+    if error is not None:
+        response = getattr(error, "response", None)
+        if response is not None and response.status_code == 404:
+            # Past the last page of the batch
+            logger.debug("%s batch %d, page %d not found", vendor, batch_num, page)
+            return {"records": [], "has_next": False, "error": None}
+        stats["errors"] += 1
+        logger.error(f"Error fetching {vendor} batch {batch_num}, page {page}: {str(error)}")
+        return {"records": [], "has_next": False, "error": error}
     
     try:
-        # Scrape each batch
-        for batch_num, config in batch_config.items():
-            batch_id = config["id"]
-            pages = config["pages"]
+        if result["cache"] == "hit":
+            # Page unchanged since the last scrape, reuse its extracted records
+            stats["hits"] += 1
+            logger.debug("%s batch %d, page %d unchanged, skipping parse", vendor, batch_num, page)
+            return {"records": result["entry"]["records"], "has_next": result["entry"].get("has_next", False), "error": None}
+        
+        stats["misses"] += 1
+        logger.debug("Scraping %s batch %d (ID: %s), page %d from %s", vendor, batch_num, batch_id, page, url)
+        image_fallbacks = fallbacks_from is not None and batch_num >= fallbacks_from
+        records, links = _extract_records(result["text"], batch_num, page, base_url, selectors, image_fallbacks)
+        has_next = has_next_link(links, config, batch_id, page, base_url)
+        page_size = config.get("page_size")
+        if page_size and len(records) >= page_size:
+            has_next = True  # A full page may be followed by another
+        cache.put(url, result["etag"], result["last_modified"], result["body_hash"], records, has_next=has_next)
+        return {"records": records, "has_next": has_next, "error": None}
+    except PARSE_ERRORS as e:
+        # Counted like a fetch error, so the batch is marked failed and its previous products kept
+        stats["errors"] += 1
+        logger.error(f"Could not parse {vendor} batch {batch_num}, page {page}: {str(e)}")
+        return {"records": [], "has_next": False, "error": e}
+
+def get_last_scrape_stats(vendor: str = DEFAULT_VENDOR) -> Dict:
+    """Get per-page cache hit/miss counts from a vendor's most recent scrape."""
+    return dict(_last_scrape_stats.get(vendor, {}))
+
+def _extract_records(html: str, batch_num: int, page: int, base_url: str, selectors: CompiledSelectors,
+                     image_fallbacks: bool) -> Tuple[List[Dict], List[Dict]]:
+    """Extract raw product records and links from a fetched group buy page.
+
+    Records keep cards with a missing price (price is None) so that
+    deduplication across pages behaves the same whether a page was parsed
+    or reused from the page cache.
+    """
+    # image_fallbacks tries multiple image selectors (S-Craft's later batches)
+    extracted = extract_page(html, selectors, image_fallbacks)
+    cards = extracted["cards"]
+    
+    logger.debug("Found %d products in batch %d, page %d", len(cards), batch_num, page)
+    
+    records = []
+    for card in cards:
+        try:
+            name = card["name"]
             
-            for page in range(1, pages + 1):
-                url = f"{base_url}?batch_id={batch_id}"
-                if page > 1:
-                    url += f"&page={page}"
-                
-                logger.info(f"Scraping batch {batch_num} (ID: {batch_id}), page {page} from {url}")
-                
-                try:
-                    response = requests.get(url, headers=headers, timeout=10)
-                    response.raise_for_status()
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    
-                    # Find product cards
-                    product_cards = soup.select('div.product-item, div.product-card, div.product')
-                    if not product_cards:
-                        logger.warning(f"No products found in batch {batch_num} with primary selectors. Trying alternative selectors...")
-                        product_cards = soup.select('div[class*="product"], div[class*="item"]')
-                    
-                    logger.info(f"Found {len(product_cards)} products in batch {batch_num}, page {page}")
-                    
-                    for card in product_cards:
-                        try:
-                            # Get product name with improved validation
-                            name_elem = card.select_one('h2, h3, .product-name, .title, [class*="name"]')
-                            if not name_elem or not name_elem.text.strip():
-                                logger.warning(f"Skipping product with missing name in batch {batch_num}, page {page}")
-                                continue
-                                
-                            name = name_elem.text.strip()
-                            
-                            # Skip if name is just whitespace or "Unknown Product"
-                            if not name or name == "Unknown Product":
-                                logger.warning(f"Skipping invalid product name in batch {batch_num}, page {page}")
-                                continue
-                            
-                            # Create unique identifier for product (name + batch)
-                            product_id = f"{name}_{batch_num}"
-                            
-                            # Skip if we've already seen this product in this batch
-                            if product_id in seen_products:
-                                logger.debug(f"Skipping duplicate product: {name} in batch {batch_num}")
-                                continue
-                            seen_products.add(product_id)
-                            
-                            # Get image URL with fallbacks for later batches
-                            image_url = None
-                            if batch_num >= 9:
-                                # Try multiple image selectors for later batches
-                                for selector in [
-                                    'img.product-image',
-                                    'img.main-image',
-                                    'img[class*="product"]',
-                                    'img[class*="main"]',
-                                    'img'
-                                ]:
-                                    img_elem = card.select_one(selector)
-                                    if img_elem and 'src' in img_elem.attrs:
-                                        image_url = clean_image_url(img_elem['src'], base_url)
-                                        if image_url and not image_url.endswith(('gif', 'svg')):  # Skip loading/placeholder images
-                                            break
-                            else:
-                                # Original image handling for earlier batches
-                                img_elem = card.select_one('img')
-                                if img_elem and 'src' in img_elem.attrs:
-                                    image_url = clean_image_url(img_elem['src'], base_url)
-                            
-                            # Get price with validation
-                            price_elem = card.select_one('.price, [class*="price"], span[class*="amount"]')
-                            if not price_elem or not price_elem.text.strip():
-                                logger.warning(f"Missing price for product {name} in batch {batch_num}")
-                                continue
-                                
-                            price = price_elem.text.strip()
-                            
-                            product = {
-                                "name": name,
-                                "image_url": image_url,
-                                "product_url": url,
-                                "price": price,
-                                "batch": batch_num,
-                                "vendor": "s-craft",
-                                "scraped_at": datetime.utcnow().isoformat()
-                            }
-                            
-                            logger.debug(f"Extracted product: {product}")
-                            all_products.append(product)
-                            
-                        except Exception as e:
-                            logger.error(f"Error parsing product card in batch {batch_num}, page {page}: {str(e)}")
-                            continue
-                    
-                except requests.RequestException as e:
-                    logger.error(f"Error fetching batch {batch_num}, page {page}: {str(e)}")
-                    continue
-                except Exception as e:
-                    logger.error(f"Unexpected error processing batch {batch_num}, page {page}: {str(e)}")
+            # Skip if name is missing, just whitespace or "Unknown Product"
+            if not name:
+                logger.warning(f"Skipping product with missing name in batch {batch_num}, page {page}")
+                continue
+            if name == "Unknown Product":
+                logger.warning(f"Skipping invalid product name in batch {batch_num}, page {page}")
+                continue
+            
+            # Take the first image selector whose src is not a loading/placeholder image
+            image_url = None
+            for src in card["image_srcs"]:
+                if src is None:
                     continue
+                image_url = clean_image_url(src, base_url)
+                if not image_fallbacks or (image_url and not image_url.endswith(('gif', 'svg'))):
+                    break
+            
+            records.append({"name": name, "image_url": image_url, "price": card["price"] or None})
+            
+        except Exception as e:
+            logger.error(f"Error parsing product card in batch {batch_num}, page {page}: {str(e)}")
+            continue
+    
+    return records, extracted["links"]
+
+def _build_products(records: List[Dict], vendor: str, batch_num: int, page: int, url: str,
+                    seen_products: set, default_currency: str = DEFAULT_CURRENCY) -> List[Dict]:
+    """Turn page records into product dicts, skipping duplicates within a batch.
+
+    Prices are parsed into currency and integer minor units (price_amount,
+    None if the text has no number) next to the raw price text.
+    """
+    products = []
+    for record in records:
+        name = record["name"]
         
-        logger.info(f"Successfully scraped {len(all_products)} unique products across all batches")
-        return all_products
+        # Create unique identifier for product (name + batch)
+        product_id = f"{name}_{batch_num}"
         
-    except Exception as e:
-        logger.error(f"Critical error in scraper: {str(e)}")
-        return []
+        # Skip if we've already seen this product in this batch
+        if product_id in seen_products:
+            debug_sampled(logger, "scraper.duplicate", "Skipping duplicate product: %s in batch %d", name, batch_num)
+            continue
+        seen_products.add(product_id)
+        
+        if not record["price"]:
+            logger.warning(f"Missing price for product {name} in batch {batch_num}")
+            continue
+        
+        parsed_price = parse_price(record["price"], default_currency)
+        product = {
+            "name": name,
+            "image_url": record["image_url"],
+            "thumbnail_url": None,  # Filled in for the whole batch by _finish_batch
+            "product_url": url,
+            "price": record["price"],
+            "price_amount": parsed_price["amount"] if parsed_price else None,
+            "currency": parsed_price["currency"] if parsed_price else None,
+            "batch": batch_num,
+            "vendor": vendor,
+            "scraped_at": datetime.utcnow().isoformat()
+        }
+        
+        debug_sampled(logger, "scraper.product", "Extracted product: %s", product)
+        products.append(product)
+    
+    return products
 
 # For testing the scraper directly
 if __name__ == "__main__":
-    products = scrape_s_craft()
+    configure_logging()
+    products = scrape_vendor(DEFAULT_VENDOR)
     print(f"Found {len(products)} products")
     for product in products[:5]:  # Print first 5 products as sample
         print(product)
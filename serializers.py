@@ -0,0 +1,297 @@
+from typing import Dict, List, Optional, Tuple, Iterable, Iterator, AsyncIterable, AsyncIterator
+from bson.objectid import ObjectId
+from datetime import datetime, timezone
+import io
+import csv
+import json
+from metrics import timed
+from images import proxy_urls
+from prices import parse_price, DEFAULT_CURRENCY
+from vendors import get_vendor
+
+# Request parsing and response bodies shared by the Flask (app.py) and ASGI (asgi.py) apps
+
+# Largest page of keycaps returned by one request
+MAX_PAGE_SIZE = 500
+
+# Columns written by CSV export unless fields is given
+EXPORT_FIELDS = ['_id', 'name', 'vendor', 'notes']
+
+def parse_keycap_query(args) -> Tuple[Optional[Dict], Optional[str]]:
+    """Validate the /api/keycaps query string, returning the parsed options or an error message."""
+    after = args.get('after')
+    limit = args.get('limit')
+    fields = args.get('fields')
+    output_format = args.get('format', 'json')
+
+    if after and not ObjectId.is_valid(after):
+        return None, "Invalid after cursor"
+    if limit is not None:
+        if not limit.isdigit() or int(limit) < 1:
+            return None, "limit must be a positive integer"
+        limit = min(int(limit), MAX_PAGE_SIZE)
+    if output_format not in ('json', 'ndjson'):
+        return None, "format must be json or ndjson"
+    return {
+        "vendor": args.get('vendor'),
+        "after": after,
+        "limit": limit,
+        "fields": parse_fields(fields),
+        "format": output_format
+    }, None
+
+def parse_export_query(args) -> Tuple[Optional[Dict], Optional[str]]:
+    """Validate the /api/keycaps/export query string, returning the parsed options or an error message."""
+    output_format = args.get('format', 'ndjson')
+    if output_format not in ('ndjson', 'csv'):
+        return None, "format must be ndjson or csv"
+    return {"vendor": args.get('vendor'), "fields": parse_fields(args.get('fields')), "format": output_format}, None
+
+def parse_compare_query(args) -> Tuple[Optional[Dict], Optional[str]]:
+    """Validate the /api/compare offset and limit, returning them or an error message."""
+    offset = args.get('offset', '0')
+    limit = args.get('limit')
+    if not offset.isdigit() or (limit is not None and (not limit.isdigit() or int(limit) < 1)):
+        return None, "offset and limit must be positive integers"
+    return {"offset": int(offset), "limit": int(limit) if limit else None}, None
+
+def parse_changes_query(args) -> Tuple[Optional[Dict], Optional[str]]:
+    """Validate the /api/drops/changes limit, returning it or an error message."""
+    limit = args.get('limit', '10')
+    if not limit.isdigit() or int(limit) < 1:
+        return None, "limit must be a positive integer"
+    return {"limit": int(limit)}, None
+
+def keycap_error(data) -> Optional[str]:
+    """Check a keycap posted to /api/keycaps, returning an error message if it cannot be added."""
+    if not data:
+        return "No data provided"
+    if not data.get('name') or not data.get('vendor'):
+        return "Name and vendor are required"
+    return None
+
+def parse_history_query(args) -> Tuple[Optional[Dict], Optional[str]]:
+    """Validate the price history query string, returning the parsed options or an error message.
+
+    start and end are ISO 8601 times; ones with an offset are converted to
+    the naive UTC times stored in the database.
+    """
+    bounds = {}
+    for name in ('start', 'end'):
+        value = args.get(name)
+        if value is None:
+            bounds[name] = None
+            continue
+        try:
+            parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None, f"{name} must be an ISO 8601 time"
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        bounds[name] = parsed
+    batch = args.get('batch')
+    if batch is not None:
+        if not batch.isdigit():
+            return None, "batch must be a non-negative integer"
+        batch = int(batch)
+    if bounds['start'] and bounds['end'] and bounds['start'] > bounds['end']:
+        return None, "start must not be after end"
+    return {"start": bounds['start'], "end": bounds['end'], "batch": batch}, None
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Split a comma-separated fields parameter."""
+    return [f.strip() for f in fields.split(',') if f.strip()] if fields else None
+
+def serialize_keycap(keycap: dict) -> str:
+    """Serialize one keycap document, converting ObjectId to string."""
+    with timed("serialize_keycap"):
+        keycap['_id'] = str(keycap['_id'])
+        return json.dumps(keycap, default=str)
+
+class KeycapJson:
+    """Format keycaps as a JSON array, or as a page with a next cursor when limit is set."""
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self._count = 0
+        self._last_id = None
+        self._next_after = None
+
+    def start(self) -> str:
+        return '{"items":[' if self.limit else '['
+
+    def item(self, keycap: Dict) -> Optional[str]:
+        """Format one keycap, or return None once the page is full."""
+        if self.limit and self._count == self.limit:
+            self._next_after = self._last_id
+            return None
+        self._last_id = str(keycap['_id'])
+        text = (',' if self._count else '') + serialize_keycap(keycap)
+        self._count += 1
+        return text
+
+    def end(self) -> str:
+        if self.limit:
+            return '],"next_after":' + json.dumps(self._next_after) + '}'
+        return ']'
+
+class KeycapNdjson:
+    """Format keycaps as newline-delimited JSON; page with the last line's _id."""
+
+    def __init__(self, limit: Optional[int] = None):
+        self.limit = limit
+        self._count = 0
+
+    def start(self) -> str:
+        return ''
+
+    def item(self, keycap: Dict) -> Optional[str]:
+        if self.limit and self._count == self.limit:
+            return None
+        self._count += 1
+        return serialize_keycap(keycap) + '\n'
+
+    def end(self) -> str:
+        return ''
+
+class ExportNdjson:
+    """Format exported keycaps one per line, without internal fields."""
+
+    def start(self) -> str:
+        return ''
+
+    def item(self, keycap: Dict) -> str:
+        keycap.pop('name_normalized', None)
+        return serialize_keycap(keycap) + '\n'
+
+    def end(self) -> str:
+        return ''
+
+class CsvRows:
+    """Format keycaps as CSV text one row at a time."""
+
+    def __init__(self, fields: List[str]):
+        self._buffer = io.StringIO()
+        self._writer = csv.DictWriter(self._buffer, fieldnames=fields, extrasaction='ignore')
+
+    def _take(self) -> str:
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return text
+
+    def start(self) -> str:
+        self._writer.writeheader()
+        return self._take()
+
+    def item(self, keycap: Dict) -> str:
+        keycap['_id'] = str(keycap['_id'])
+        self._writer.writerow(keycap)
+        return self._take()
+
+    def end(self) -> str:
+        return ''
+
+def keycap_writer(output_format: str, limit: Optional[int]):
+    """Pick the /api/keycaps body format: json or ndjson."""
+    return KeycapNdjson(limit) if output_format == 'ndjson' else KeycapJson(limit)
+
+def export_writer(output_format: str, fields: Optional[List[str]]):
+    """Pick the export body format: ndjson or csv with the given columns."""
+    return CsvRows(fields or EXPORT_FIELDS) if output_format == 'csv' else ExportNdjson()
+
+def stream_rows(writer, keycaps: Iterable[Dict]) -> Iterator[str]:
+    """Stream keycaps through a writer (KeycapJson, KeycapNdjson, ExportNdjson or CsvRows)."""
+    text = writer.start()
+    if text:
+        yield text
+    for keycap in keycaps:
+        text = writer.item(keycap)
+        if text is None:
+            break
+        yield text
+    text = writer.end()
+    if text:
+        yield text
+
+async def stream_rows_async(writer, keycaps: AsyncIterable[Dict]) -> AsyncIterator[str]:
+    """stream_rows for keycaps read on the event loop."""
+    text = writer.start()
+    if text:
+        yield text
+    async for keycap in keycaps:
+        text = writer.item(keycap)
+        if text is None:
+            break
+        yield text
+    text = writer.end()
+    if text:
+        yield text
+
+def parse_import_rows(stream, input_format: str) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """Yield (row number, keycap, error) for each row of an NDJSON or CSV upload."""
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if input_format == 'csv' else None)
+    if input_format == 'csv':
+        reader = csv.DictReader(text)
+        for data in reader:
+            # Empty cells leave the field unset rather than clearing it
+            yield reader.line_num, {key: value for key, value in data.items() if key and value}, None
+        return
+
+    for row, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield row, None, f"Invalid JSON: {str(e)}"
+            continue
+        if not isinstance(data, dict):
+            yield row, None, "Each line must be a JSON object"
+            continue
+        yield row, data, None
+
+def valid_import_rows(stream, input_format: str, errors: List[Dict]) -> Iterator[Tuple[int, Dict]]:
+    """Yield the valid (row number, keycap) pairs of an upload, collecting the rest in errors."""
+    # Parse the body as it streams in, passing invalid rows to the error report
+    for row, data, error in parse_import_rows(stream, input_format):
+        if error is None and (not data.get('name') or not data.get('vendor')):
+            error = "Name and vendor are required"
+        elif error is None and not isinstance(data['name'], str):
+            error = "Name must be a string"
+        if error is not None:
+            errors.append({"row": row, "error": error})
+        else:
+            yield row, data
+
+def import_format(requested: Optional[str], mimetype: str) -> Optional[str]:
+    """Pick the import format from the format parameter or the upload's content type."""
+    if requested is None:
+        requested = 'csv' if mimetype in ('text/csv', 'application/csv') else 'ndjson'
+    return requested if requested in ('ndjson', 'csv') else None
+
+def with_prices(drops: List[Dict], vendor: str) -> List[Dict]:
+    """Fill in parsed prices (price_amount, currency) for drops stored before scrapes carried them."""
+    if all("price_amount" in drop for drop in drops):
+        return drops
+    default_currency = get_vendor(vendor).get("currency", DEFAULT_CURRENCY)
+    filled = []
+    for drop in drops:
+        if "price_amount" not in drop:
+            parsed = parse_price(drop.get("price"), default_currency)
+            drop = {**drop, "price_amount": parsed["amount"] if parsed else None,
+                    "currency": parsed["currency"] if parsed else None}
+        filled.append(drop)
+    return filled
+
+def with_thumbnails(drops: List[Dict]) -> List[Dict]:
+    """Fill in proxied image URLs, registering every drop's image in one registry save.
+
+    Covers drops stored before scrapes carried thumbnail URLs and images whose
+    registry entry was dropped when the image cache evicted their download.
+    """
+    thumbnails = proxy_urls(drop.get("image_url") for drop in drops)
+    return [
+        {**drop, "thumbnail_url": thumbnails[drop["image_url"]]} if drop.get("image_url") else drop
+        for drop in drops
+    ]
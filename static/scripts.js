@@ -16,25 +16,48 @@ const collectionTable = document.getElementById('collection-table').querySelecto
 const addKeycapForm = document.getElementById('add-keycap-form');
 
 // Load collection
+const COLLECTION_PAGE_SIZE = 100;
+
 async function loadCollection() {
     try {
         console.log('Starting to load collection...');
-        const response = await fetch('/api/keycaps?vendor=S-Craft');
-        console.log('API Response status:', response.status);
-        
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
+        let after = null;
+        let firstPage = true;
         
-        const keycaps = await response.json();
-        console.log('Received keycaps data:', keycaps);
-        
-        if (!Array.isArray(keycaps)) {
-            console.error('Received data is not an array:', keycaps);
-            throw new Error('Invalid data format received from server');
-        }
-        
-        renderCollection(keycaps);
+        // Page through the collection using the server's keyset cursor
+        do {
+            const params = new URLSearchParams({
+                vendor: 'S-Craft',
+                limit: COLLECTION_PAGE_SIZE,
+                fields: 'name,vendor,notes',
+            });
+            if (after) {
+                params.set('after', after);
+            }
+            
+            const response = await fetch(`/api/keycaps?${params}`);
+            console.log('API Response status:', response.status);
+            
+            if (!response.ok) {
+                throw new Error(`HTTP error! status: ${response.status}`);
+            }
+            
+            const page = await response.json();
+            console.log('Received keycaps page:', page);
+            
+            if (!page || !Array.isArray(page.items)) {
+                console.error('Received data is not a page of keycaps:', page);
+                throw new Error('Invalid data format received from server');
+            }
+            
+            if (firstPage) {
+                renderCollection(page.items);
+                firstPage = false;
+            } else {
+                appendKeycapRows(page.items);
+            }
+            after = page.next_after;
+        } while (after);
     } catch (error) {
         console.error('Error loading collection:', error);
         showError('Failed to load collection. Please try again later.');
@@ -44,7 +67,6 @@ async function loadCollection() {
 // Render collection
 function renderCollection(keycaps) {
     console.log('Starting to render collection...');
-    console.log('Keycaps to render:', keycaps);
     
     collectionTable.innerHTML = '';
     if (!keycaps || keycaps.length === 0) {
@@ -55,9 +77,13 @@ function renderCollection(keycaps) {
         return;
     }
     
+    appendKeycapRows(keycaps);
+}
+
+// Append a page of keycaps to the collection table
+function appendKeycapRows(keycaps) {
     console.log(`Rendering ${keycaps.length} keycaps`);
-    keycaps.forEach((keycap, index) => {
-        console.log(`Rendering keycap ${index + 1}:`, keycap);
+    keycaps.forEach(keycap => {
         const row = document.createElement('tr');
         row.innerHTML = `
             <td>${keycap.name || ''}</td>
@@ -144,61 +170,161 @@ async function deleteKeycap(id) {
 const dropsTable = document.getElementById('drops-table').querySelector('tbody');
 const scrapeBtn = document.getElementById('scrape-btn');
 const compareBtn = document.getElementById('compare-btn');
+const addMissingBtn = document.getElementById('add-missing-btn');
 
 let currentDrops = [];  // Store the current drops data
+const THUMBNAIL_WIDTHS = [160, 320, 640];  // Widths served by /img/<hash>
+const dropsByKey = new Map();  // name_batch -> drop, matching the server's product key
+const dropRows = new Map();  // name_batch -> table row
+let dropsStream = null;
+
+function dropKey(drop) {
+    return `${drop.name}_${drop.batch}`;
+}
 
 // Load drops
 async function loadDrops(forceScrape = false) {
+    // Later changes arrive as events instead of by polling
+    openDropsStream();
     try {
         const response = await fetch(`/api/drops${forceScrape ? '?force=true' : ''}`);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         const drops = await response.json();
-        currentDrops = drops;  // Store the drops data
         renderDrops(drops);
+        return response.headers.get('X-Refresh-Running') === 'true';
     } catch (error) {
         console.error('Error loading drops:', error);
         showError('Failed to load drops. Please try again later.');
+        return false;
+    }
+}
+
+// Subscribe to scrape progress and drop changes; EventSource reconnects by itself
+function openDropsStream() {
+    if (dropsStream) {
+        return;
     }
+    dropsStream = new EventSource('/api/drops/stream');
+    
+    dropsStream.addEventListener('progress', event => {
+        const progress = JSON.parse(event.data);
+        scrapeBtn.textContent = `Scraping... ${progress.batches_done}/${progress.batches_total} batches`;
+        // Show each batch's products as soon as it is scraped
+        progress.products.forEach(upsertDrop);
+        syncCurrentDrops();
+    });
+    
+    dropsStream.addEventListener('drops', event => {
+        const delta = JSON.parse(event.data);
+        console.log(`Drops changed: ${delta.added.length} added, ${delta.changed.length} changed, ${delta.removed.length} removed`);
+        delta.removed.forEach(removeDrop);
+        delta.changed.forEach(upsertDrop);
+        delta.added.forEach(upsertDrop);
+        syncCurrentDrops();
+    });
+    
+    dropsStream.addEventListener('scrape', event => {
+        const scrape = JSON.parse(event.data);
+        if (scrape.status === 'started') {
+            setScraping(true);
+        } else {
+            setScraping(false);
+            if (scrape.status === 'failed') {
+                showError('Failed to scrape drops. Please try again later.');
+            }
+        }
+    });
+}
+
+function setScraping(running) {
+    scrapeBtn.disabled = running;
+    scrapeBtn.textContent = running ? 'Scraping...' : 'Scrape Latest Drops';
 }
 
 // Render drops
 function renderDrops(drops) {
     dropsTable.innerHTML = '';
-    if (!drops || drops.length === 0) {
-        const row = document.createElement('tr');
-        row.innerHTML = '<td colspan="4" class="no-data">No drops available</td>';
-        dropsTable.appendChild(row);
+    dropsByKey.clear();
+    dropRows.clear();
+    drops.forEach(upsertDrop);
+    syncCurrentDrops();
+}
+
+// Add or update one drop's row, keeping rows in batch order
+function upsertDrop(drop) {
+    const key = dropKey(drop);
+    const existing = dropsByKey.get(key);
+    drop = existing ? { ...existing, ...drop } : drop;
+    dropsByKey.set(key, drop);
+    
+    const cells = `
+        <td>${drop.name}</td>
+        <td>${renderDropImage(drop)}</td>
+        <td>Batch ${drop.batch}</td>
+        <td>${drop.price}</td>
+    `;
+    const row = dropRows.get(key);
+    if (row) {
+        // Only the price and image change between scrapes
+        if (existing.price !== drop.price || existing.image_url !== drop.image_url) {
+            row.innerHTML = cells;
+        }
         return;
     }
     
-    drops.forEach(drop => {
+    const newRow = document.createElement('tr');
+    newRow.innerHTML = cells;
+    dropRows.set(key, newRow);
+    const next = Array.from(dropsTable.rows).find(other => Number(other.dataset.batch) > drop.batch);
+    newRow.dataset.batch = drop.batch;
+    dropsTable.insertBefore(newRow, next || null);
+}
+
+function removeDrop(drop) {
+    const key = dropKey(drop);
+    const row = dropRows.get(key);
+    if (row) {
+        row.remove();
+    }
+    dropRows.delete(key);
+    dropsByKey.delete(key);
+}
+
+// Keep currentDrops and the empty-table message in step with the rows
+function syncCurrentDrops() {
+    currentDrops = Array.from(dropsByKey.values());
+    const placeholder = dropsTable.querySelector('.no-data');
+    if (currentDrops.length && placeholder) {
+        placeholder.parentElement.remove();
+    } else if (!currentDrops.length && !placeholder) {
         const row = document.createElement('tr');
-        row.innerHTML = `
-            <td>${drop.name}</td>
-            <td>${drop.image_url ? `<img src="${drop.image_url}" alt="${drop.name}" loading="lazy">` : 'No image'}</td>
-            <td>Batch ${drop.batch}</td>
-            <td>${drop.price}</td>
-        `;
+        row.innerHTML = '<td colspan="4" class="no-data">No drops available</td>';
         dropsTable.appendChild(row);
-    });
+    }
+}
+
+// Thumbnails come from the server's image proxy; fall back to the source URL
+function renderDropImage(drop) {
+    if (drop.thumbnail_url) {
+        const srcset = THUMBNAIL_WIDTHS.map(w => `${drop.thumbnail_url}?w=${w} ${w}w`).join(', ');
+        return `<img src="${drop.thumbnail_url}?w=160" srcset="${srcset}" sizes="100px" alt="${drop.name}" loading="lazy" decoding="async">`;
+    }
+    if (drop.image_url) {
+        return `<img src="${drop.image_url}" alt="${drop.name}" loading="lazy">`;
+    }
+    return 'No image';
 }
 
 // Scrape latest drops
 scrapeBtn.addEventListener('click', async () => {
-    scrapeBtn.disabled = true;
-    scrapeBtn.textContent = 'Scraping...';
+    setScraping(true);
     
-    try {
-        await loadDrops(true);  // Force new scrape
-        scrapeBtn.textContent = 'Scrape Latest Drops';
-    } catch (error) {
-        console.error('Error scraping drops:', error);
-        showError('Failed to scrape drops. Please try again later.');
-        scrapeBtn.textContent = 'Scrape Latest Drops';
-    } finally {
-        scrapeBtn.disabled = false;
+    // Force new scrape; the stream re-enables the button when it finishes
+    const running = await loadDrops(true);
+    if (!running) {
+        setScraping(false);
     }
 });
 
@@ -255,8 +381,14 @@ compareBtn.addEventListener('click', async () => {
             
             if (isMissing) {
                 row.classList.add('missing');
+                row.title = '';
             } else {
                 row.classList.remove('missing');
+                // Show which collection entry a fuzzy match came from
+                const match = comparison.matches.find(item => item.name.toLowerCase() === name);
+                row.title = match && match.confidence < 1
+                    ? `Matched "${match.matched_name}" (${Math.round(match.confidence * 100)}% confidence)`
+                    : '';
             }
         });
         
@@ -267,6 +399,36 @@ compareBtn.addEventListener('click', async () => {
     }
 });
 
+// Add every missing drop to the collection in one request
+addMissingBtn.addEventListener('click', async () => {
+    if (!confirm('Add all drops missing from your collection?')) {
+        return;
+    }
+    addMissingBtn.disabled = true;
+    
+    try {
+        const response = await fetch('/api/keycaps/add-missing', { method: 'POST' });
+        if (!response.ok) {
+            const error = await response.json();
+            throw new Error(error.error || 'Failed to add missing drops');
+        }
+        
+        const result = await response.json();
+        console.log('Add missing result:', result);
+        if (result.errors.length) {
+            showError(`Added ${result.inserted} keycaps, ${result.errors.length} failed`);
+        }
+        
+        await loadCollection();
+        document.querySelectorAll('#drops-table tr.missing').forEach(row => row.classList.remove('missing'));
+    } catch (error) {
+        console.error('Error adding missing drops:', error);
+        showError(error.message);
+    } finally {
+        addMissingBtn.disabled = false;
+    }
+});
+
 // Show error message
 function showError(message) {
     // You can implement a more sophisticated error display here
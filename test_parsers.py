@@ -0,0 +1,64 @@
+"""Pin the card records every parser backend extracts from the saved fixtures.
+
+Run with `python -m pytest`. Backends that are not installed (lxml) are skipped.
+"""
+import os
+
+import pytest
+
+from parsers import BACKENDS, CompiledSelectors, extract_cards
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+ALL_BACKENDS = ["lxml", "html.parser", "reference"]
+
+def card(name, price, src, fallback_srcs=None):
+    """Expected record; fallback_srcs are the srcs for every image selector, src alone is the plain 'img' match."""
+    return {"name": name, "price": price, "image_srcs": [src], "fallback_srcs": fallback_srcs or [None] * 4 + [src]}
+
+EXPECTED = {
+    "group_buy_basic.html": [
+        card("Pikachu Artisan", "$45.00", "/uploads/pikachu.jpg?w=600"),
+        card("Eevee & Friends", "$52.00", "https://cdn.s-craft.studio/uploads/eevee.png"),
+        card("Snorlax Sleeping", "", "/uploads/snorlax.jpg"),  # Sold out, no price element
+        card("Snorlax Sleeping", "$60.00", "/uploads/snorlax-alt.jpg"),
+        card("Bulbasaur Moss", "$38.00", None),  # img without src
+        card("", "$10.00", None),  # Blank name, no image
+        card("Unknown Product", "$10.00", None),
+        # div.product-card and the div.product nested in it are both cards
+        card("Nested Inner", "$20.00", "/uploads/nested-inner.jpg"),
+        card("Nested Inner", "$20.00", "/uploads/nested-inner.jpg"),
+        card("Charmander Flame", "$41.00", ""),  # Empty src is kept as ""
+    ],
+    # No card matches the primary selectors, so the alternative ones are used
+    "group_buy_lazy_images.html": [
+        card("Mewtwo Psystrike", "$75.00", "/assets/loading.gif",
+             [None, "/uploads/mewtwo.webp?v=3", None, "/uploads/mewtwo.webp?v=3", "/assets/loading.gif"]),
+        card("Gengar Shadow", "$68.00", "/assets/spinner.svg",
+             ["/assets/spinner.svg", None, "/assets/spinner.svg", None, "/assets/spinner.svg"]),
+        card("Only Placeholder", "$30.00", "/assets/loading.gif"),
+        card("Lapras Wave", "$55.00", None),  # First img and img.main-image only have data-src
+        card("Jigglypuff Song", "$40.00", "/uploads/jigglypuff.jpg"),
+    ],
+}
+
+def _load(filename: str) -> str:
+    with open(os.path.join(FIXTURE_DIR, filename), 'r') as f:
+        return f.read()
+
+@pytest.mark.parametrize("backend", ALL_BACKENDS)
+@pytest.mark.parametrize("filename", sorted(EXPECTED))
+@pytest.mark.parametrize("image_fallbacks", [False, True])
+def test_backend_extracts_pinned_cards(backend, filename, image_fallbacks):
+    if backend != "reference" and backend not in BACKENDS:
+        pytest.skip(f"{backend} is not installed")
+    cards = extract_cards(_load(filename), CompiledSelectors(), image_fallbacks, backend)
+    expected = [{
+        "name": want["name"],
+        "price": want["price"],
+        "image_srcs": want["fallback_srcs"] if image_fallbacks else want["image_srcs"]
+    } for want in EXPECTED[filename]]
+    assert cards == expected
+
+def test_every_fixture_is_pinned():
+    fixtures = {filename for filename in os.listdir(FIXTURE_DIR) if filename.endswith('.html')}
+    assert fixtures == set(EXPECTED)
@@ -0,0 +1,61 @@
+"""Price parsing into currency and integer minor units, including drops stored before it.
+
+Run with `python -m pytest`.
+"""
+import pytest
+
+from db import _apply_delta, _diff_products
+from prices import parse_price, format_amount
+from serializers import with_prices
+
+@pytest.mark.parametrize("text, expected", [
+    ("$45.00", {"currency": "USD", "amount": 4500}),
+    ("$.99", {"currency": "USD", "amount": 99}),
+    (".99", {"currency": "USD", "amount": 99}),
+    ("€,5", {"currency": "EUR", "amount": 50}),
+    ("1.234,56 €", {"currency": "EUR", "amount": 123456}),
+    ("$1,234.56", {"currency": "USD", "amount": 123456}),
+    ("US$1,299.50", {"currency": "USD", "amount": 129950}),
+    ("45,00 €", {"currency": "EUR", "amount": 4500}),
+    ("1 299 EUR", {"currency": "EUR", "amount": 129900}),
+    ("$1,299", {"currency": "USD", "amount": 129900}),
+    ("¥1200", {"currency": "JPY", "amount": 1200}),
+    ("¥1,200", {"currency": "JPY", "amount": 1200}),
+    ("CA$52.5", {"currency": "CAD", "amount": 5250}),
+    ("$38.00 - $45.00", {"currency": "USD", "amount": 3800}),  # Ranges use the first price
+    ("SALE 45 GBP", {"currency": "GBP", "amount": 4500}),  # Only known currency codes count
+])
+def test_parse_price(text, expected):
+    assert parse_price(text) == expected
+
+def test_parse_price_uses_default_currency():
+    assert parse_price("1200", "JPY") == {"currency": "JPY", "amount": 1200}
+
+@pytest.mark.parametrize("text", [None, "", "Sold out", "$"])
+def test_parse_price_without_a_number(text):
+    assert parse_price(text) is None
+
+def test_format_amount():
+    assert format_amount(4500, "USD") == "45.00"
+    assert format_amount(99, "USD") == "0.99"
+    assert format_amount(1200, "JPY") == "1200"
+
+def test_snapshot_stored_before_parsing_is_rewritten():
+    # A checkpoint from before scrapes stored price_amount/currency
+    previous = [{"name": "Pikachu Artisan", "batch": 1, "price": "$.99", "image_url": "/a.jpg"}]
+    current = [{"name": "Pikachu Artisan", "batch": 1, "price": "$.99", "price_amount": 99,
+                "currency": "USD", "image_url": "/a.jpg", "thumbnail_url": None}]
+    delta = _diff_products(previous, current)
+    assert delta == {"added": [], "removed": [], "changed": current}
+    assert _apply_delta(previous, delta) == current
+    assert _diff_products(current, current) == {"added": [], "removed": [], "changed": []}
+
+def test_drops_stored_before_parsing_are_filled_on_read():
+    drops = [
+        {"name": "Old", "batch": 1, "price": "1.234,56 €"},
+        {"name": "New", "batch": 1, "price": "$45.00", "price_amount": 4500, "currency": "USD"},
+        {"name": "Unpriced", "batch": 1, "price": "TBA"},
+    ]
+    assert [(drop["price_amount"], drop["currency"]) for drop in with_prices(drops, "s-craft")] == [
+        (123456, "EUR"), (4500, "USD"), (None, None)
+    ]
@@ -0,0 +1,77 @@
+from typing import Dict, List
+import os
+
+# Vendor scraper registry. Adding a vendor is one config block:
+#   name                        Display name
+#   base_url                    Listing URL the page templates are built from
+#   page_url / next_page_url    URL templates for the first and later pages of a batch
+#                               ({base_url}, {batch_id} and {page} are filled in)
+#   batches                     Batch number -> {"id": vendor batch id, "pages": page count}
+#                               (page counts are a starting point; the scraper discovers the real ones)
+#   batch_id_pattern            Optional regex capturing batch ids from links on the index page;
+#                               new batches found there are scraped too
+#   skip_batch_ids              Batch ids linked from the index page that are never scraped
+#   index_url                   Page listing the batches (defaults to base_url)
+#   page_size                   Optional cards per full page, for sites without next-page links
+#   selectors                   Optional overrides for parsers' card/name/price/image selectors
+#                               (keys: card_selectors, name_selector, price_selector, image_selectors)
+#   image_fallbacks_from_batch  First batch that tries every image selector (None for never)
+#   max_workers                 Concurrent page fetches for this vendor
+#   min_request_interval        Seconds between requests to one of this vendor's hosts
+#   time_budget                 Seconds one scrape of this vendor may spend fetching (default SCRAPER_TIME_BUDGET)
+#   currency                    Currency of prices shown without a symbol or code (default USD)
+VENDORS = {
+    "s-craft": {
+        "name": "S-Craft",
+        "base_url": os.getenv('S_CRAFT_BASE_URL', "https://www.s-craft.studio/shop/group-buy"),
+        "page_url": "{base_url}?batch_id={batch_id}",
+        "next_page_url": "{base_url}?batch_id={batch_id}&page={page}",
+        "batch_id_pattern": r"[?&]batch_id=(\d+)",
+        # Linked from the index but left out of the batch list on purpose
+        "skip_batch_ids": [10, 11, 12, 13, 15, 16, 17, 19, 20],
+        "batches": {
+            1: {"id": 1, "pages": 1},
+            2: {"id": 2, "pages": 1},
+            3: {"id": 3, "pages": 1},
+            4: {"id": 4, "pages": 1},
+            5: {"id": 5, "pages": 1},
+            6: {"id": 6, "pages": 1},
+            7: {"id": 7, "pages": 1},
+            8: {"id": 8, "pages": 1},
+            9: {"id": 9, "pages": 1},
+            10: {"id": 14, "pages": 1},
+            11: {"id": 18, "pages": 2},
+            12: {"id": 21, "pages": 2}
+        },
+        "image_fallbacks_from_batch": 9,
+        "max_workers": 8,
+        "min_request_interval": 0.02,
+        "currency": "USD",
+    },
+}
+
+DEFAULT_VENDOR = "s-craft"
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.5",
+    "Connection": "keep-alive",
+}
+
+def get_vendor(vendor: str) -> Dict:
+    """Get a vendor's scraper config, raising KeyError for unknown vendors."""
+    return VENDORS[vendor]
+
+def list_vendors() -> List[str]:
+    """Get the keys of all registered vendors."""
+    return list(VENDORS)
+
+def register_vendor(vendor: str, config: Dict):
+    """Register or replace a vendor's scraper config."""
+    VENDORS[vendor] = config
+
+def page_url(config: Dict, batch_id, page: int, base_url: str = None) -> str:
+    """Build the URL for one page of a vendor batch."""
+    template = config["page_url"] if page == 1 else config["next_page_url"]
+    return template.format(base_url=base_url or config["base_url"], batch_id=batch_id, page=page)
@@ -0,0 +1,174 @@
+from typing import Dict, Iterator, AsyncIterator, List, Optional, Tuple
+import itertools
+import re
+import time
+import requests
+from images import HAS_PIL, IMAGE_SECURITY_HEADERS
+from metrics import observe, inc
+from scraper import get_last_scrape_stats
+from response_cache import response_cache, cache_key, etag_for, not_modified, negotiate, encoded_body, CACHE_CONTROL
+from vendors import DEFAULT_VENDOR, list_vendors
+
+# Request and response handling shared by the Flask (app.py) and ASGI
+# (asgi.py) apps. Both frameworks build on werkzeug's request and response
+# types, so helpers take the framework's request or response object and
+# each app keeps only its own (sync or async) calls to the database.
+
+# Proxied images never change under a given URL
+IMAGE_MAX_AGE = 365 * 24 * 3600
+IMAGE_HASH_RE = re.compile(r'^[0-9a-f]{32}$')
+IMAGE_ERRORS = (requests.RequestException, ValueError)  # Source image could not be fetched or read
+
+KEYCAP_MIMETYPES = {'json': 'application/json', 'ndjson': 'application/x-ndjson'}
+EXPORT_MIMETYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+def error(message: str, status: int = 400) -> Tuple[Dict, int]:
+    """JSON error body and status, returned as is from a route."""
+    return {"error": message}, status
+
+def server_error(logger, route: str, e: Exception) -> Tuple[Dict, int]:
+    """Log an unexpected route failure and describe it in a 500 response."""
+    logger.error(f"Error in {route}: {str(e)}")
+    return error(str(e), 500)
+
+def vendor_arg(request) -> Optional[str]:
+    """Get the vendor query parameter, or None if it names an unknown vendor."""
+    vendor = request.args.get('vendor', DEFAULT_VENDOR)
+    return vendor if vendor in list_vendors() else None
+
+def known_vendor(vendor: Optional[str]) -> bool:
+    """Check an optional vendor filter: None means every vendor."""
+    return vendor is None or vendor in list_vendors()
+
+def unknown_vendor() -> Tuple[Dict, int]:
+    return error(f"Unknown vendor, expected one of: {', '.join(list_vendors())}", 404)
+
+def record_request_metrics(request, response, start: Optional[float]):
+    """Record per-route latency and status counts for a request that started at start."""
+    if start is None:
+        return
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    observe("request_duration_seconds", time.perf_counter() - start,
+            help_text="Time to produce a response, per route", route=route, method=request.method)
+    inc("requests_total", help_text="Responses per route and status",
+        route=route, method=request.method, status=response.status_code)
+
+class CachedRequest:
+    """A request for a response cache key: its ETag, whether the client's copy is current and the cached entry.
+
+    The entry is only looked up when the client needs a body, so a 304 is
+    answered without touching the cache.
+    """
+
+    def __init__(self, key: Tuple, request):
+        self.key = key
+        self.etag = etag_for(key)
+        self.not_modified = not_modified(request.headers.get('If-None-Match'), self.etag)
+        self.entry = None if self.not_modified else response_cache.get(key)
+        self._accept_encoding = request.headers.get('Accept-Encoding')
+
+    @property
+    def answered(self) -> bool:
+        """Whether the response is a 304 or a cached body, with nothing to build."""
+        return self.not_modified or self.entry is not None
+
+    def store(self, body: bytes):
+        """Compress and cache a freshly built body."""
+        self.entry = response_cache.put(self.key, body)
+
+    def body(self) -> Tuple[bytes, Optional[str]]:
+        """Get the cached body in the encoding the client prefers, and that encoding."""
+        return encoded_body(self.entry, negotiate(self._accept_encoding))
+
+    def tee(self, chunks: Iterator[str]) -> Iterator[str]:
+        """Stream a body built on a miss, caching it for the next request."""
+        return response_cache.tee(self.key, chunks)
+
+    def tee_async(self, chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        return response_cache.tee_async(self.key, chunks)
+
+    def finish(self, response, encoding: Optional[str] = None):
+        """Add the validator and revalidation headers shared by cached responses."""
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['ETag'] = self.etag
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        response.vary.add('Accept-Encoding')
+        return response
+
+def keycaps_cache_key(query: Dict, version) -> Tuple:
+    """Key a /api/keycaps page by the collection version; every keycap write bumps it."""
+    return cache_key('/api/keycaps', version, **query)
+
+def compare_cache_key(vendor: str, query: Dict, scrape_id, version) -> Tuple:
+    """Key a /api/compare page by the latest scrape and the collection version."""
+    return cache_key('/api/compare', (scrape_id, version), vendor=vendor, offset=query["offset"], limit=query["limit"])
+
+def drops_cache_key(vendor: str, scrape_id) -> Tuple:
+    """Key /api/drops by the latest scrape; drops only change when a new one is stored."""
+    return cache_key('/api/drops', scrape_id, vendor=vendor)
+
+def first_checked(keycaps: Iterator[Dict]) -> Iterator[Dict]:
+    """Run the query before streaming so database errors still return a 500."""
+    first = next(keycaps, None)
+    return itertools.chain([first], keycaps) if first is not None else iter(())
+
+async def first_checked_async(keycaps: AsyncIterator[Dict]) -> AsyncIterator[Dict]:
+    """first_checked for a cursor read on the event loop."""
+    first = await anext(keycaps, None)
+
+    async def chained():
+        if first is None:
+            return
+        yield first
+        async for keycap in keycaps:
+            yield keycap
+
+    return chained()
+
+def export_headers(output_format: str) -> Dict[str, str]:
+    return {'Content-Disposition': f'attachment; filename=keycaps.{output_format}'}
+
+def refresh_wanted(request, age: Optional[float], interval: float) -> bool:
+    """Whether /api/drops should start a background scrape: forced, no data yet, or stale."""
+    return request.args.get('force', '').lower() == 'true' or age is None or age >= interval
+
+def drops_headers(response, age: Optional[float], refresh_running: bool):
+    """Report the data age and whether a refresh is running on a /api/drops response."""
+    response.headers['X-Data-Age'] = str(int(age)) if age is not None else ''
+    response.headers['X-Refresh-Running'] = 'true' if refresh_running else 'false'
+    return response
+
+def parse_image_request(url_hash: str, request) -> Optional[Dict]:
+    """Get the thumbnail width and format for /img/<url_hash>, or None if the request names no image."""
+    width = request.args.get('w')
+    if not IMAGE_HASH_RE.match(url_hash) or (width is not None and not width.isdigit()):
+        return None
+    image_format = request.args.get('format')
+    if image_format not in ('webp', 'jpeg'):
+        image_format = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    return {"width": int(width) if width else None, "format": image_format}
+
+def image_headers(response):
+    """Mark a served image immutable and unable to run as a page from our origin."""
+    response.cache_control.immutable = True
+    response.headers.update(IMAGE_SECURITY_HEADERS)
+    if HAS_PIL:
+        response.vary.add('Accept')
+    return response
+
+def event_stream_headers(response):
+    """Keep caches and proxies from holding back server-sent events."""
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+    return response
+
+def debug_scrape_body(vendor: str, drops: List[Dict]) -> Dict:
+    """Summarize a scrape run by /api/debug/scraper."""
+    return {
+        "status": "success",
+        "vendor": vendor,
+        "count": len(drops),
+        "cache": get_last_scrape_stats(vendor),
+        "drops": drops[:5]  # Return first 5 items for debugging
+    }